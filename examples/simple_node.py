@@ -6,6 +6,7 @@ from durand.object_dictionary import ObjectDictionary
 from durand.datatypes import DatatypeEnum
 from durand import MinimalNode, Variable
 from durand.network import CANBusNetwork
+from durand.services.sdo import FileDownloadHandler
 
 
 bus = can.Bus(interface='socketcan', channel='can0')
@@ -31,23 +32,10 @@ node.object_dictionary[0x2001] = data_var
 
 node.object_dictionary.update_callbacks[(0x2001, 0)].add(print)
 
-class MyDownloadHandler:
-    def __init__(self):
-        self._file = open('update.bin', 'wb')
-
-    def on_receive(self, data: bytes):
-        self._file.write(data)
-
-    def on_finish(self):
-        self._file.close()
-
-    def on_abort(self):
-        self._file.close()
-
 #define handler
 def download_callback(node, index, subindex, size):
     if index == 0x2001:
-        return MyDownloadHandler()
+        return FileDownloadHandler('update.bin', size)
 
     return None
 
@@ -1,6 +1,10 @@
+from collections import OrderedDict
 from enum import Enum
+import asyncio
+import itertools
 import logging
-from typing import List, Callable
+import threading
+from typing import List, Callable, Hashable, Optional, Set
 
 
 log = logging.getLogger(__name__)
@@ -16,17 +20,190 @@ class FailMode(Enum):
     )
 
 
+class OverflowPolicy(Enum):
+    DROP_OLDEST = 1  # the oldest pending entry is dropped
+    DROP_NEWEST = 2  # the new entry is dropped
+    COALESCE = 3  # pending entries with the same key are replaced by the newest one
+
+
+class AsyncCallbackQueue:
+    """Queue used to run coroutine callbacks on an event loop.
+
+    Coroutine functions registered in a CallbackHandler are not awaited in the
+    calling context (e.g. the CAN receive thread). Instead, the call is put into
+    this bounded queue and processed by a worker task on the event loop.
+
+    :param maxsize: maximum number of pending calls
+    :param policy: handling of pending calls when the queue is full. With
+                   OverflowPolicy.COALESCE a pending call for the same callback handler
+                   (e.g. the same multiplexor in the object dictionary) is replaced
+                   by the newer call.
+    :param loop: event loop used to run the callbacks (default is the running loop,
+                 so the queue has to be created in a coroutine when no loop is given)
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 64,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        loop=None,
+    ):
+        if maxsize < 1:
+            raise ValueError("maxsize has to be at least 1")
+
+        self._maxsize = maxsize
+        self._policy = policy
+        self._loop = asyncio.get_running_loop() if loop is None else loop
+
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._sequence = itertools.count()
+        self._worker_active = False
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, key: Hashable, callback: Callable, args=(), kwargs=None):
+        """Add a call of the coroutine function to the queue
+
+        :param key: key used to coalesce calls (only used with OverflowPolicy.COALESCE)
+        :param callback: coroutine function to be called
+        :param args: tuple with positional arguments for the callback
+        :param kwargs: dictionary with keyword arguments
+        """
+        if kwargs is None:
+            kwargs = {}
+
+        if self._policy != OverflowPolicy.COALESCE:
+            key = next(self._sequence)
+
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = (callback, args, kwargs)
+            elif len(self._pending) >= self._maxsize:
+                if self._policy == OverflowPolicy.DROP_NEWEST:
+                    log.debug("Async callback queue full, dropping newest call")
+                    return
+
+                log.debug("Async callback queue full, dropping oldest call")
+                self._pending.popitem(last=False)
+                self._pending[key] = (callback, args, kwargs)
+            else:
+                self._pending[key] = (callback, args, kwargs)
+
+            if self._worker_active:
+                return
+
+            # raises when the loop is closed, the worker is started on the next call
+            self._loop.call_soon_threadsafe(self._start_worker)
+            self._worker_active = True
+
+    def _start_worker(self):
+        self._loop.create_task(self._worker())
+
+    def _pop(self):
+        with self._lock:
+            if not self._pending:
+                self._worker_active = False
+                return None
+
+            return self._pending.popitem(last=False)[1]
+
+    async def _worker(self):
+        while True:
+            entry = self._pop()
+
+            if entry is None:
+                return
+
+            callback, args, kwargs = entry
+
+            try:
+                await callback(*args, **kwargs)
+            except Exception:
+                log.exception("Exception in coroutine callback")
+
+
+class AsyncQueueProvider:
+    def __init__(self):
+        self._queue: Optional[AsyncCallbackQueue] = None
+        self._default = False  # queue is created by the provider
+
+    def set(self, queue: AsyncCallbackQueue) -> None:
+        self._queue = queue
+        self._default = False
+
+    def get(self) -> AsyncCallbackQueue:
+        # the default queue is bound to the running loop of the caller, so it has
+        # to be created in a coroutine (done by CallbackHandler.add)
+        if self._queue is None or (self._default and self._queue.loop.is_closed()):
+            self._queue = AsyncCallbackQueue()
+            self._default = True
+
+        return self._queue
+
+
+async_queue_provider = AsyncQueueProvider()
+
+
+def get_async_queue() -> AsyncCallbackQueue:
+    return async_queue_provider.get()
+
+
+def set_async_queue(queue: AsyncCallbackQueue):
+    async_queue_provider.set(queue)
+
+
 class CallbackHandler:
-    def __init__(self, fail_mode: FailMode = FailMode.IGNORE):
+    """Container for callbacks called with the same arguments
+
+    Callbacks may be coroutine functions. Those are not awaited but handed over
+    to an AsyncCallbackQueue (default is the one provided by get_async_queue). As
+    the result is not awaited, coroutine functions are only allowed when the
+    fail mode is FailMode.IGNORE. Without a given queue, they have to be added
+    while the event loop is running, as the default queue is bound to it.
+    """
+
+    def __init__(
+        self,
+        fail_mode: FailMode = FailMode.IGNORE,
+        async_queue: AsyncCallbackQueue = None,
+    ):
         self._callbacks: List[Callable] = []
+        self._coroutine_functions: Set[Callable] = set()
         self._fail_mode = fail_mode
+        self._async_queue = async_queue
 
     def add(self, callback):
+        if asyncio.iscoroutinefunction(callback):
+            if self._fail_mode != FailMode.IGNORE:
+                raise ValueError(
+                    "Coroutine functions are only supported with FailMode.IGNORE"
+                )
+
+            if self._async_queue is None:
+                try:
+                    get_async_queue()  # bind the default queue to the running loop
+                except RuntimeError:
+                    raise ValueError(
+                        "Coroutine functions have to be added in a running event loop"
+                        " or with an AsyncCallbackQueue"
+                    ) from None
+
+            self._coroutine_functions.add(callback)
+
         self._callbacks.append(callback)
 
     def remove(self, callback):
         self._callbacks.remove(callback)
 
+        if callback not in self._callbacks:
+            self._coroutine_functions.discard(callback)
+
     def __contains__(self, callback):
         return callback in self._callbacks
 
@@ -35,7 +212,10 @@ class CallbackHandler:
 
         for callback in self._callbacks:
             try:
-                callback(*args, **kwargs)
+                if self._coroutine_functions and callback in self._coroutine_functions:
+                    self._put_async(callback, args, kwargs)
+                else:
+                    callback(*args, **kwargs)
             except Exception as exc:
                 if self._fail_mode == FailMode.LATE_FAIL and exception is None:
                     exception = exc
@@ -46,3 +226,13 @@ class CallbackHandler:
 
         if exception:
             raise exception
+
+    def _put_async(self, callback, args, kwargs):
+        try:
+            queue = self._async_queue
+            if queue is None:
+                queue = get_async_queue()
+            queue.put((id(self), callback), callback, args, kwargs)
+        except Exception:
+            # not a failure of the callback, but a missing or closed event loop
+            log.exception("Scheduling coroutine callback %r failed", callback)
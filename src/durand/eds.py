@@ -1,16 +1,43 @@
 from dataclasses import dataclass, fields
-from re import match
+from enum import IntEnum
+from re import match, fullmatch
 from datetime import datetime
-from typing import TYPE_CHECKING, Optional
-
-from durand.object_dictionary import Variable, Record
-from durand.datatypes import DatatypeEnum
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, Optional, Set, Tuple
+import functools
+import hashlib
+import io
+import logging
+import os
+import pickle
+import tempfile
+import zipfile
+
+from durand.object_dictionary import (
+    Variable,
+    Record,
+    Array,
+    ObjectDictionary,
+    TObject,
+)
+from durand.datatypes import DatatypeEnum, is_numeric, is_float
+from durand.scheduler import get_scheduler
+from durand.services.sdo.upload import IterableUploadHandler
 
 
 if TYPE_CHECKING:
     from durand.node import Node
 
 
+log = logging.getLogger(__name__)
+
+
+class StoreFormat(IntEnum):
+    """Format of the EDS provided via object 0x1021 (value of object 0x1022)"""
+
+    ASCII = 0
+    ZIP = 0x80  # manufacturer specific: zip archive (deflate) containing the EDS file
+
+
 @dataclass
 class FileInfo:
     FileName: str = "python_durand_device.eds"
@@ -116,6 +143,21 @@ class DeviceInfo:
 
 
 class EDS:
+    """Generator for the EDS file of a node
+
+    The descriptions of the objects are cached as encoded bytes. An object is
+    described again when it is added or replaced or one of its values is written
+    in the object dictionary (the current values are described). Changes not
+    visible to the object dictionary (e.g. modifying the name of a variable
+    afterwards) have to be announced via invalidate.
+
+    With StoreFormat.ZIP the compressed file is generated by the scheduler
+    (COMPRESS_DELAY seconds after a change of an object), so it is usually
+    available when requested. Written values are only compressed on request.
+    """
+
+    COMPRESS_DELAY = 1.0
+
     def __init__(self, node: "Node"):
         self._node = node
 
@@ -123,6 +165,20 @@ class EDS:
         self.device_info = DeviceInfo()
         self.comments = ""
 
+        self._object_cache: Dict[int, bytes] = {}
+        self._body_cache: Optional[bytes] = None
+        self._generation = 0  # incremented on every change
+
+        # update callbacks (one per index) registered for the described variables
+        self._value_callbacks: Dict[int, Callable] = {}
+        self._watched: Set[Tuple[int, int]] = set()
+
+        self._store_format = StoreFormat.ASCII
+        self._compressed_cache: Optional[Tuple[str, int, bytes]] = None
+        self._compress_handle = None
+
+        node.object_dictionary.change_callbacks.add(self.invalidate)
+
     replace_node_id = {
         (0x1014, None): 0x80,  # EMCY
         (0x1200, 1): 0x600,  # SDO Server COB Rx
@@ -137,8 +193,100 @@ class EDS:
         (0x1803, 1): 0x480,  # TPDO 4
     }
 
+    def invalidate(self, index: Optional[int] = None):
+        """Describe the object on the given index again (or all when index is None)
+
+        :param index: index of the changed object
+        """
+        self._generation += 1
+        self._body_cache = None
+
+        if index is None:
+            self._object_cache.clear()
+        else:
+            self._object_cache.pop(index, None)
+
+        self._schedule_compress()
+
+    def _watch(self, index: int, obj):
+        """Describe the object again when one of its values is written"""
+        callback = self._value_callbacks.get(index)
+
+        if callback is None:
+            callback = functools.partial(self._value_written, index)
+            self._value_callbacks[index] = callback
+
+        subindices = [0] if isinstance(obj, Variable) else [sub for sub, _ in obj]
+        update_callbacks = self._node.object_dictionary.update_callbacks
+
+        for subindex in subindices:
+            if (index, subindex) not in self._watched:
+                self._watched.add((index, subindex))
+                update_callbacks[(index, subindex)].add(callback)
+
+    def _value_written(self, index: int, _value):
+        # process data is written often, so the compression is not scheduled
+        self._generation += 1
+        self._body_cache = None
+        self._object_cache.pop(index, None)
+
+    def _schedule_compress(self):
+        if self._store_format == StoreFormat.ZIP and self._compress_handle is None:
+            self._compress_handle = get_scheduler().add(
+                self.COMPRESS_DELAY, self._precompress
+            )
+
     @property
-    def content(self):
+    def store_format(self) -> StoreFormat:
+        return self._store_format
+
+    @store_format.setter
+    def store_format(self, value: StoreFormat):
+        self._store_format = StoreFormat(value)
+        self._node.object_dictionary.write(0x1022, 0, int(value))
+        self._schedule_compress()
+
+    @property
+    def stored_data(self) -> bytes:
+        """EDS file in the selected store format (provided via object 0x1021)"""
+        if self._store_format == StoreFormat.ASCII:
+            return self.data
+
+        return self._compress()
+
+    def _precompress(self):
+        self._compress_handle = None
+        self._compress()
+
+    def _compress(self) -> bytes:
+        header = self._header()
+        generation = self._generation
+
+        cache = self._compressed_cache
+        if cache is not None and cache[:2] == (header, generation):
+            return cache[2]
+
+        data = header.encode() + self._body()
+
+        with io.BytesIO() as stream:
+            with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(self.file_info.FileName, data)
+
+            compressed = stream.getvalue()
+
+        self._compressed_cache = (header, generation, compressed)
+        return compressed
+
+    @property
+    def content(self) -> str:
+        return self.data.decode()
+
+    @property
+    def data(self) -> bytes:
+        """EDS file encoded as bytes"""
+        return self._header().encode() + self._body()
+
+    def _header(self) -> str:
         content = ""
 
         if self.comments:
@@ -151,23 +299,87 @@ class EDS:
         content += self.file_info.content
         content += self.device_info.content
 
+        return content
+
+    def iter_data(self) -> Iterator[bytes]:
+        """Generate the EDS file section by section (encoded as bytes)"""
+        yield self._header().encode()
+
+        body = self._body_cache
+
+        if body is not None:
+            yield body
+        else:
+            yield from self._iter_body()
+
+    def upload_handler(self, announce_size=True) -> IterableUploadHandler:
+        """Create an upload handler providing the EDS in the selected store format
+
+        :param announce_size: the size is announced to the client. Otherwise the
+                              data is generated while the upload is running.
+        :returns: upload handler used by SDO servers for object 0x1021
+        """
+        if self._store_format != StoreFormat.ASCII:
+            data = self._compress()
+            return IterableUploadHandler((data,), len(data))
+
+        if not announce_size:
+            return IterableUploadHandler(self.iter_data())
+
+        # references to the cached descriptions (without joining them)
+        parts = list(self.iter_data())
+        return IterableUploadHandler(parts, sum(len(part) for part in parts))
+
+    def _body(self) -> bytes:
+        body = self._body_cache
+
+        if body is not None:
+            return body
+
+        generation = self._generation
+
+        body = b"".join(self._iter_body())
+
+        if generation == self._generation:  # no change while generating
+            self._body_cache = body
+
+        return body
+
+    def _iter_body(self) -> Iterator[bytes]:
         objects = dict(self._node.object_dictionary)
 
         mandatory_objects = self.extract_objects(objects, (0x1000, 0x1001, 0x1018))
-        content += self.describe_section("MandatoryObjects", mandatory_objects)
-
         optional_indices = [
             index for index in objects if index < 0x2000 or index >= 0x6000
         ]
         optional_objects = self.extract_objects(objects, optional_indices)
-        content += self.describe_section("OptionalObjects", optional_objects)
 
-        content += self.describe_section("ManufacturerObjects", objects)
+        yield from self._iter_section("MandatoryObjects", mandatory_objects)
+        yield from self._iter_section("OptionalObjects", optional_objects)
+        yield from self._iter_section("ManufacturerObjects", objects)
 
-        return content
+    def _iter_section(self, name: str, objects: dict) -> Iterator[bytes]:
+        yield self.describe_section_header(name, objects).encode()
+
+        for index, obj in objects.items():
+            yield self._encode_object(index, obj)
+
+    def _encode_object(self, index: int, obj) -> bytes:
+        data = self._object_cache.get(index)
+
+        if data is None:
+            self._watch(index, obj)
+            generation = self._generation
+            data = self.describe_object(index, obj).encode()
+
+            if generation == self._generation:
+                self._object_cache[index] = data
+
+        return data
 
     @staticmethod
     def extract_objects(d: dict, indices: list) -> dict:
+        indices = set(indices)
         extracted_dict = {index: obj for index, obj in d.items() if index in indices}
         for index in indices:
             d.pop(index, None)
@@ -232,20 +444,263 @@ class EDS:
 
         return content
 
+    @staticmethod
+    def describe_section_header(name: str, objects: dict) -> str:
+        lines = [f"[{name}]", f"SupportedObjects={len(objects)}"]
+        lines += [f"{nr + 1}=0x{index:04X}" for nr, index in enumerate(objects)]
+        return "\n".join(lines) + "\n\n"
+
     def describe_section(self, name: str, objects: dict):
-        content = f"[{name}]\nSupportedObjects={len(objects)}\n"
+        content = [self.describe_section_header(name, objects)]
+        content += [self.describe_object(index, obj) for index, obj in objects.items()]
+        return "".join(content)
 
-        for obj_nr, index in enumerate(objects):
-            content += f"{obj_nr + 1}=0x{index:04X}\n"
 
-        content += "\n"
+class EDSProvider:
+    def __init__(self, node: "Node"):
+        self._node = node
 
-        for index, obj in objects.items():
-            content += self.describe_object(index, obj)
 
-        return content
+# version of the compiled cache format (increment when the parser is changed)
+CACHE_VERSION = 1
 
+TSection = Dict[str, str]
 
-class EDSProvider:
-    def __init__(self, node: "Node"):
-        self._node = node
+
+def _read_ini(content: str) -> Dict[str, TSection]:
+    """Read the sections of an INI file (section names and keys in lower case)"""
+    sections: Dict[str, TSection] = {}
+    section: TSection = {}
+
+    for line in content.splitlines():
+        line = line.strip()
+
+        if not line or line[0] in ";#":
+            continue
+
+        if line[0] == "[" and line[-1] == "]":
+            section = sections.setdefault(line[1:-1].strip().lower(), {})
+        elif "=" in line:
+            key, value = line.split("=", 1)
+            section[key.strip().lower()] = value.strip()
+
+    return sections
+
+
+def _parse_int(value: str, node_id: int) -> int:
+    result = 0
+
+    for term in value.replace(" ", "").split("+"):
+        if term.upper() == "$NODEID":
+            result += node_id
+        elif term[:2].lower() == "0x":
+            result += int(term, 16)
+        elif "." in term:  # scaled values are exported as float
+            result += int(float(term))
+        elif len(term) > 1 and term.startswith("0"):
+            result += int(term, 8)
+        else:
+            result += int(term)
+
+    return result
+
+
+def _parse_value(value: str, datatype: DatatypeEnum, node_id: int):
+    if is_float(datatype):
+        return float(value)
+
+    if is_numeric(datatype):
+        return _parse_int(value, node_id)
+
+    if datatype == DatatypeEnum.OCTET_STRING:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+
+    return value.encode()
+
+
+def _parse_variable(section: TSection, node_id: int) -> Variable:
+    datatype = DatatypeEnum(_parse_int(section["datatype"], 0))
+
+    access = section.get("accesstype", "rw").lower()
+    if access in ("rwr", "rww"):
+        access = "rw"
+
+    value = section.get("parametervalue", None) or section.get("defaultvalue", None)
+
+    minimum, maximum = None, None
+
+    if is_numeric(datatype):
+        parse = float if is_float(datatype) else lambda v: _parse_int(v, node_id)
+
+        if section.get("lowlimit", None):
+            minimum = parse(section["lowlimit"])
+        if section.get("highlimit", None):
+            maximum = parse(section["highlimit"])
+
+    return Variable(
+        datatype,
+        access,
+        value=None if value is None else _parse_value(value, datatype, node_id),
+        minimum=minimum,
+        maximum=maximum,
+        name=section.get("parametername", None),
+    )
+
+
+def _parse_object(
+    section: TSection, subsections: Dict[int, TSection], node_id: int
+) -> TObject:
+    object_type = _parse_int(section.get("objecttype", "0x7"), 0)
+    name = section.get("parametername", None)
+
+    if object_type == 0x7:
+        return _parse_variable(section, node_id)
+
+    if section.get("compactsubobj", None):
+        length = _parse_int(section["compactsubobj"], 0)
+        return Array(_parse_variable(section, node_id), length, name=name)
+
+    variables = {
+        subindex: _parse_variable(subsection, node_id)
+        for subindex, subsection in sorted(subsections.items())
+    }
+
+    entries = [variable for subindex, variable in variables.items() if subindex]
+    homogeneous = entries and all(v == entries[0] for v in entries[1:])
+
+    if object_type == 0x8 and homogeneous and max(variables) == len(entries):
+        # array with a shared variable for all entries
+        mutable = 0 in variables and variables[0].writable
+        return Array(entries[0], len(entries), mutable, name=name)
+
+    record = Record(name=name)
+
+    for subindex, variable in variables.items():
+        if subindex:
+            record[subindex] = variable
+
+    return record
+
+
+def parse_eds(content: str, node_id: Optional[int] = None) -> Dict[int, TObject]:
+    """Parse the objects described in an EDS or DCF file
+
+    DCF specific parameter values are used instead of the default values.
+    Expressions containing $NodeID are evaluated with the given node id (for a
+    DCF the node id of the [DeviceComissioning] section is used by default).
+
+    :param content: content of the EDS or DCF file
+    :param node_id: node id used for $NodeID expressions
+    :returns: dictionary with index as key and the Variable, Record or Array
+    """
+    parsed_sections = _read_ini(content)
+
+    if node_id is None:
+        commissioning = parsed_sections.get("devicecomissioning", {})
+        node_id = _parse_int(commissioning.get("nodeid", "0"), 0)
+
+    sections: Dict[int, TSection] = {}
+    subsections: Dict[int, Dict[int, TSection]] = {}
+
+    for name, section in parsed_sections.items():
+        name_match = fullmatch(r"([0-9a-f]{4})(?:sub([0-9a-f]+))?", name)
+
+        if not name_match:
+            continue
+
+        index = int(name_match.group(1), 16)
+
+        if name_match.group(2) is None:
+            sections[index] = section
+        else:
+            subindex = int(name_match.group(2), 16)
+            subsections.setdefault(index, {})[subindex] = section
+
+    objects = {}
+
+    for index, section in sorted(sections.items()):
+        try:
+            objects[index] = _parse_object(section, subsections.get(index, {}), node_id)
+        except (KeyError, ValueError) as exc:
+            log.warning("Object 0x%04X in EDS not supported: %r", index, exc)
+
+    return objects
+
+
+def load_eds(
+    path: str,
+    node_id: Optional[int] = None,
+    od: Optional[ObjectDictionary] = None,
+    cache_dir: Optional[str] = None,
+) -> ObjectDictionary:
+    """Build an object dictionary from an EDS or DCF file
+
+    Objects provided by the services of a node (e.g. PDO parameters) are replaced
+    when the object dictionary is used for a Node.
+
+    When cache_dir is given, the parsed objects are stored there in a compiled
+    (pickled) form, keyed by the hash of the file and the node id. Loading the
+    same file again is only unpickling the objects. The cache directory has to
+    be trusted, as loading a pickle may execute code.
+
+    :param path: path of the EDS or DCF file
+    :param node_id: node id used for $NodeID expressions
+    :param od: object dictionary the objects are added to (default is a new one)
+    :param cache_dir: directory for the compiled cache (None to disable)
+    :returns: the object dictionary
+    """
+    with open(path, "rb") as eds_file:
+        data = eds_file.read()
+
+    objects = None
+    cache_path = None
+
+    if cache_dir is not None:
+        key = hashlib.sha256(data)
+        key.update(f"{node_id}:{CACHE_VERSION}".encode())
+        cache_path = os.path.join(cache_dir, key.hexdigest() + ".pickle")
+
+        try:
+            with open(cache_path, "rb") as cache_file:
+                objects = pickle.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            log.warning("Compiled EDS cache %s invalid", cache_path, exc_info=True)
+
+    if objects is None:
+        try:
+            content = data.decode()
+        except UnicodeDecodeError:
+            content = data.decode("latin-1")
+
+        objects = parse_eds(content, node_id)
+
+        if cache_path is not None:
+            _write_cache(cache_path, objects)
+
+    od = ObjectDictionary() if od is None else od
+
+    for index, obj in objects.items():
+        od[index] = obj
+
+    return od
+
+
+def _write_cache(path: str, objects: Dict[int, TObject]):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as cache_file:
+            pickle.dump(objects, cache_file, pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,475 @@
+""" Running many nodes in worker processes
+
+One process owns the network (e.g. a CANBusNetwork) and forwards the frames via
+rings in shared memory to the worker processes running the nodes.
+
+Requires Python 3.8 or newer (multiprocessing.shared_memory).
+"""
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+from durand.network import NetworkABC
+from durand.scheduler import SyncScheduler, set_scheduler
+
+
+log = logging.getLogger(__name__)
+
+
+POLL_INTERVAL = 0.000_5  # sleep time while waiting for space in a full ring [s]
+BATCH_SIZE = 64  # maximum number of records processed in one pass
+
+FRAME = 0
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+
+INDEX_STRUCT = struct.Struct("<Q")  # head (written by producer), tail (by consumer)
+RECORD_STRUCT = struct.Struct("<IBB")  # cob_id, kind, size (followed by data)
+RECORD_SIZE = 72  # record header and up to 64 bytes of data
+TAIL_OFFSET = 8
+RECORDS_OFFSET = 16
+
+
+class SharedRing:
+    """Single producer, single consumer ring buffer for frames in shared memory
+
+    The producer only writes the head index, the consumer only writes the tail
+    index, so no locking between the processes is needed. Every process must
+    only use one thread to put (or get) records.
+
+    :param capacity: number of records
+    :param name: name of the shared memory to attach to (None to create a new one)
+    """
+
+    def __init__(self, capacity: int = 1024, name: Optional[str] = None):
+        if name is None:
+            size = RECORDS_OFFSET + capacity * RECORD_SIZE
+            self._shm = SharedMemory(create=True, size=size)
+        else:
+            try:
+                self._shm = SharedMemory(name=name, track=False)  # type: ignore
+            except TypeError:  # track is available since Python 3.13
+                self._shm = SharedMemory(name=name)
+
+        self._buf = self._shm.buf
+        self._capacity = (len(self._buf) - RECORDS_OFFSET) // RECORD_SIZE
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __len__(self):
+        head = INDEX_STRUCT.unpack_from(self._buf, 0)[0]
+        return head - INDEX_STRUCT.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    def put(self, cob_id: int, data: bytes = b"", kind: int = FRAME) -> bool:
+        """Add a record, returns False when the ring is full"""
+        buf = self._buf
+        head = INDEX_STRUCT.unpack_from(buf, 0)[0]
+
+        if head - INDEX_STRUCT.unpack_from(buf, TAIL_OFFSET)[0] >= self._capacity:
+            return False
+
+        offset = RECORDS_OFFSET + (head % self._capacity) * RECORD_SIZE
+        RECORD_STRUCT.pack_into(buf, offset, cob_id, kind, len(data))
+        start = offset + RECORD_STRUCT.size
+        buf[start : start + len(data)] = data
+
+        INDEX_STRUCT.pack_into(buf, 0, head + 1)  # publish the record
+        return True
+
+    def get(self) -> Optional[Tuple[int, int, bytes]]:
+        """Returns the oldest record as (cob_id, kind, data) or None when empty"""
+        buf = self._buf
+        tail = INDEX_STRUCT.unpack_from(buf, TAIL_OFFSET)[0]
+
+        if tail == INDEX_STRUCT.unpack_from(buf, 0)[0]:
+            return None
+
+        offset = RECORDS_OFFSET + (tail % self._capacity) * RECORD_SIZE
+        cob_id, kind, size = RECORD_STRUCT.unpack_from(buf, offset)
+        start = offset + RECORD_STRUCT.size
+        data = bytes(buf[start : start + size])
+
+        INDEX_STRUCT.pack_into(buf, TAIL_OFFSET, tail + 1)  # release the record
+        return cob_id, kind, data
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+class FarmNetwork(NetworkABC):
+    """Network used by the nodes in a worker process
+
+    Every node uses its own FarmNodeNetwork, so several nodes may subscribe the
+    same COB-ID (e.g. NMT or SYNC). A COB-ID is subscribed at the router when the
+    first callback is added and unsubscribed when the last one is removed.
+
+    Frames and changes of the subscriptions are put into the TX ring and the
+    router is woken up via tx_wakeup. Received frames are read from the RX ring
+    by process(). Frames sent by a node are also dispatched to the other nodes of
+    this worker by process() (the router forwards them to the other workers).
+
+    :param rx_ring: ring with frames from the network
+    :param tx_ring: ring with frames and subscriptions to the network
+    :param tx_wakeup: event set when a record is put into the TX ring
+    """
+
+    def __init__(self, rx_ring: SharedRing, tx_ring: SharedRing, tx_wakeup=None):
+        self._rx_ring = rx_ring
+        self._tx_ring = tx_ring
+        self._tx_wakeup = tx_wakeup
+        self._tx_lock = threading.Lock()
+
+        # frames sent in this worker with the callback of the sending node
+        self._local: Deque[Tuple[int, bytes, Optional[Callable]]] = deque()
+
+        self.subscriptions: Dict[int, List[Callable[[int, bytes], None]]] = {}
+        self.tx_dropped = 0  # number of frames dropped due to a full ring
+
+    def add_subscription(self, cob_id: int, callback):
+        callbacks = self.subscriptions.setdefault(cob_id, [])
+        callbacks.append(callback)
+
+        if len(callbacks) == 1:
+            self._put_control(cob_id, SUBSCRIBE)
+
+    def remove_subscription(self, cob_id: int, callback=None):
+        """remove a subscription
+        :param cob_id: remove subscription for cob_id
+        :param callback: callback to be removed (default is the latest added)
+        """
+        callbacks = self.subscriptions[cob_id]
+
+        if callback is None:
+            callbacks.pop()
+        else:
+            callbacks.remove(callback)
+
+        if not callbacks:
+            del self.subscriptions[cob_id]
+            self._put_control(cob_id, UNSUBSCRIBE)
+
+    def _put_control(self, cob_id: int, kind: int):
+        # changes of subscriptions must not get lost, so wait for free space
+        with self._tx_lock:
+            while not self._tx_ring.put(cob_id, kind=kind):
+                time.sleep(POLL_INTERVAL)
+
+        self._wake_up_router()
+
+    def _wake_up_router(self):
+        if self._tx_wakeup is not None:
+            self._tx_wakeup.set()
+
+    def send(self, cob_id: int, msg: bytes, sender: Optional[Callable] = None):
+        """sending a CAN message to the network and the nodes of this worker
+        :param cob_id: CAN arbitration id
+        :param msg: CAN data bytes
+        :param sender: callback of the sending node for cob_id (not called)
+        """
+        if cob_id in self.subscriptions:
+            self._local.append((cob_id, msg, sender))
+
+        with self._tx_lock:
+            if self._tx_ring.put(cob_id, msg):
+                self._wake_up_router()
+                return
+
+        self.tx_dropped += 1
+        log.warning("TX ring full, dropping 0x%X", cob_id)
+
+    @property
+    def pending(self) -> bool:
+        """Frames sent in this worker are waiting to be dispatched"""
+        return bool(self._local)
+
+    def process(self) -> int:
+        """Dispatch the received frames, returns the number of frames"""
+        count = 0
+
+        while self._local and count < BATCH_SIZE:
+            count += 1
+            self._dispatch(*self._local.popleft())
+
+        while count < BATCH_SIZE:
+            record = self._rx_ring.get()
+
+            if record is None:
+                break
+
+            cob_id, _, data = record
+            count += 1
+            self._dispatch(cob_id, data)
+
+        return count
+
+    def _dispatch(self, cob_id: int, data: bytes, sender: Optional[Callable] = None):
+        # copied, as callbacks may change the subscriptions
+        for callback in tuple(self.subscriptions.get(cob_id, ())):
+            if callback is sender:
+                continue  # a node is not receiving its own frames
+
+            try:
+                callback(cob_id, data)
+            except Exception as e:
+                log.exception(f"{e!r} while processing 0x{cob_id:X}")
+
+
+class FarmNodeNetwork(NetworkABC):
+    """Network of a single node in a worker process
+
+    Like other networks, it keeps one callback per COB-ID. The subscriptions
+    are added to the FarmNetwork shared by the nodes of the worker.
+
+    :param network: network of the worker process
+    """
+
+    def __init__(self, network: FarmNetwork):
+        self._network = network
+        self.subscriptions: Dict[int, Callable[[int, bytes], None]] = {}
+
+    def add_subscription(self, cob_id: int, callback):
+        previous = self.subscriptions.get(cob_id, None)
+        self.subscriptions[cob_id] = callback
+        self._network.add_subscription(cob_id, callback)
+
+        # a replaced callback is removed afterwards to keep the COB-ID subscribed
+        if previous is not None:
+            self._network.remove_subscription(cob_id, previous)
+
+    def remove_subscription(self, cob_id: int):
+        self._network.remove_subscription(cob_id, self.subscriptions.pop(cob_id))
+
+    def send(self, cob_id: int, msg: bytes):
+        self._network.send(cob_id, msg, self.subscriptions.get(cob_id, None))
+
+
+class FarmScheduler(SyncScheduler):
+    """Scheduler of a worker process, run by the loop of the worker"""
+
+    def run_pending(self) -> Optional[float]:
+        """Call the due callbacks, returns the delay until the next one"""
+        return self._sched.run(blocking=False)
+
+
+def _run_worker(
+    setup: Callable[[NetworkABC, int], object],
+    node_ids: Sequence[int],
+    rx_name: str,
+    tx_name: str,
+    rx_wakeup,
+    tx_wakeup,
+    stop_event,
+):
+    scheduler = FarmScheduler()
+    set_scheduler(scheduler)
+
+    rx_ring, tx_ring = SharedRing(name=rx_name), SharedRing(name=tx_name)
+    network = FarmNetwork(rx_ring, tx_ring, tx_wakeup)
+
+    # keep references to the nodes
+    nodes = [  # noqa: F841
+        setup(FarmNodeNetwork(network), node_id) for node_id in node_ids
+    ]
+
+    while not stop_event.is_set():
+        # cleared before processing, so records put meanwhile are not missed
+        rx_wakeup.clear()
+        received = network.process()
+        delay = scheduler.run_pending()
+
+        if received < BATCH_SIZE and not network.pending:
+            rx_wakeup.wait(delay)  # until a frame is routed or the next timer
+
+    rx_ring.close()
+    tx_ring.close()
+
+
+class NodeFarm:
+    """Running nodes in worker processes to scale with the number of cores
+
+    The node ids are split into contiguous parts, one per worker process. Every
+    worker calls setup(network, node_id) for its node ids (setup has to be
+    picklable, e.g. a function of a module) and runs its own scheduler.
+
+    The calling process owns the network. A router thread forwards frames and
+    subscriptions from the workers to the network. Received frames are put
+    into the RX rings of the workers subscribed to the COB-ID. Frames sent by a
+    worker are also put into the RX rings of the other subscribed workers, as
+    the network is not receiving its own frames.
+
+    :param network: network owning the CAN bus (e.g. CANBusNetwork)
+    :param setup: function creating the node for the given network and node id
+    :param node_ids: node ids of the nodes to be created
+    :param workers: number of worker processes (default is the number of CPUs)
+    :param ring_size: number of frames per ring
+    :param context: multiprocessing context (default is the default context)
+    """
+
+    def __init__(
+        self,
+        network: NetworkABC,
+        setup: Callable[[NetworkABC, int], object],
+        node_ids: Sequence[int],
+        workers: Optional[int] = None,
+        ring_size: int = 1024,
+        context=None,
+    ):
+        self._network = network
+        self._setup = setup
+        self._context = context or multiprocessing.get_context()
+
+        node_ids = list(node_ids)
+        workers = min(workers or os.cpu_count() or 1, len(node_ids))
+        self._partitions = [
+            node_ids[i * len(node_ids) // workers : (i + 1) * len(node_ids) // workers]
+            for i in range(workers)
+        ]
+
+        self._rx_rings = [SharedRing(ring_size) for _ in self._partitions]
+        self._tx_rings = [SharedRing(ring_size) for _ in self._partitions]
+
+        # COB-ID -> numbers of the subscribed workers
+        self._routes: Dict[int, Tuple[int, ...]] = {}
+        self._rx_lock = threading.Lock()  # RX rings are filled by two threads
+
+        # set by the router when frames are put into the RX ring of a worker
+        self._rx_wakeups = [self._context.Event() for _ in self._partitions]
+        # set by the workers when records are put into their TX ring
+        self._tx_wakeup = self._context.Event()
+        self._stop_event = self._context.Event()
+        self._processes: List = []
+        self._router: Optional[threading.Thread] = None
+        self._running = False
+
+        self.rx_dropped = 0  # number of frames dropped due to a full RX ring
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_args):
+        self.stop()
+
+    def start(self):
+        """Start the worker processes and the router thread"""
+        for node_ids, rx_ring, tx_ring, rx_wakeup in zip(
+            self._partitions, self._rx_rings, self._tx_rings, self._rx_wakeups
+        ):
+            process = self._context.Process(
+                target=_run_worker,
+                args=(
+                    self._setup,
+                    node_ids,
+                    rx_ring.name,
+                    tx_ring.name,
+                    rx_wakeup,
+                    self._tx_wakeup,
+                    self._stop_event,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+        self._running = True
+        self._router = threading.Thread(target=self._route_tx, daemon=True)
+        self._router.start()
+
+    def stop(self):
+        """Stop the workers and release the rings"""
+        self._stop_event.set()
+
+        for rx_wakeup in self._rx_wakeups:
+            rx_wakeup.set()
+
+        for process in self._processes:
+            process.join()
+
+        self._running = False
+        self._tx_wakeup.set()
+
+        if self._router is not None:
+            self._router.join()
+
+        for cob_id in tuple(self._routes):
+            self._network.remove_subscription(cob_id)
+
+        self._routes.clear()
+
+        for ring in self._rx_rings + self._tx_rings:
+            ring.close()
+            ring.unlink()
+
+    def _route_rx(self, cob_id: int, msg: bytes):
+        self._put_rx(cob_id, msg)
+
+    def _put_rx(self, cob_id: int, msg: bytes, sender: Optional[int] = None):
+        with self._rx_lock:
+            for worker in self._routes.get(cob_id, ()):
+                if worker == sender:
+                    continue
+
+                if self._rx_rings[worker].put(cob_id, msg):
+                    self._rx_wakeups[worker].set()
+                else:
+                    self.rx_dropped += 1
+                    log.warning("RX ring full, dropping 0x%X", cob_id)
+
+    def _route_tx(self):
+        while self._running:
+            # cleared before processing, so records put meanwhile are not missed
+            self._tx_wakeup.clear()
+            busy = False
+
+            for worker, tx_ring in enumerate(self._tx_rings):
+                for _ in range(BATCH_SIZE):
+                    record = tx_ring.get()
+
+                    if record is None:
+                        break
+
+                    self._process_record(worker, *record)
+                else:
+                    busy = True  # more records may be pending
+
+            if not busy:
+                self._tx_wakeup.wait()
+
+    def _process_record(self, worker: int, cob_id: int, kind: int, data: bytes):
+        if kind == FRAME:
+            self._put_rx(cob_id, data, sender=worker)
+
+            try:
+                self._network.send(cob_id, data)
+            except Exception:
+                log.exception("Sending 0x%X failed", cob_id)
+            return
+
+        workers = self._routes.get(cob_id, ())
+
+        if kind == SUBSCRIBE and worker not in workers:
+            # routes are replaced (not changed), as they are read by other threads
+            self._routes[cob_id] = workers + (worker,)
+
+            if not workers:
+                self._network.add_subscription(cob_id, self._route_rx)
+        elif kind == UNSUBSCRIBE and worker in workers:
+            workers = tuple(number for number in workers if number != worker)
+
+            if workers:
+                self._routes[cob_id] = workers
+            else:
+                del self._routes[cob_id]
+                self._network.remove_subscription(cob_id)
@@ -1,17 +1,35 @@
 """ Interfacing python-canopen-node with python-can library
 """
 from abc import ABCMeta, abstractmethod
-from typing import Dict, Callable
+from contextlib import contextmanager
+from enum import Enum
+from typing import (
+    Dict,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+)
 from threading import Lock
+import heapq
+import itertools
 import logging
 
 import can  # type: ignore
 
+from durand.scheduler import get_scheduler
+
 
 log = logging.getLogger(__name__)
 
 
 class NetworkABC(metaclass=ABCMeta):
+    fd = False  # CAN FD frames with up to 64 bytes are used (e.g. for PDOs)
+
     @abstractmethod
     def add_subscription(self, cob_id: int, callback):
         """add subscription
@@ -32,16 +50,123 @@ class NetworkABC(metaclass=ABCMeta):
         :param msg: CAN data bytes
         """
 
+    def update_subscriptions(
+        self,
+        add: Optional[Mapping[int, Callable[[int, bytes], None]]] = None,
+        remove: Iterable[int] = (),
+    ):
+        """add and remove several subscriptions at once
+        :param add: mapping of cob_id to callback to subscribe
+        :param remove: cob_ids to remove (removed before adding the new ones)
+        """
+        for cob_id in remove:
+            self.remove_subscription(cob_id)
+
+        if add:
+            for cob_id, callback in add.items():
+                self.add_subscription(cob_id, callback)
+
+    @contextmanager
+    def subscription_transaction(self) -> Iterator[None]:
+        """context in which changes of the subscriptions may be collected and
+        applied at once when leaving (transactions can be nested)
+        """
+        yield
+
+
+class TxClass(Enum):
+    """Service class of a frame (by the function code of the COB-ID)"""
+
+    NMT = 0  # NMT module control
+    EMCY = 1  # SYNC, EMCY and TIME
+    PDO = 2
+    SDO = 3
+    ERROR_CONTROL = 4  # heartbeat and LSS
+
+    @staticmethod
+    def from_cob_id(cob_id: int) -> "TxClass":
+        if cob_id == 0:
+            return TxClass.NMT
+
+        if cob_id < 0x180:
+            return TxClass.EMCY
+
+        if cob_id < 0x580:
+            return TxClass.PDO
+
+        if cob_id < 0x700 or cob_id > 0x7FF:
+            return TxClass.SDO
+
+        return TxClass.ERROR_CONTROL
+
+
+# maximum number of queued frames per service class
+DEFAULT_TX_QUOTAS = {
+    TxClass.NMT: 16,
+    TxClass.EMCY: 32,
+    TxClass.PDO: 256,
+    TxClass.SDO: 128,
+    TxClass.ERROR_CONTROL: 16,
+}
+
+TX_RETRY_DELAY = 0.001  # first delay to retry sending [s]
+TX_RETRY_DELAY_MAX = 0.1  # maximum delay (doubled on every failed retry) [s]
+
+RX_BATCH_SIZE = 64  # maximum number of frames processed in one batch
+
 
 class CANBusNetwork(NetworkABC):
-    def __init__(self, can_bus: can.BusABC, loop=None):
+    """Network using a python-can bus
+
+    Frames are sent directly as long as the bus accepts them. When sending fails
+    with a CanOperationError (e.g. driver queue full or bus-off), the frame and
+    all following ones are queued and sending is retried via the scheduler with
+    increasing delay. The queue is ordered by COB-ID like the CAN arbitration, so
+    NMT and PDO frames are not waiting behind SDO block segments. A queued PDO
+    frame is replaced by a newer frame with the same COB-ID. Every service class
+    has a quota of queued frames (tx_quotas), further frames are dropped.
+
+    With batch_receive, all frames already available from the bus are read and
+    processed in one batch. For COB-IDs in latest_only_cob_ids (e.g. RPDOs where
+    only the latest values are of interest) only the newest frame of a batch is
+    processed.
+
+    :param can_bus: python-can bus
+    :param loop: event loop used by the notifier (None to use a thread)
+    :param batch_receive: drain all available frames on every reception
+    :param fd: send CAN FD frames (with bitrate switch) and process received ones
+    """
+
+    def __init__(
+        self,
+        can_bus: can.BusABC,
+        loop=None,
+        batch_receive: bool = False,
+        fd: bool = False,
+    ):
         self._bus = can_bus
         self._loop = loop
+        self.fd = fd
 
         self.lock = Lock()
         self.subscriptions: Dict[int, Callable[[int, bytes], None]] = {}
+        self.latest_only_cob_ids: Set[int] = set()
+
+        self.tx_quotas = dict(DEFAULT_TX_QUOTAS)
+        self.tx_dropped = 0  # number of frames dropped due to a full quota
+
+        self._tx_lock = Lock()
+        self._tx_heap: List[list] = []  # entries: [cob_id, sequence, data]
+        self._tx_sequence = itertools.count()
+        self._tx_counts = dict.fromkeys(TxClass, 0)
+        self._tx_pdos: Dict[int, list] = {}  # queued PDO entry by COB-ID
+        self._tx_busy = False
+        self._tx_retry_delay = 0.0  # > 0 while waiting for a retry
 
-        listener = NodeListener(self)
+        self._transactions = 0  # number of open subscription transactions
+        self._filters_outdated = False
+
+        listener = NodeListener(self, can_bus if batch_receive else None)
         self._notifier = can.Notifier(self._bus, (listener,), 1, self._loop)
 
     def add_subscription(self, cob_id: int, callback):
@@ -54,28 +179,171 @@ class CANBusNetwork(NetworkABC):
             self.subscriptions.pop(cob_id)
             self._update_filters()
 
+    def update_subscriptions(
+        self,
+        add: Optional[Mapping[int, Callable[[int, bytes], None]]] = None,
+        remove: Iterable[int] = (),
+    ):
+        with self.lock:
+            for cob_id in remove:
+                self.subscriptions.pop(cob_id)
+
+            if add:
+                self.subscriptions.update(add)
+
+            self._update_filters()
+
+    @contextmanager
+    def subscription_transaction(self) -> Iterator[None]:
+        with self.lock:
+            self._transactions += 1
+
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._transactions -= 1
+
+                if not self._transactions and self._filters_outdated:
+                    self._update_filters()
+
     def _update_filters(self):
+        if self._transactions:
+            self._filters_outdated = True
+            return
+
+        self._filters_outdated = False
         self._bus.set_filters(
             [{"can_id": i, "can_mask": 0x7FF} for i in self.subscriptions]
         )
 
     def send(self, cob_id: int, msg: bytes):
-        msg = can.Message(arbitration_id=cob_id, data=msg, is_extended_id=False)
-        self._bus.send(msg)
+        with self._tx_lock:
+            if not self._enqueue(cob_id, msg) or self._tx_busy:
+                return
+
+            if self._tx_retry_delay:
+                return  # the scheduled retry is sending the queue
+
+            self._tx_busy = True
+
+        self._process_queue()
+
+    def _enqueue(self, cob_id: int, data: bytes) -> bool:
+        tx_class = TxClass.from_cob_id(cob_id)
+
+        if tx_class == TxClass.PDO and cob_id in self._tx_pdos:
+            self._tx_pdos[cob_id][2] = data  # replace the outdated frame
+            return False
+
+        if self._tx_counts[tx_class] >= self.tx_quotas[tx_class]:
+            self.tx_dropped += 1
+            log.warning("TX quota for %s exhausted, dropping 0x%X", tx_class, cob_id)
+            return False
+
+        entry = [cob_id, next(self._tx_sequence), data]
+        heapq.heappush(self._tx_heap, entry)
+        self._tx_counts[tx_class] += 1
+
+        if tx_class == TxClass.PDO:
+            self._tx_pdos[cob_id] = entry
+
+        return True
+
+    def _process_queue(self):
+        while True:
+            with self._tx_lock:
+                if not self._tx_heap:
+                    self._tx_busy = False
+                    self._tx_retry_delay = 0.0
+                    return
+
+                entry = heapq.heappop(self._tx_heap)
+                cob_id, _, data = entry
+                tx_class = TxClass.from_cob_id(cob_id)
+                self._tx_counts[tx_class] -= 1
+
+                if self._tx_pdos.get(cob_id) is entry:
+                    del self._tx_pdos[cob_id]
+
+            msg = can.Message(
+                arbitration_id=cob_id,
+                data=data,
+                is_extended_id=False,
+                is_fd=self.fd,
+                bitrate_switch=self.fd,
+            )
+
+            try:
+                self._bus.send(msg, timeout=0)
+            except (can.CanOperationError, can.CanTimeoutError) as exc:
+                with self._tx_lock:
+                    if cob_id not in self._tx_pdos:  # not superseded meanwhile
+                        heapq.heappush(self._tx_heap, entry)
+                        self._tx_counts[tx_class] += 1
+
+                        if tx_class == TxClass.PDO:
+                            self._tx_pdos[cob_id] = entry
+
+                    self._tx_busy = False
+                    self._tx_retry_delay = min(
+                        self._tx_retry_delay * 2 or TX_RETRY_DELAY, TX_RETRY_DELAY_MAX
+                    )
+                    delay = self._tx_retry_delay
+
+                log.debug(
+                    "Sending 0x%X failed (%r), retry in %.3fs", cob_id, exc, delay
+                )
+
+                try:
+                    get_scheduler().add(delay, self._retry)
+                except Exception:
+                    # the queue is sent again with the next frame
+                    log.exception("Scheduling the TX retry failed")
+
+                    with self._tx_lock:
+                        self._tx_retry_delay = 0.0
+                return
+            except Exception:
+                log.exception("Sending 0x%X failed, frame dropped", cob_id)
+
+    def _retry(self):
+        with self._tx_lock:
+            if self._tx_busy:
+                return
+
+            self._tx_busy = True
+
+        self._process_queue()
 
     def stop(self):
         self._notifier.stop()
 
 
 class NodeListener(can.Listener):
-    def __init__(self, network: CANBusNetwork):
+    """Dispatching received frames to the subscriptions of the network
+
+    :param network: the network
+    :param bus: when given, all frames available from this bus are read on
+                every reception and processed as one batch
+    """
+
+    def __init__(self, network: CANBusNetwork, bus: Optional[can.BusABC] = None):
         self._network = network
+        self._bus = bus
 
     def on_message_received(self, msg: can.Message):
-        if msg.is_error_frame or msg.is_remote_frame or msg.is_fd:
+        if self._bus is not None:
+            self.on_messages_received(self._drain(msg))
+            return
+
+        if msg.is_error_frame or msg.is_remote_frame:
             # rtr is currently not supported
             return
 
+        if msg.is_fd and not self._network.fd:
+            return
+
         with self._network.lock:
             callback = self._network.subscriptions.get(msg.arbitration_id, None)
 
@@ -86,3 +354,49 @@ class NodeListener(can.Listener):
             callback(msg.arbitration_id, msg.data)
         except Exception as e:
             log.exception(f"{e!r} while processing {msg!r}")
+
+    def _drain(self, msg: can.Message) -> List[can.Message]:
+        assert self._bus is not None
+        batch = [msg]
+
+        while len(batch) < RX_BATCH_SIZE:
+            msg = self._bus.recv(0)
+
+            if msg is None:
+                break
+
+            batch.append(msg)
+
+        return batch
+
+    def on_messages_received(self, batch: Sequence[can.Message]):
+        """Process a batch of received frames in order"""
+        latest_only = self._network.latest_only_cob_ids
+        newest: Dict[int, can.Message] = {}
+
+        if latest_only:
+            for msg in batch:
+                if msg.arbitration_id in latest_only:
+                    newest[msg.arbitration_id] = msg
+
+        # single dict lookups are atomic, so subscriptions changed by a callback
+        # are used for the following frames of the batch
+        subscriptions = self._network.subscriptions
+        fd = self._network.fd
+
+        for msg in batch:
+            if msg.is_error_frame or msg.is_remote_frame or (msg.is_fd and not fd):
+                continue
+
+            if newest and newest.get(msg.arbitration_id, msg) is not msg:
+                continue  # superseded by a newer frame in this batch
+
+            callback = subscriptions.get(msg.arbitration_id, None)
+
+            if not callback:
+                continue
+
+            try:
+                callback(msg.arbitration_id, msg.data)
+            except Exception as e:
+                log.exception(f"{e!r} while processing {msg!r}")
@@ -1,16 +1,18 @@
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass
 
 from .network import NetworkABC
 from .object_dictionary import ObjectDictionary
-from .services.sdo import SDOServer
+from .services.sdo import SDOServer, SDODispatcher
 from .services.pdo import TPDO, RPDO
 from .eds import EDS
 from .services.nmt import NMTSlave, StateEnum
 from .services.lss import LSSSlave
 from .services.sync import SyncConsumer
 from .services.emcy import EMCYProducer
-from .services.heartbeat import HeartbeatProducer
+from .services.heartbeat import HeartbeatProducer, HeartbeatConsumer
+from .services.concise_dcf import ConciseDCF
+from .services.storage import ParameterStorage
 from .object_dictionary import Variable, Record
 from .datatypes import DatatypeEnum as DT
 
@@ -32,6 +34,7 @@ class Node:
         node_id: int,
         od: ObjectDictionary = None,
         capabilities: NodeCapabilities = NodeCapabilities(),
+        storage_path: Optional[str] = None,
     ):
 
         self.network = network
@@ -49,6 +52,7 @@ class Node:
         self.eds.device_info.NrOfRXPDO = capabilities.rpdos
         self.eds.device_info.NrOfTXPDO = capabilities.tpdos
 
+        self.sdo_dispatcher = SDODispatcher(self)
         self.sdo_servers: List[SDOServer] = []
 
         assert (
@@ -61,6 +65,8 @@ class Node:
         self.heartbeat_producer = HeartbeatProducer(self)
         self.lss = LSSSlave(self)
         self.emcy = EMCYProducer(self)
+        self.heartbeat_consumer = HeartbeatConsumer(self)
+        self.concise_dcf = ConciseDCF(self)
 
         od[0x1000] = Variable(DT.UNSIGNED32, "ro", 0, name="Device Type")
 
@@ -82,12 +88,18 @@ class Node:
         identity_record[4] = Variable(DT.UNSIGNED32, "ro", 0, name="Serial Number")
 
         od[0x1018] = identity_record
+
+        self.parameter_storage = ParameterStorage(self, storage_path)
+        self.parameter_storage.load()
+
         self.nmt.set_state(StateEnum.PRE_OPERATIONAL)
 
         # EDS provider
         od[0x1021] = Variable(DT.DOMAIN, "ro", name="Store EDS")
         od[0x1022] = Variable(DT.UNSIGNED8, "ro", value=0, name="Store Format")
-        od.set_read_callback(0x1021, 0, lambda: self.eds.content.encode())
+        od.set_read_callback(0x1021, 0, lambda: self.eds.stored_data)
+        upload_callbacks = self.sdo_dispatcher.upload_handler_callbacks
+        upload_callbacks[(0x1021, 0)] = lambda *_: self.eds.upload_handler()
 
 
 MinimalNodeCapabilities = NodeCapabilities(sdo_servers=1, rpdos=4, tpdos=4)
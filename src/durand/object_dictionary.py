@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from collections import defaultdict
-from typing import Any, Dict, Tuple, Callable, Union, Optional
+from typing import Any, Dict, Iterable, Tuple, Callable, Union, Optional
 import itertools
 import logging
 
@@ -186,6 +186,9 @@ class ObjectDictionary:
         )
         self._read_callbacks: Dict[TMultiplexor, Callable] = {}
 
+        # called with the index when an object is added or replaced (not on writes)
+        self.change_callbacks = CallbackHandler()
+
     def __getitem__(self, index: int):
         try:
             return self._variables[index]
@@ -198,6 +201,8 @@ class ObjectDictionary:
         else:
             self._objects[index] = obj
 
+        self.change_callbacks.call(index)
+
     def lookup(self, index: int, subindex: int = None) -> TObject:
         """Return object on index:subindex in object dictionary. When subindex is None
         the object is returned. Otherwise a lookup is extended with subindex in the Array/Record.
@@ -227,16 +232,52 @@ class ObjectDictionary:
 
         :param index: object index
         :param subindex: subindex in record or array
-        :param value: value to be written
+        :param value: value to be written (DOMAIN downloads above
+                      DownloadBuffer.SPILL_THRESHOLD are provided as memoryview
+                      of a memory-mapped file, smaller ones as bytes)
         :param downloaded: flag is set, when the write is caused by an actual download
                            (instead of a internal value change)
 
         :raises KeyError: when index:subindex not found
         :raises Exception: when validate_callback fails
         """
+        multiplexor = self._store(index, subindex, value, downloaded)
+        self._notify(multiplexor, value, downloaded)
+
+    def write_many(
+        self, entries: Iterable[Tuple[int, int, Any]], downloaded: bool = False
+    ):
+        """Write several values in a batch.
+
+        The values are validated and stored in the given order. The update and
+        download callbacks are called afterwards, once per multiplexor with the
+        last value written (in the order the last values were written). When a
+        write fails, the callbacks for the values stored so far are called before
+        the exception is raised.
+
+        :param entries: iterable of (index, subindex, value) tuples
+        :param downloaded: flag is set, when the writes are caused by an actual download
+
+        :raises KeyError: when an index:subindex is not found
+        :raises Exception: when a validate_callback fails
+        """
+        pending: Dict[TMultiplexor, Any] = {}
+
+        try:
+            for index, subindex, value in entries:
+                multiplexor = self._store(index, subindex, value, downloaded)
+                pending.pop(multiplexor, None)
+                pending[multiplexor] = value
+        finally:
+            for multiplexor, value in pending.items():
+                self._notify(multiplexor, value, downloaded)
+
+    def _store(
+        self, index: int, subindex: int, value: Any, downloaded: bool
+    ) -> TMultiplexor:
         assert isinstance(
-            value, (bytes, bool, int, float)
-        ), "Only bytes, bool, int or float are allowed in object dictionary"
+            value, (bytes, memoryview, bool, int, float)
+        ), "Only bytes, memoryview, bool, int or float are allowed in object dictionary"
 
         if index in self._variables:
             multiplexor = (index, 0)
@@ -260,7 +301,9 @@ class ObjectDictionary:
             self.validate_callbacks[multiplexor].call(value)  # may raises exception
 
         self._data[multiplexor] = value
+        return multiplexor
 
+    def _notify(self, multiplexor: TMultiplexor, value: Any, downloaded: bool):
         if multiplexor in self.update_callbacks:
             self.update_callbacks[multiplexor].call(value)
 
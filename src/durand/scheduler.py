@@ -133,6 +133,9 @@ class VirtualScheduler(AbstractScheduler):
             if earliest_timestamp > start_time + duration:
                 break
 
+            # entries added by the callbacks are relative to the current time
+            self._time = earliest_timestamp
+
             entry_indices = tuple(
                 entry_index
                 for entry_index, timestamp in self._timestamp_dict.items()
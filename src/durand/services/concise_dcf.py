@@ -0,0 +1,133 @@
+import struct
+from typing import TYPE_CHECKING, List, Optional, Tuple, Any
+
+from durand.object_dictionary import Variable, Array, TMultiplexor
+from durand.datatypes import DatatypeEnum as DT, is_numeric
+from durand.services.sdo.download import BaseDownloadHandler
+from durand.services.sdo.server import SDODomainAbort
+
+
+if TYPE_CHECKING:
+    from durand.node import Node
+
+
+ENTRY_STRUCT = struct.Struct("<HBI")  # index, subindex, size
+
+
+class ConciseDCF:
+    """Concise DCF (CiA302, object 0x1F22) to configure the node with one download
+
+    A concise DCF downloaded to the subindex of the own node id is parsed and all
+    entries are written via ObjectDictionary.write_many, so the callbacks of an
+    object are called once with its final value. Downloads to other subindices
+    are only stored.
+    """
+
+    def __init__(self, node: "Node"):
+        self._node = node
+
+        node.object_dictionary[0x1F22] = Array(
+            Variable(DT.DOMAIN, "rw", name="Concise DCF"),
+            length=127,
+            name="Concise DCF",
+        )
+
+        callbacks = node.sdo_dispatcher.download_handler_callbacks
+
+        for subindex in range(1, 128):
+            callbacks[(0x1F22, subindex)] = self._create_handler
+
+    def _create_handler(
+        self, node: "Node", _index: int, subindex: int, size: Optional[int]
+    ) -> Optional[BaseDownloadHandler]:
+        if subindex != node.node_id:
+            return None
+
+        return ConciseDCFHandler(self, subindex, size)
+
+    def apply(self, data: bytes):
+        """Parse the concise DCF and write the entries to the object dictionary
+
+        :param data: concise DCF (number of entries followed by the entries)
+
+        :raises SDODomainAbort: when the DCF is malformed or an entry can't be written
+        """
+        entries = self.parse(data)
+
+        # e.g. PDOs enabled by the DCF are subscribed in one batch
+        with self._node.network.subscription_transaction():
+            self._node.object_dictionary.write_many(entries, downloaded=True)
+
+    def parse(self, data: bytes) -> List[Tuple[int, int, Any]]:
+        multiplexor = (0x1F22, self._node.node_id)
+        data = memoryview(data)
+
+        if len(data) < 4:
+            raise SDODomainAbort(0x06070010, multiplexor)  # length not matching
+
+        count = int.from_bytes(data[:4], "little")
+        offset = 4
+        entries = []
+
+        for _ in range(count):
+            if offset + ENTRY_STRUCT.size > len(data):
+                raise SDODomainAbort(0x06070010, multiplexor)
+
+            index, subindex, size = ENTRY_STRUCT.unpack_from(data, offset)
+            offset += ENTRY_STRUCT.size
+
+            if offset + size > len(data):
+                raise SDODomainAbort(0x06070010, multiplexor)
+
+            value = self._unpack((index, subindex), data[offset : offset + size])
+            entries.append((index, subindex, value))
+            offset += size
+
+        return entries
+
+    def _unpack(self, multiplexor: TMultiplexor, data: memoryview):
+        try:
+            variable = self._node.object_dictionary.lookup(*multiplexor)
+        except KeyError as exc:
+            raise SDODomainAbort(0x06020000, multiplexor) from exc  # not existing
+
+        if not isinstance(variable, Variable):
+            raise SDODomainAbort(0x06090011, multiplexor)  # subindex does not exist
+
+        if not variable.writable:
+            raise SDODomainAbort(0x06010002, multiplexor)  # read-only object
+
+        if not is_numeric(variable.datatype):
+            return bytes(data)
+
+        if len(data) != variable.size:
+            raise SDODomainAbort(0x06070010, multiplexor)  # length not matching
+
+        value = variable.unpack(data)
+
+        if variable.minimum is not None and value < variable.minimum:
+            raise SDODomainAbort(0x06090032, multiplexor)  # value too low
+
+        if variable.maximum is not None and value > variable.maximum:
+            raise SDODomainAbort(0x06090031, multiplexor)  # value too high
+
+        return value
+
+
+class ConciseDCFHandler(BaseDownloadHandler):
+    def __init__(self, concise_dcf: ConciseDCF, subindex: int, size: Optional[int]):
+        self._concise_dcf = concise_dcf
+        self._subindex = subindex
+        self._size = size
+        self._buffer = bytearray()
+
+    def on_receive(self, data: bytes):
+        self._buffer += data
+
+    def on_finish(self):
+        if self._size is not None and len(self._buffer) != self._size:
+            raise SDODomainAbort(
+                0x06070010, multiplexor=(0x1F22, self._subindex)
+            )  # length not matching
+
+        self._concise_dcf.apply(self._buffer)
@@ -1,7 +1,12 @@
-from typing import TYPE_CHECKING, Optional
+from array import array
+from collections import deque
+from enum import Enum
+from typing import TYPE_CHECKING, Deque, Tuple
+import functools
+import logging
 import struct
 
-from durand.object_dictionary import Variable
+from durand.object_dictionary import Variable, Array
 from durand.services.nmt import StateEnum
 from durand.datatypes import DatatypeEnum as DT
 from durand.scheduler import get_scheduler
@@ -10,15 +15,113 @@ if TYPE_CHECKING:
     from durand.node import Node
 
 
+log = logging.getLogger(__name__)
+
+
+TEMCY = Tuple[int, int, bytes]  # error code, error register, data
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = 0  # the oldest pending EMCY is dropped
+    DROP_NEWEST = 1  # the new EMCY is dropped
+
+
+class ErrorHistory:
+    """Pre-defined error field (object 0x1003)
+
+    The errors are kept in a ring buffer of fixed capacity. Sub 0 returns the
+    number of recorded errors, sub 1 the newest one. Writing 0 to sub 0 clears
+    the history.
+
+    Every entry contains the error code (bits 0-15) and the first two bytes of
+    the manufacturer specific data as additional information (bits 16-31).
+
+    :param node: the node
+    :param capacity: maximum number of recorded errors
+    """
+
+    def __init__(self, node: "Node", capacity: int = 16):
+        self._ring = array("L", [0]) * capacity
+        self._head = 0  # position for the next error
+        self._count = 0
+
+        od = node.object_dictionary
+        od[0x1003] = Array(
+            Variable(DT.UNSIGNED32, "ro", name="Standard Error Field"),
+            length=capacity,
+            mutable=True,
+            name="Pre-defined Error Field",
+        )
+
+        od.set_read_callback(0x1003, 0, lambda: self._count)
+        od.validate_callbacks[(0x1003, 0)].add(self._validate_clear)
+        od.update_callbacks[(0x1003, 0)].add(lambda _value: self.clear())
+
+        for subindex in range(1, capacity + 1):
+            od.set_read_callback(
+                0x1003, subindex, functools.partial(self.__getitem__, subindex)
+            )
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, subindex: int) -> int:
+        """Returns the entry of the given subindex (1 is the newest error)"""
+        if not 1 <= subindex <= self._count:
+            return 0
+
+        return self._ring[(self._head - subindex) % len(self._ring)]
+
+    def record(self, error_code: int, data: bytes = b""):
+        """Add an error to the history (the oldest one is overwritten when full)"""
+        self._ring[self._head] = error_code | int.from_bytes(data[:2], "little") << 16
+        self._head = (self._head + 1) % len(self._ring)
+        self._count = min(self._count + 1, len(self._ring))
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    @staticmethod
+    def _validate_clear(value: int):
+        if value != 0:
+            raise ValueError("Only 0 can be written to clear the error history")
+
+
 class EMCYProducer:
-    def __init__(self, node: "Node"):
+    """Producing EMCY messages
+
+    EMCYs set while the inhibit time is running are put into a FIFO queue and
+    are sent one per inhibit time. An EMCY identical to one already pending
+    (and not followed by an error reset) is not queued again. When the queue is
+    full, the overflow policy decides which EMCY is dropped.
+
+    :param node: the node
+    :param queue_size: maximum number of pending EMCYs
+    :param overflow_policy: EMCY to drop when the queue is full
+    :param history_size: capacity of the error history (object 0x1003)
+    """
+
+    def __init__(
+        self,
+        node: "Node",
+        queue_size: int = 16,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        history_size: int = 16,
+    ):
         self._node = node
 
         self._timer_handle = None
         self._inhibit_time = 0.0
-        self._deferred_emcy = None
+        self._queue: Deque[TEMCY] = deque()
         self._stopped = True
 
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.dropped = 0  # number of EMCYs dropped due to a full queue
+
+        self.history = ErrorHistory(node, history_size)
+
         self._cob_id: int = 0x80 + node.node_id
 
         node.object_dictionary[0x1001] = Variable(
@@ -46,6 +149,7 @@ class EMCYProducer:
     def _update_nmt_state(self, state: StateEnum):
         if state == StateEnum.STOPPED:
             self._stopped = True
+            self._queue.clear()
         elif (
             state in (StateEnum.PRE_OPERATIONAL, StateEnum.OPERATIONAL)
             and self._stopped
@@ -80,6 +184,12 @@ class EMCYProducer:
         self._timer_handle = None
         self._inhibit_time = value / 10_000
 
+        if not self._inhibit_time:
+            while self._queue:  # no inhibit time anymore, so send all pending
+                self._send(*self._queue.popleft())
+        elif self._queue:
+            self._time_up()  # continue sending with the new inhibit time
+
     @property
     def inhibit_time(self):
         return self._node.object_dictionary.read(0x1015, 0) / 10_000
@@ -91,23 +201,46 @@ class EMCYProducer:
     def _time_up(self):
         self._timer_handle = None
 
-        if self._deferred_emcy:
-            self._send(*self._deferred_emcy)
-
-        self._deferred_emcy = None
+        if self._queue:
+            self._send(*self._queue.popleft())
 
     def set(self, error_code: int, error_register: int, data: bytes = b""):
-        self._node.object_dictionary.write(0x1001, 0, error_register)
+        od = self._node.object_dictionary
+
+        if od.read(0x1001, 0) != error_register:
+            od.write(0x1001, 0, error_register)
+
+        if error_code:
+            self.history.record(error_code, data)
 
         if not self.enable:
             return
 
         if self._timer_handle is not None:
-            self._deferred_emcy = (error_code, error_register, data)
+            self._enqueue((error_code, error_register, data))
             return
 
         self._send(error_code, error_register, data)
 
+    def _enqueue(self, emcy: TEMCY):
+        for pending in reversed(self._queue):
+            if pending == emcy:
+                return  # already pending
+
+            if pending[0] == 0 or emcy[0] == 0:
+                break  # an error reset is only merged with a directly preceding one
+
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            log.warning("EMCY queue full (%s)", self.overflow_policy.name)
+
+            if self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                return
+
+            self._queue.popleft()
+
+        self._queue.append(emcy)
+
     def _send(self, error_code: int, error_register: int, data: bytes = b""):
         if self._stopped:
             return
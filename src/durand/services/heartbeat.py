@@ -1,8 +1,13 @@
-from typing import TYPE_CHECKING
+from array import array
+from typing import TYPE_CHECKING, Dict, Tuple
+import functools
+import math
+import threading
 
-from durand.object_dictionary import Variable
+from durand.object_dictionary import Variable, Array
 from durand.datatypes import DatatypeEnum as DT
 from durand.scheduler import get_scheduler
+from durand.callback_handler import CallbackHandler
 
 if TYPE_CHECKING:
     from durand.node import Node
@@ -35,3 +40,176 @@ class HeartbeatProducer:
         self._handle = get_scheduler().add(
             interval, self._process_heartbeat, args=(interval,)
         )
+
+
+SWEEP_DIVIDER = 4  # number of sweeps per shortest consumer heartbeat time
+
+
+class HeartbeatConsumer:
+    """Monitors the heartbeats of other nodes (object 0x1016)
+
+    Every entry of 0x1016 contains the node id (bits 16-23) and the consumer
+    heartbeat time in ms (bits 0-15). Monitoring of a node starts with its first
+    received heartbeat.
+
+    Instead of a timer per node, a single sweep timer is running with a quarter
+    of the shortest consumer heartbeat time. Received heartbeats only store the
+    current sweep count in an array indexed by the node id, so a timeout is
+    detected with a delay of up to one sweep period.
+
+    A timeout is signaled via timeout_callbacks (called with the node id) and an
+    EMCY with error code 0x8130. Monitoring of the node restarts with its next
+    heartbeat.
+
+    :param node: the node
+    :param entries: number of entries in 0x1016
+    """
+
+    def __init__(self, node: "Node", entries: int = 127):
+        self._node = node
+
+        # protects the sweep timer against configuration changes from other threads
+        self._lock = threading.Lock()
+        self._handle = None
+        self._generation = 0  # incremented on every configuration change
+
+        self._ticks = 0  # number of sweeps done
+        self._period = 0.0
+
+        # indexed by node id
+        self._last_seen = array("Q", [0]) * 128  # sweep count
+        self._timeout_ticks = array("L", [0]) * 128
+        self._alive = bytearray(128)
+        self._monitored: Tuple[int, ...] = ()
+
+        self.timeout_callbacks = CallbackHandler()
+
+        od = node.object_dictionary
+        od[0x1016] = Array(
+            Variable(DT.UNSIGNED32, "rw", name="Consumer Heartbeat Time"),
+            length=entries,
+            name="Consumer Heartbeat Time",
+        )
+
+        for subindex in range(1, entries + 1):
+            od.validate_callbacks[(0x1016, subindex)].add(
+                functools.partial(self._validate_entry, subindex)
+            )
+            od.update_callbacks[(0x1016, subindex)].add(self._update_entries)
+
+    def is_alive(self, node_id: int) -> bool:
+        """Returns if the heartbeat of the monitored node is received in time"""
+        return bool(self._alive[node_id])
+
+    def _entries(self) -> Dict[int, int]:
+        """Returns the monitored nodes with their consumer heartbeat time in ms"""
+        od = self._node.object_dictionary
+        entries = {}
+
+        for subindex in range(1, len(od.lookup(0x1016))):
+            value = od.read(0x1016, subindex)
+            node_id, time_ms = (value >> 16) & 0xFF, value & 0xFFFF
+
+            if 1 <= node_id <= 127 and time_ms:
+                entries[node_id] = time_ms
+
+        return entries
+
+    def _validate_entry(self, subindex: int, value: int):
+        node_id, time_ms = (value >> 16) & 0xFF, value & 0xFFFF
+
+        if not time_ms:
+            return
+
+        od = self._node.object_dictionary
+
+        for other in range(1, len(od.lookup(0x1016))):
+            other_value = od.read(0x1016, other)
+
+            if (
+                other != subindex
+                and (other_value >> 16) & 0xFF == node_id
+                and other_value & 0xFFFF
+            ):
+                raise ValueError(f"Node {node_id} is already monitored")
+
+    def _update_entries(self, _value: int):
+        network = self._node.network
+        entries = self._entries()
+
+        network.update_subscriptions(
+            add={
+                0x700 + node_id: self._receive
+                for node_id in entries
+                if node_id not in self._monitored
+            },
+            remove=[
+                0x700 + node_id for node_id in self._monitored if node_id not in entries
+            ],
+        )
+
+        with self._lock:
+            # a pending sweep may already be running, so it is not canceled but
+            # stops itself as its generation is outdated
+            self._generation += 1
+            self._handle = None
+
+            # changing the configuration restarts the monitoring
+            self._monitored = tuple(entries)
+            self._alive[:] = bytes(128)
+
+            if not entries:
+                return
+
+            self._period = min(entries.values()) / 1000 / SWEEP_DIVIDER
+
+            for node_id, time_ms in entries.items():
+                self._timeout_ticks[node_id] = math.ceil(time_ms / 1000 / self._period)
+
+            self._handle = get_scheduler().add(
+                self._period, self._sweep, args=(self._generation,)
+            )
+
+    def _receive(self, cob_id: int, _msg: bytes):
+        node_id = cob_id - 0x700
+        self._last_seen[node_id] = self._ticks
+        self._alive[node_id] = 1
+
+    def _sweep(self, generation: int):
+        timed_out = []
+
+        with self._lock:
+            if generation != self._generation:
+                return  # replaced by a configuration change
+
+            self._handle = get_scheduler().add(
+                self._period, self._sweep, args=(generation,)
+            )
+
+            self._ticks += 1
+            ticks = self._ticks
+
+            last_seen, timeout_ticks, alive = (
+                self._last_seen,
+                self._timeout_ticks,
+                self._alive,
+            )
+
+            for node_id in self._monitored:
+                # the heartbeat was received up to one sweep after the stored count
+                if (
+                    alive[node_id]
+                    and ticks - last_seen[node_id] > timeout_ticks[node_id]
+                ):
+                    alive[node_id] = 0
+                    timed_out.append(node_id)
+
+        # called without the lock, as the callbacks may change the configuration
+        for node_id in timed_out:
+            self._timeout(node_id)
+
+    def _timeout(self, node_id: int):
+        self.timeout_callbacks.call(node_id)
+
+        # heartbeat error, error register: generic and communication error
+        self._node.emcy.set(0x8130, 0x11, bytes((node_id,)))
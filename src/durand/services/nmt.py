@@ -1,6 +1,6 @@
 from enum import IntEnum
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable, Dict, Hashable
 
 from ..callback_handler import CallbackHandler
 
@@ -19,11 +19,20 @@ class StateEnum(IntEnum):
 
 
 class NMTSlave:
+    """NMT slave service
+
+    state_callbacks are called on every state change. Services which are only
+    affected when entering or leaving OPERATIONAL (like PDOs) register in
+    operational_callbacks (mapping a key to the callback), so other transitions
+    are not visiting them.
+    """
+
     def __init__(self, node: "Node"):
         self._node = node
         self.pending_node_id = node.node_id
 
         self.state_callbacks = CallbackHandler()
+        self.operational_callbacks: Dict[Hashable, Callable[[StateEnum], None]] = {}
 
         self.state = StateEnum.STOPPED
 
@@ -67,6 +76,15 @@ class NMTSlave:
             # send bootup message
             self._node.network.send(0x700 + self._node.node_id, b"\x00")
 
-        self.state = state
+        previous_state, self.state = self.state, state
+
+        # subscription changes of all services are applied in one batch
+        with self._node.network.subscription_transaction():
+            if StateEnum.OPERATIONAL in (previous_state, state):
+                for callback in tuple(self.operational_callbacks.values()):
+                    try:
+                        callback(state)
+                    except Exception:
+                        log.debug("Ignored exception in NMT callback", exc_info=True)
 
-        self.state_callbacks.call(state)
+            self.state_callbacks.call(state)
@@ -5,11 +5,23 @@ from typing import TYPE_CHECKING, Sequence
 
 from durand.object_dictionary import TMultiplexor, Variable
 from durand.services.nmt import StateEnum
+from durand.services.sdo.server import SDODomainAbort
 
 if TYPE_CHECKING:
     from durand.node import Node
 
 
+FD_FRAME_SIZES = (12, 16, 20, 24, 32, 48, 64)  # CAN FD payload sizes above 8 bytes
+
+
+def frame_size(size: int) -> int:
+    """Returns the payload size of the (CAN FD) frame carrying size bytes"""
+    if size <= 8:
+        return size
+
+    return next(frame_size for frame_size in FD_FRAME_SIZES if frame_size >= size)
+
+
 class PDOBase:
     COB_OFFSET = 0
     MAPPING_ARRAY_INDEX = 0
@@ -27,6 +39,11 @@ class PDOBase:
     def node(self):
         return self._node
 
+    @property
+    def max_size(self) -> int:
+        """Maximum size of the PDO in bytes (and number of mapping entries)"""
+        return 64 if self._node.network.fd else 8
+
     def _update_nmt_state(self, state: StateEnum):
         if state == StateEnum.OPERATIONAL:
             if self._index < 4:
@@ -41,6 +58,17 @@ class PDOBase:
         else:
             self._deactivate_mapping()
 
+    def _update_nmt_membership(self):
+        """Register for NMT transitions only when entering or leaving OPERATIONAL
+        changes the behavior of this PDO (default COB-ID or enabled and mapped)
+        """
+        callbacks = self._node.nmt.operational_callbacks
+
+        if self._index < 4 or (self.enable and self._multiplexors):
+            callbacks[self] = self._update_nmt_state
+        else:
+            callbacks.pop(self, None)
+
     def _downloaded_cob_id(self, value: int):
         self._cob_id = value
         # TODO: check RTR flag to be cleared
@@ -50,6 +78,8 @@ class PDOBase:
         else:
             self._activate_mapping()
 
+        self._update_nmt_membership()
+
     def _downloaded_transmission_type(self, value: int):
         self.transmission_type = value
 
@@ -78,6 +108,7 @@ class PDOBase:
             self._cob_id |= 1 << 31
             self._deactivate_mapping()
 
+        self._update_nmt_membership()
         self._update_od_cob_id()
 
     @abstractmethod
@@ -85,14 +116,22 @@ class PDOBase:
         """write self._cob_id to object dictionary"""
 
     def _downloaded_map_length(self, length):
+        od = self._node.object_dictionary
         multiplexors = []
+        size = 0
 
         for subindex in range(1, length + 1):
-            value = self._node.object_dictionary.read(
-                self.MAPPING_ARRAY_INDEX + self._index, subindex
-            )
+            value = od.read(self.MAPPING_ARRAY_INDEX + self._index, subindex)
             index, subindex = value >> 16, (value >> 8) & 0xFF
             multiplexors.append((index, subindex))
+            size += (value & 0xFF) // 8
+
+        if size > self.max_size:
+            # keep the current mapping and abort the download
+            od.write(self.MAPPING_ARRAY_INDEX + self._index, 0, len(self._multiplexors))
+            raise SDODomainAbort(
+                0x06040042, (self.MAPPING_ARRAY_INDEX + self._index, 0)
+            )  # PDO length exceeded
 
         self._map(multiplexors)
 
@@ -102,6 +141,17 @@ class PDOBase:
 
     @mapping.setter
     def mapping(self, multiplexors: Sequence[TMultiplexor]):
+        size = 0
+
+        for multiplexor in multiplexors:
+            variable = self._node.object_dictionary.lookup(*multiplexor)
+            assert isinstance(variable, Variable), "Variable expected"
+            assert variable.size is not None, "Variable with fixed size expected"
+            size += variable.size
+
+        if size > self.max_size:
+            raise ValueError(f"Mapping exceeds {self.max_size} bytes")
+
         self._map(multiplexors)
         self._node.object_dictionary.write(
             self.MAPPING_ARRAY_INDEX + self._index, 0, len(multiplexors)
@@ -109,10 +159,7 @@ class PDOBase:
         for _entry, multiplexor in enumerate(multiplexors):
             index, subindex = multiplexor
             variable = self._node.object_dictionary.lookup(index, subindex)
-            assert isinstance(variable, Variable), "Variable expected"
-            # TODO: check if variable.size is None
-            # TODO: check if overall size <= 8
-            assert variable.size is not None
+            assert isinstance(variable, Variable) and variable.size is not None
             value = (index << 16) + (subindex << 8) + (variable.size * 8)
             self._node.object_dictionary.write(
                 self.MAPPING_ARRAY_INDEX + self._index, _entry + 1, value
@@ -122,6 +169,7 @@ class PDOBase:
         self._deactivate_mapping()
         self._multiplexors = tuple(multiplexors)
         self._activate_mapping()
+        self._update_nmt_membership()
 
     @abstractmethod
     def _activate_mapping(self):
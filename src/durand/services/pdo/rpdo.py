@@ -2,8 +2,9 @@ from typing import TYPE_CHECKING, Sequence, Callable, Any, Optional
 
 from durand.object_dictionary import Variable, Record, Array
 from durand.datatypes import DatatypeEnum as DT
+from durand.callback_handler import CallbackHandler, FailMode
 
-from .base import PDOBase
+from .base import PDOBase, frame_size
 
 if TYPE_CHECKING:
     from durand.node import Node
@@ -42,14 +43,20 @@ class RPDO(PDOBase):
 
         map_var = Variable(DT.UNSIGNED32, "rw", name="Mapped Object")
         map_array = Array(
-            map_var, length=8, mutable=True, name=f"RPDO {index + 1} Mapping Parameter"
+            map_var,
+            length=self.max_size,
+            mutable=True,
+            name=f"RPDO {index + 1} Mapping Parameter",
         )
         od[0x1600 + index] = map_array
 
         od.write(0x1600 + index, 0, 0)  # set number of mapped objects to 0
-        od.download_callbacks[(0x1600 + index, 0)].add(self._downloaded_map_length)
+        # an exceeded PDO length aborts the download of the number of entries
+        callbacks = CallbackHandler(fail_mode=FailMode.FIRST_FAIL)
+        callbacks.add(self._downloaded_map_length)
+        od.download_callbacks[(0x1600 + index, 0)] = callbacks
 
-        node.nmt.state_callbacks.add(self._update_nmt_state)
+        self._update_nmt_membership()
 
     def _set_transmission_type(self, value: int):
         self._deactivate_mapping()
@@ -86,8 +93,11 @@ class RPDO(PDOBase):
             variables.append(variable)
             expected_size += variable.size
 
+        # CAN FD frames may be padded to the next valid payload size
+        valid_sizes = (expected_size, frame_size(expected_size))
+
         def unpack(data: bytes):
-            if len(data) != expected_size:
+            if len(data) not in valid_sizes:
                 self.node.emcy.set(0x8210, 0)  # EMCY for RPDO with wrong size
                 return
 
@@ -3,9 +3,10 @@ import logging
 
 from durand.object_dictionary import Variable, Record, Array
 from durand.datatypes import DatatypeEnum as DT
+from durand.callback_handler import CallbackHandler, FailMode
 from durand import get_scheduler
 
-from .base import PDOBase
+from .base import PDOBase, frame_size
 
 if TYPE_CHECKING:
     from durand.node import Node
@@ -111,14 +112,20 @@ class TPDO(PDOBase):
 
         map_var = Variable(DT.UNSIGNED32, "rw", name="Mapped Object")
         map_array = Array(
-            map_var, length=8, mutable=True, name=f"TPDO {index + 1} Mapping Parameter"
+            map_var,
+            length=self.max_size,
+            mutable=True,
+            name=f"TPDO {index + 1} Mapping Parameter",
         )
         od[0x1A00 + index] = map_array
 
         od.write(0x1A00 + index, 0, 0)  # set number of mapped objects to 0
-        od.download_callbacks[(0x1A00 + index, 0)].add(self._downloaded_map_length)
+        # an exceeded PDO length aborts the download of the number of entries
+        callbacks = CallbackHandler(fail_mode=FailMode.FIRST_FAIL)
+        callbacks.add(self._downloaded_map_length)
+        od.download_callbacks[(0x1A00 + index, 0)] = callbacks
 
-        node.nmt.state_callbacks.add(self._update_nmt_state)
+        self._update_nmt_membership()
 
     def _set_transmission_type(self, value: int):
         if self._sync_handler:
@@ -208,4 +215,8 @@ class TPDO(PDOBase):
                 return
 
         data = b"".join(self._cache)
+
+        if len(data) > 8:  # pad to a valid CAN FD payload size
+            data = data.ljust(frame_size(len(data)), b"\x00")
+
         self._node.network.send(self._cob_id & 0x1FFF_FFFF, data)
@@ -1,3 +1,4 @@
 from .server import SDOServer
-from .download import BaseDownloadHandler
-from .upload import BaseUploadHandler
+from .dispatcher import SDODispatcher
+from .download import BaseDownloadHandler, FileDownloadHandler
+from .upload import BaseUploadHandler, FileUploadHandler, IterableUploadHandler
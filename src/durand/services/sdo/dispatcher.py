@@ -0,0 +1,186 @@
+from collections import deque
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Optional, Tuple
+import logging
+import threading
+
+from durand.object_dictionary import TMultiplexor
+from durand.services.nmt import StateEnum
+
+from .download import DownloadManager
+from .upload import UploadManager
+
+if TYPE_CHECKING:
+    from durand.node import Node
+    from .server import SDOServer
+
+
+log = logging.getLogger(__name__)
+
+
+class SDODispatcher:
+    """Central receive path for all SDO servers of a node
+
+    The dispatcher owns one table from RX COB-ID to SDO server. Only servers with
+    valid COB-IDs are entered, so disabled servers are not costing anything. It
+    registers a single NMT state callback for all servers and subscribes the
+    COB-IDs of the table while the node is pre-operational or operational.
+
+    Download and upload managers holding the state of a transfer are handed out
+    to a server when a request is processed and are returned to a pool when the
+    transfer is finished.
+
+    All responses are sent via a single TX queue, so servers processing their
+    requests on different worker threads are not sending concurrently.
+
+    upload_handler_callbacks and download_handler_callbacks map a multiplexor to
+    a callback creating a handler for this object. They are used by all servers
+    when the handler callback of the server is not providing a handler.
+    """
+
+    def __init__(self, node: "Node"):
+        self._node = node
+
+        self._servers: Dict[int, "SDOServer"] = {}  # RX COB-ID -> SDO server
+        self._default_server: Optional["SDOServer"] = None
+        self._active = False
+
+        self._pool_lock = threading.Lock()
+        self._download_pool: List[DownloadManager] = []
+        self._upload_pool: List[UploadManager] = []
+
+        self._tx_lock = threading.Lock()
+        self._tx_queue: Deque[Tuple[int, bytes]] = deque()
+        self._tx_busy = False
+
+        self.upload_handler_callbacks: Dict[TMultiplexor, Callable] = {}
+        self.download_handler_callbacks: Dict[TMultiplexor, Callable] = {}
+
+        node.nmt.state_callbacks.add(self._update_nmt_state)
+
+    @property
+    def active_servers(self) -> int:
+        """Number of SDO servers with valid COB-IDs"""
+        return len(self._servers)
+
+    def set_executor(self, executor: Optional[Executor]):
+        """Process the requests of all SDO servers on the given executor
+
+        Every SDO server is processing its requests in order, while requests for
+        different servers are processed concurrently on the workers of the
+        executor. See SDOServer.set_executor for a single server.
+
+        :param executor: executor (e.g. ThreadPoolExecutor) or None to process
+                         the requests in the receiving context
+        """
+        for server in self._node.sdo_servers:
+            server.set_executor(executor)
+
+    def add_server(self, server: "SDOServer"):
+        """Add a new SDO server (called when the server is created)"""
+        if server.index == 0:
+            self._default_server = server
+
+        self.register(server)
+
+    def register(self, server: "SDOServer"):
+        """Enter the server into the table when its COB-IDs are valid"""
+        cob_rx = server.cob_rx
+
+        if cob_rx is None or server.cob_tx is None:
+            return
+
+        self._servers[cob_rx & 0x7FF] = server
+
+        if self._active:
+            self._node.network.add_subscription(cob_rx & 0x7FF, self.handle_msg)
+
+    def unregister(self, server: "SDOServer"):
+        """Remove the server from the table (e.g. before its COB-IDs are changed)"""
+        cob_rx = server.cob_rx
+
+        if cob_rx is None or self._servers.get(cob_rx & 0x7FF) is not server:
+            return
+
+        del self._servers[cob_rx & 0x7FF]
+
+        if self._active:
+            self._node.network.remove_subscription(cob_rx & 0x7FF)
+
+    def _update_nmt_state(self, state: StateEnum):
+        if self._active and state in (StateEnum.STOPPED, StateEnum.INITIALISATION):
+            self._node.network.update_subscriptions(remove=tuple(self._servers))
+            self._active = False
+            return
+
+        if not self._active and state in (
+            StateEnum.PRE_OPERATIONAL,
+            StateEnum.OPERATIONAL,
+        ):
+            if self._default_server is not None:
+                # the node id may have changed (e.g. via LSS)
+                self._default_server.update_node_id()
+
+            self._node.network.update_subscriptions(
+                add=dict.fromkeys(self._servers, self.handle_msg)
+            )
+            self._active = True
+
+    def handle_msg(self, cob_id: int, msg: bytes) -> None:
+        server = self._servers.get(cob_id)
+
+        if server is not None:
+            server.handle_msg(cob_id, msg)
+
+    def acquire_download_manager(self, server: "SDOServer") -> DownloadManager:
+        with self._pool_lock:
+            if self._download_pool:
+                manager = self._download_pool.pop()
+                manager.bind(server)
+                return manager
+
+        return DownloadManager(server)
+
+    def acquire_upload_manager(self, server: "SDOServer") -> UploadManager:
+        with self._pool_lock:
+            if self._upload_pool:
+                manager = self._upload_pool.pop()
+                manager.bind(server)
+                return manager
+
+        return UploadManager(server)
+
+    def release_download_manager(self, manager: DownloadManager):
+        with self._pool_lock:
+            self._download_pool.append(manager)
+
+    def release_upload_manager(self, manager: UploadManager):
+        with self._pool_lock:
+            self._upload_pool.append(manager)
+
+    def send(self, cob_id: int, data: bytes):
+        """Put a response into the TX queue
+
+        The calling thread is sending the queued responses unless another thread
+        is already doing so.
+        """
+        with self._tx_lock:
+            self._tx_queue.append((cob_id, data))
+
+            if self._tx_busy:
+                return
+
+            self._tx_busy = True
+
+        while True:
+            with self._tx_lock:
+                if not self._tx_queue:
+                    self._tx_busy = False
+                    return
+
+                cob_id, data = self._tx_queue.popleft()
+
+            try:
+                self._node.network.send(cob_id, data)
+            except Exception:
+                log.exception("Sending SDO response on 0x%X failed", cob_id)
@@ -1,9 +1,14 @@
+import mmap
+import os
 import struct
+import tempfile
+import time
 from binascii import crc_hqx
-from typing import Optional
+from typing import Optional, Union
 
 from .server import SDODomainAbort, SDOServer, TransferState, SDO_STRUCT
 from ...object_dictionary import Variable, TMultiplexor
+from ...datatypes import DatatypeEnum
 
 
 class BaseDownloadHandler:
@@ -20,39 +25,217 @@ class BaseDownloadHandler:
         """on_abort is called when the transfer was aborted"""
 
 
+class FileDownloadHandler(BaseDownloadHandler):
+    """Download handler writing the received data into a file
+
+    The data is written into a temporary file in the same directory, which is
+    renamed to the given path when the transfer is finished. An existing file is
+    only replaced on success. Received segments are collected in a buffer and
+    written in chunks of buffer_size bytes.
+
+    :param path: path of the file to be written
+    :param size: announced size of the transfer (used to preallocate the file)
+    :param buffer_size: number of bytes collected before writing to the file
+    """
+
+    def __init__(self, path: str, size: Optional[int] = None, buffer_size=0x10000):
+        self._path = path
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self._temp_path = tempfile.mkstemp(
+            dir=directory, prefix=".", suffix=".part"
+        )
+        self._file = os.fdopen(fd, "wb")
+
+        if size:
+            self._file.truncate(size)
+
+    def on_receive(self, data: bytes):
+        self._buffer += data
+
+        if len(self._buffer) >= self._buffer_size:
+            self._flush()
+
+    def _flush(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    def on_finish(self):
+        try:
+            self._flush()
+            self._file.truncate()  # remove preallocated space when transfer is shorter
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._temp_path, self._path)
+        except Exception:
+            self.on_abort()
+            raise
+
+    def on_abort(self):
+        self._file.close()
+        self._buffer.clear()
+
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+class DownloadBuffer:
+    """Collecting the downloaded data when no download handler is used
+
+    When the size is announced, the buffer is preallocated and the data is written
+    in place. Above SPILL_THRESHOLD bytes a memory-mapped temporary file is used
+    instead of memory and the value is handed over as memoryview of that file
+    (instead of bytes) to avoid copying.
+
+    :param size: announced size or None
+    """
+
+    SPILL_THRESHOLD = 0x100000
+
+    def __init__(self, size: Optional[int] = None):
+        self._size = size
+        self._length = 0
+
+        self._data: Union[bytearray, mmap.mmap]
+
+        if size is None:
+            self._data = bytearray()
+        elif size > self.SPILL_THRESHOLD:
+            with tempfile.TemporaryFile() as file:
+                file.truncate(size)
+                self._data = mmap.mmap(file.fileno(), size)
+        else:
+            self._data = bytearray(size)
+
+    def __len__(self):
+        return self._length
+
+    def write(self, data: bytes):
+        """Append data to the buffer
+
+        :param data: data to be appended
+        :raises ValueError: when the announced size is exceeded
+        """
+        if self._size is None:
+            self._data += data
+        else:
+            end = self._length + len(data)
+
+            if end > self._size:
+                raise ValueError("Announced size exceeded")
+
+            self._data[self._length : end] = data
+
+        self._length += len(data)
+
+    def crc(self, start: int, crc: int) -> int:
+        """Update the CRC with the data starting at the given offset
+
+        :param start: offset in the buffer
+        :param crc: CRC value to be updated
+        :returns: updated CRC
+        """
+        with memoryview(self._data) as view:
+            return crc_hqx(view[start : self._length], crc)
+
+    def value(self) -> Union[bytes, memoryview]:
+        """The received data as bytes or as memoryview when spilled to a file
+        (the buffer has not to be used afterwards)
+        """
+        view = memoryview(self._data)[: self._length]
+
+        if isinstance(self._data, mmap.mmap):
+            return view
+
+        with view:
+            return bytes(view)
+
+
 class DownloadManager:
+    # limits for the block size used in block downloads
+    MAX_BLOCK_SIZE = 127
+    BLOCK_SIZE_INCREMENT = 8
+
+    # maximum time in seconds the handler should need to process a block
+    HANDLER_TIME_LIMIT = 0.1
+
     def __init__(self, server: SDOServer):
         self._server = server
 
-        self._handler_callback = None
         self._handler: Optional[BaseDownloadHandler] = None
 
         self._multiplexor: Optional[TMultiplexor] = None
         self._state = TransferState.NONE
 
-        self._buffer = bytearray()
+        self._buffer: Optional[DownloadBuffer] = None
 
         # used for block transfer
-        self._sequence_number = 1
+        self._sequence_number = 1  # next expected sequence number
+        self._sequence_error = False
         self._crc: Optional[int] = None
+        self._block_size = self.MAX_BLOCK_SIZE
+        self._handler_time = 0.0  # time used by handler in current block
+        self._block_start = 0  # offset in buffer where the current block starts
+        self._last_segment = b""
 
         # used for segmented transfer
         self._toggle_bit = False
 
+    def bind(self, server: SDOServer):
+        """Bind a pooled manager to another SDO server"""
+        self._server = server
+
     def set_handler_callback(self, callback):
-        self._handler_callback = callback
+        self._server.download_handler_callback = callback
 
     @property
     def block_transfer_active(self):
         return self._state == TransferState.BLOCK
 
+    @property
+    def transfer_active(self):
+        return self._state != TransferState.NONE
+
+    def abort_transfer(self) -> Optional[TMultiplexor]:
+        """Abort the active transfer (e.g. on timeout) and release the handler
+
+        :returns: multiplexor of the aborted transfer or None if no transfer was active
+        """
+        if self._state == TransferState.NONE:
+            return None
+
+        self._abort()
+        return self._multiplexor
+
     def _init(self, new_state: TransferState):
         self._state = new_state
 
         self._handler = None
         self._sequence_number = 1
         self._toggle_bit = False
-        self._buffer.clear()
+        self._buffer = None
+        self._block_start = 0
+        self._last_segment = b""
+
+    def _setup(self, index: int, subindex: int, size: Optional[int]):
+        node = self._server.node
+        handler_callback = self._server.download_handler_callback
+
+        if handler_callback:
+            self._handler = handler_callback(node, index, subindex, size)
+
+        if self._handler is None:
+            callbacks = node.sdo_dispatcher.download_handler_callbacks
+            handler_callback = callbacks.get((index, subindex), None)
+
+            if handler_callback:
+                self._handler = handler_callback(node, index, subindex, size)
+
+        if self._handler is None:
+            self._buffer = DownloadBuffer(size)
 
     def on_abort(self, multiplexor):
         if self._state != TransferState.NONE and self._multiplexor == multiplexor:
@@ -60,15 +243,26 @@ class DownloadManager:
 
     def _receive(self, data: bytes):
         if self._handler:
+            start_time = time.perf_counter()
+
             try:
                 self._handler.on_receive(data)
+                self._handler_time += time.perf_counter() - start_time
             except Exception as exc:
                 self._abort()
                 raise SDODomainAbort(
                     0x08000020, self._multiplexor
                 ) from exc  # data can't be stored
         else:
-            self._buffer.extend(data)
+            assert self._buffer is not None, "Buffer expected"
+
+            try:
+                self._buffer.write(data)
+            except ValueError as exc:
+                self._abort()
+                raise SDODomainAbort(
+                    0x06070012, self._multiplexor
+                ) from exc  # length of service parameter too high
 
     def _abort(self):
         if self._handler:
@@ -81,8 +275,13 @@ class DownloadManager:
             if self._handler:
                 self._handler.on_finish()
             else:
+                assert self._buffer is not None, "Buffer expected"
                 variable = self._server.lookup(*self._multiplexor)
-                value = variable.unpack(self._buffer)
+
+                if variable.datatype == DatatypeEnum.DOMAIN:
+                    value = self._buffer.value()  # memoryview when spilled
+                else:
+                    value = variable.unpack(self._buffer.value())
 
                 if variable.minimum is not None and value < variable.minimum:
                     raise SDODomainAbort(0x06090032, self._multiplexor)  # value too low
@@ -129,13 +328,9 @@ class DownloadManager:
             self._multiplexor = (index, subindex)
 
             size = int.from_bytes(msg[4:], "little")
+            self._setup(index, subindex, size if cmd & 0x01 else None)
 
-            if self._handler_callback:
-                self._handler = self._handler_callback(
-                    self._server.node, index, subindex, size if cmd & 0x01 else None
-                )
-
-            self._server.node.network.send(self._server.cob_tx, response)
+            self._server.send(response)
             return
 
         if cmd & 0x01:  # size specified
@@ -148,17 +343,12 @@ class DownloadManager:
             size = variable.size
 
         self._init(TransferState.NONE)
-
-        if self._handler_callback:
-            self._handler = self._handler_callback(
-                self._server.node, index, subindex, size
-            )
-
         self._multiplexor = (index, subindex)
+        self._setup(index, subindex, size)
         self._receive(msg[4 : 4 + size])
         self._finish()
 
-        self._server.node.network.send(self._server.cob_tx, response)
+        self._server.send(response)
 
     def download_segment(self, msg: bytes):
         if self._state != TransferState.SEGMENT:
@@ -183,9 +373,7 @@ class DownloadManager:
             self._finish()
 
         cmd = 0x20 + (toggle_bit << 4)
-        self._server.node.network.send(
-            self._server.cob_tx, cmd.to_bytes(1, "little") + bytes(7)
-        )
+        self._server.send(cmd.to_bytes(1, "little") + bytes(7))
 
     def download_block_init(self, msg: bytes):
         if self._state != TransferState.NONE:
@@ -210,21 +398,25 @@ class DownloadManager:
         else:
             size = None
 
-        if self._handler_callback:
-            self._handler = self._handler_callback(
-                self._server.node, index, subindex, size
-            )
+        self._setup(index, subindex, size)
 
         self._sequence_number = 1
+        self._sequence_error = False
+        self._block_size = self.MAX_BLOCK_SIZE
+        self._handler_time = 0.0
 
         cmd = 0xA4
-        self._server.node.network.send(
-            self._server.cob_tx,
-            cmd.to_bytes(1, "little") + msg[1:4] + b"\x7F" + bytes(3),
+        self._server.send(
+            cmd.to_bytes(1, "little")
+            + msg[1:4]
+            + self._block_size.to_bytes(1, "little")
+            + bytes(3),
         )
 
     def download_sub_block(self, msg: bytes):
-        if self._sequence_number != msg[0] & 0x7F:
+        sequence_number = msg[0] & 0x7F
+
+        if not 1 <= sequence_number <= self._block_size:
             self._abort()
             raise SDODomainAbort(
                 0x05040003, self._multiplexor
@@ -232,28 +424,67 @@ class DownloadManager:
 
         last_sub_block = bool(msg[0] & 0x80)
 
-        data = msg[1:]
+        if sequence_number != self._sequence_number:
+            # a segment was lost - the following segments of this block are ignored
+            # and the client is repeating them after the acknowledge
+            self._sequence_error = True
+        elif not self._sequence_error:
+            data = msg[1:]
+
+            if last_sub_block:
+                # number of valid bytes is not known until block end
+                self._last_segment = bytes(data)
+                self._state = TransferState.BLOCK_END
+            else:
+                if self._crc is not None and self._handler:
+                    self._crc = crc_hqx(data, self._crc)
+
+                self._receive(data)
 
-        if self._crc is not None and not last_sub_block:
-            self._crc = crc_hqx(data, self._crc)
+            self._sequence_number += 1
 
-        if not last_sub_block:
-            self._receive(data)
-        else:
-            self._buffer.extend(data)
-            self._state = TransferState.BLOCK_END
+        if sequence_number == self._block_size or last_sub_block:
+            acknowledged_sequence = self._sequence_number - 1
+            self._block_size = self._next_block_size(acknowledged_sequence)
+
+            if self._crc is not None and self._buffer is not None:
+                # CRC is calculated over the whole sub-block in the buffer
+                self._crc = self._buffer.crc(self._block_start, self._crc)
+                self._block_start = len(self._buffer)
 
-        if self._sequence_number == 127 or last_sub_block:
-            self._server.node.network.send(
-                self._server.cob_tx,
+            self._server.send(
                 b"\xA2"
-                + self._sequence_number.to_bytes(1, "little")
-                + b"\x7F"
+                + acknowledged_sequence.to_bytes(1, "little")
+                + self._block_size.to_bytes(1, "little")
                 + bytes(5),
             )
+
             self._sequence_number = 1
+            self._sequence_error = False
+            self._handler_time = 0.0
+
+    def _next_block_size(self, acknowledged_sequence: int) -> int:
+        """Calculate the block size for the next block
+
+        The block size is halved when segments were lost and increased when the
+        block was received completely. It's limited, so the handler is able to
+        process a block within HANDLER_TIME_LIMIT.
+
+        :param acknowledged_sequence: number of successfully received segments
+        :returns: the new block size
+        """
+        if self._sequence_error:
+            block_size = self._block_size // 2
         else:
-            self._sequence_number += 1
+            block_size = self._block_size + self.BLOCK_SIZE_INCREMENT
+
+        if acknowledged_sequence and self._handler_time:
+            time_per_segment = self._handler_time / acknowledged_sequence
+            block_size = min(
+                block_size, int(self.HANDLER_TIME_LIMIT / time_per_segment)
+            )
+
+        return max(1, min(block_size, self.MAX_BLOCK_SIZE))
 
     def download_block_end(self, msg: bytes):
         if self._state != TransferState.BLOCK_END:
@@ -261,18 +492,15 @@ class DownloadManager:
             raise SDODomainAbort(0x05040001)  # client command specificer not valid
 
         size = 7 - ((msg[0] >> 2) & 0x07)
+        data = self._last_segment[:size]
 
         if self._crc is not None:
-            self._crc = crc_hqx(self._buffer[-7:][:size], self._crc)
+            self._crc = crc_hqx(data, self._crc)
             if self._crc != struct.unpack("<H", msg[1:3])[0]:
                 self._abort()
                 raise SDODomainAbort(0x05040004, self._multiplexor)  # CRC invalid
 
-        if self._handler:
-            self._receive(self._buffer[:size])
-        elif size != 7:
-            del self._buffer[size % 7 - 7 :]
-
+        self._receive(data)
         self._finish()
 
-        self._server.node.network.send(self._server.cob_tx, b"\xA1" + bytes(7))
+        self._server.send(b"\xA1" + bytes(7))
@@ -1,15 +1,21 @@
 import struct
+from collections import deque
+from concurrent.futures import Executor
 from enum import Enum
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Deque, Optional
 import logging
+import threading
 
 from durand.datatypes import DatatypeEnum as DT
 from durand.object_dictionary import TMultiplexor, Variable, Record
-from durand.services.nmt import StateEnum
+from durand.scheduler import get_scheduler
 
 
 if TYPE_CHECKING:
     from durand.node import Node
+    from .dispatcher import SDODispatcher
+    from .download import DownloadManager
+    from .upload import UploadManager
 
 
 log = logging.getLogger(__name__)
@@ -17,6 +23,8 @@ log = logging.getLogger(__name__)
 
 SDO_STRUCT = struct.Struct("<BHB")
 
+TIMEOUT_CHECK_DIVIDER = 4  # number of timeout checks per timeout period
+
 
 class SDODomainAbort(Exception):
     def __init__(self, code: int, multiplexor: TMultiplexor = None):
@@ -32,22 +40,34 @@ class SDOServer:
     def __init__(self, node: "Node", index=0):
         self._node = node
         self._index = index
-        self._stopped = True
+        self._dispatcher: "SDODispatcher" = node.sdo_dispatcher
 
-        from .download import DownloadManager
-        from .upload import UploadManager
+        self._executor: Optional[Executor] = None
+        self._pending_msgs: Optional[Deque[bytes]] = None
+        self._executor_lock: Optional[threading.Lock] = None
+        self._executor_busy = False
 
-        self.download_manager = DownloadManager(self)
-        self.upload_manager = UploadManager(self)
+        # protects the transfer state against the timeout check of the scheduler
+        self._lock = threading.Lock()
 
-        if index == 0:
-            self._cob_rx = 0x600 + self._node.node_id
-        else:
-            self._cob_rx = 0x80000000
+        self._timeout: Optional[float] = None
+        self._timeout_lock = threading.Lock()  # protects the timeout handle
+        self._timeout_handle = None
+        self._checks = 0  # number of timeout checks done
+        self._last_activity = 0  # number of timeout checks at the last request
+
+        # transfer state, taken from the pool of the dispatcher when needed
+        self._download_manager: Optional["DownloadManager"] = None
+        self._upload_manager: Optional["UploadManager"] = None
+
+        self.download_handler_callback = None
+        self.upload_handler_callback = None
 
         if index == 0:
+            self._cob_rx = 0x600 + self._node.node_id
             self._cob_tx = 0x580 + self._node.node_id
         else:
+            self._cob_rx = 0x80000000
             self._cob_tx = 0x80000000
 
         od = self._node.object_dictionary
@@ -73,73 +93,73 @@ class SDOServer:
                 DT.UNSIGNED8, "rw", name="Node-ID of the SDO Client"
             )
 
-            self._node.nmt.state_callbacks.add(self._update_subscription)
-        else:
-            self._node.nmt.state_callbacks.add(self._update_node)
-
         od[0x1200 + index] = server_record
 
-        self._handle_cs_dict = {
-            0: self.download_manager.download_segment,
-            1: self.download_manager.init_download,
-            2: self.upload_manager.init_upload,
-            3: self.upload_manager.upload_segment,
-            5: self.upload_manager.init_upload,
-            6: self._handle_download_block,
-        }
+        self._dispatcher.add_server(self)
 
     @property
     def node(self):
         return self._node
 
-    def _update_subscription(self, state: StateEnum):
-        if not self._stopped and state in (StateEnum.STOPPED, StateEnum.INITIALISATION):
-            self._node.network.remove_subscription(self._cob_rx)
-            self._stopped = True
-            return
+    @property
+    def index(self) -> int:
+        return self._index
+
+    @property
+    def download_manager(self) -> "DownloadManager":
+        if self._download_manager is None:
+            self._download_manager = self._dispatcher.acquire_download_manager(self)
+
+        return self._download_manager
+
+    @property
+    def upload_manager(self) -> "UploadManager":
+        if self._upload_manager is None:
+            self._upload_manager = self._dispatcher.acquire_upload_manager(self)
+
+        return self._upload_manager
 
+    @property
+    def transfer_active(self) -> bool:
+        return (
+            self._download_manager is not None
+            and self._download_manager.transfer_active
+        ) or (self._upload_manager is not None and self._upload_manager.transfer_active)
+
+    def _release_managers(self):
+        """Return the managers without an active transfer to the pool"""
         if (
-            self._stopped
-            and state in (StateEnum.PRE_OPERATIONAL, StateEnum.OPERATIONAL)
-            and not (self._cob_rx | self._cob_tx) & (1 << 31)
+            self._download_manager is not None
+            and not self._download_manager.transfer_active
         ):
-            self._node.network.add_subscription(self._cob_rx, self.handle_msg)
-            self._stopped = False
-
-    def _update_node(self, state: StateEnum):
-        if not self._stopped and state in (StateEnum.STOPPED, StateEnum.INITIALISATION):
-            self._node.network.remove_subscription(self._cob_rx)
-            self._stopped = True
-            return
+            self._dispatcher.release_download_manager(self._download_manager)
+            self._download_manager = None
 
-        if self._stopped and state in (
-            StateEnum.PRE_OPERATIONAL,
-            StateEnum.OPERATIONAL,
+        if (
+            self._upload_manager is not None
+            and not self._upload_manager.transfer_active
         ):
-            self._cob_rx = 0x600 + self._node.node_id
-            self._cob_tx = 0x580 + self._node.node_id
-            self._node.network.add_subscription(self._cob_rx, self.handle_msg)
-            self._stopped = False
+            self._dispatcher.release_upload_manager(self._upload_manager)
+            self._upload_manager = None
+
+    def update_node_id(self):
+        """Update the COB-IDs of the default SDO server to the current node id"""
+        self._dispatcher.unregister(self)
+        self._cob_rx = 0x600 + self._node.node_id
+        self._cob_tx = 0x580 + self._node.node_id
+        self._dispatcher.register(self)
 
     def _update_cob_rx(self, value: int):
         # bit 31: 0 - valid, 1 - invalid
-        if not (self._cob_rx | self._cob_tx) & (1 << 31):
-            self._node.network.remove_subscription(self._cob_rx & 0x7FF)
-
-        if not value & (1 << 31) and not self._cob_tx & (1 << 31):
-            self._node.network.add_subscription(value & 0x7FF, self.handle_msg)
-
+        self._dispatcher.unregister(self)
         self._cob_rx = value
+        self._dispatcher.register(self)
 
     def _update_cob_tx(self, value: int):
         # bit 31: 0 - valid, 1 - invalid
-        if not ((self._cob_rx | self._cob_tx) & (1 << 31)) and value & (1 << 31):
-            self._node.network.remove_subscription(self._cob_rx & 0x7FF)
-
-        if not value & (1 << 31) and not self._cob_rx & (1 << 31):
-            self._node.network.add_subscription(self._cob_rx & 0x7FF, self.handle_msg)
-
+        self._dispatcher.unregister(self)
         self._cob_tx = value
+        self._dispatcher.register(self)
 
     @property
     def cob_rx(self) -> int:
@@ -177,33 +197,214 @@ class SDOServer:
     def client_node_id(self, value: int):
         return self._node.object_dictionary.write(0x1200 + self._index, 3, value)
 
+    @property
+    def timeout(self) -> Optional[float]:
+        """Timeout in seconds for segmented and block transfers (None to disable)
+
+        When no request is received within the timeout, the active transfer is
+        aborted (abort code 0x05040000) and the handler or buffer is released.
+
+        Instead of restarting a timer on every request, a periodic check with a
+        quarter of the timeout is running while a transfer is active, so the
+        abort is sent up to a quarter of the timeout later. The check is started
+        in the receiving context, so the scheduler is not used by the threads of
+        an executor (see set_executor).
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value: Optional[float]):
+        with self._lock:
+            # a running check stops itself or takes the new timeout when due
+            self._timeout = value
+            self._last_activity = self._checks
+            self._start_timeout_check()
+
+    def _start_timeout_check(self, force=False):
+        """Start the periodic check (force when requests are processed on an
+        executor, as the transfer state is not known yet)
+        """
+        if not self._timeout or not (force or self.transfer_active):
+            return
+
+        with self._timeout_lock:
+            if self._timeout_handle is None:
+                self._timeout_handle = get_scheduler().add(
+                    self._timeout / TIMEOUT_CHECK_DIVIDER, self._check_timeout
+                )
+
+    def _check_timeout(self):
+        with self._timeout_lock:
+            self._timeout_handle = None
+
+        if not self._lock.acquire(blocking=False):
+            # a request is processed right now (e.g. on an executor)
+            self._start_timeout_check(force=True)
+            return
+
+        try:
+            self._checks += 1
+
+            if not self._timeout:
+                return
+
+            if not self.transfer_active:
+                if self._executor_busy:  # requests are pending
+                    self._start_timeout_check(force=True)
+                return
+
+            if self._checks - self._last_activity <= TIMEOUT_CHECK_DIVIDER:
+                self._start_timeout_check()
+                return
+
+            self._transfer_timed_out()
+        finally:
+            self._lock.release()
+
+    def _transfer_timed_out(self):
+        multiplexor = None
+
+        if self._download_manager is not None:
+            multiplexor = self._download_manager.abort_transfer()
+
+        if multiplexor is None and self._upload_manager is not None:
+            multiplexor = self._upload_manager.abort_transfer()
+
+        self._release_managers()
+
+        if multiplexor is None:
+            return
+
+        log.debug("SDO transfer of 0x%04X:%d timed out", *multiplexor)
+
+        if self.cob_tx is None:
+            return
+
+        response = SDO_STRUCT.pack(0x80, *multiplexor) + struct.pack("<I", 0x05040000)
+        self.send(response)
+
+    def send(self, data: bytes):
+        """Send a response to the SDO client via the TX queue of the dispatcher"""
+        self._dispatcher.send(self._cob_tx, data)
+
+    def set_executor(self, executor: Optional[Executor]):
+        """Process the requests of this SDO server on the given executor.
+
+        The receive path only queues the request and returns immediately, so slow
+        up- and download handlers are not blocking the processing of other COB-IDs.
+        Requests are processed in order and the response is sent when the
+        processing (including the handler call) is completed. The scheduler is
+        only used in the receiving context. When the executor is shut down, the
+        requests are processed in the receiving context again.
+
+        :param executor: executor (e.g. ThreadPoolExecutor) or None to process
+                         the requests in the receiving context
+        """
+        if self._executor_lock is None:
+            self._pending_msgs = deque()
+            self._executor_lock = threading.Lock()
+
+        self._executor = executor
+
     def handle_msg(self, cob_id: int, msg: bytes) -> None:
         assert (
             cob_id == self._cob_rx
         ), "Cob RX id invalid (0x{cob_id:X}, expected 0x{self._cob_rx:X})"
 
+        executor = self._executor
+
+        if executor is None:
+            self._process_msg(msg)
+            return
+
+        self._last_activity = self._checks
+        self._start_timeout_check(force=True)
+
+        with self._executor_lock:
+            self._pending_msgs.append(msg)
+
+            if self._executor_busy:
+                return
+
+            self._executor_busy = True
+
+        try:
+            executor.submit(self._process_pending_msgs)
+        except RuntimeError:  # executor is shut down
+            log.warning("SDO executor not available, processing in receiving context")
+            self._process_pending_msgs()
+
+    def _process_pending_msgs(self):
+        finished = False
+
+        try:
+            while True:
+                with self._executor_lock:
+                    if not self._pending_msgs:
+                        self._executor_busy = False
+                        finished = True
+                        return
+
+                    msg = self._pending_msgs.popleft()
+
+                try:
+                    self._process_msg(msg)
+                except Exception:
+                    log.exception("Processing SDO request %r failed", msg)
+        finally:
+            if not finished:  # the next request starts processing again
+                with self._executor_lock:
+                    self._executor_busy = False
+
+    def _process_msg(self, msg: bytes):
+        with self._lock:
+            self._last_activity = self._checks
+
+            try:
+                self._handle_request(msg)
+            finally:
+                self._release_managers()
+
+                if self._executor is None:  # otherwise started by handle_msg
+                    self._start_timeout_check()
+
+    def _handle_request(self, msg: bytes):
         try:
             ccs = (msg[0] & 0xE0) >> 5
 
             if msg[0] == 0x80:  # abort
                 return self.abort(msg)
-            if self.download_manager.block_transfer_active:
-                return self.download_manager.download_sub_block(msg)
-            if self.upload_manager.block_transfer_active:
-                return self.upload_manager.upload_sub_block(msg)
+            if (
+                self._download_manager is not None
+                and self._download_manager.block_transfer_active
+            ):
+                return self._download_manager.download_sub_block(msg)
+            if (
+                self._upload_manager is not None
+                and self._upload_manager.block_transfer_active
+            ):
+                return self._upload_manager.upload_sub_block(msg)
             # TODO: handle active download or upload by a state machine
 
-            try:
-                return self._handle_cs_dict[ccs](msg)
-            except KeyError as exc:  # ccs not found
-                raise SDODomainAbort(0x05040001) from exc  # SDO command not implemented
+            if ccs == 0:
+                return self.download_manager.download_segment(msg)
+            if ccs == 1:
+                return self.download_manager.init_download(msg)
+            if ccs in (2, 5):
+                return self.upload_manager.init_upload(msg)
+            if ccs == 3:
+                return self.upload_manager.upload_segment(msg)
+            if ccs == 6:
+                return self._handle_download_block(msg)
+
+            raise SDODomainAbort(0x05040001)  # SDO command not implemented
         except SDODomainAbort as exc:
             index, subindex = 0, 0
             if exc.multiplexor:
                 index, subindex = exc.multiplexor
             response = SDO_STRUCT.pack(0x80, index, subindex)
             response += struct.pack("<I", exc.code)
-            self._node.network.send(self._cob_tx, response)
+            self.send(response)
         except Exception as exc:
             if len(msg) >= 4:
                 _, index, subindex = SDO_STRUCT.unpack(msg[:4])
@@ -214,7 +415,7 @@ class SDOServer:
             log.debug(f"{exc!r} during processing {msg!r}")
 
             response = SDO_STRUCT.pack(0x80, index, subindex) + b"\x00\x00\x00\x08"
-            self._node.network.send(self._cob_tx, response)  # report general error
+            self.send(response)  # report general error
 
     def _handle_download_block(self, msg: bytes):
         if msg[0] & 0x01:  # end block transfer
@@ -248,5 +449,7 @@ class SDOServer:
             # if index:subindex not available - there is nothing to abort
             return
 
-        self.download_manager.on_abort((index, subindex))
-        self.upload_manager.on_abort((index, subindex))
+        if self._download_manager is not None:
+            self._download_manager.on_abort((index, subindex))
+        if self._upload_manager is not None:
+            self._upload_manager.on_abort((index, subindex))
@@ -1,5 +1,7 @@
+import mmap
+import os
 import struct
-from typing import Optional
+from typing import Iterable, Optional
 from abc import ABCMeta, abstractmethod
 from binascii import crc_hqx
 
@@ -26,17 +28,101 @@ class BaseUploadHandler:
         """on_abort is called when the transfer was aborted"""
 
 
+class FileUploadHandler(BaseUploadHandler):
+    """Upload handler providing the content of a file
+
+    The file is memory-mapped and on_read returns slices of the mapping without
+    copying the data.
+
+    :param path: path of the file to be uploaded
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+
+        self._mmap: Optional[mmap.mmap] = None
+        self._view = memoryview(b"")
+        self._offset = 0
+
+        if self.size:  # empty files can't be mapped
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+
+    def on_read(self, size: int) -> memoryview:
+        data = self._view[self._offset : self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def on_finish(self):
+        self._close()
+
+    def on_abort(self):
+        self._close()
+
+    def _close(self):
+        self._view.release()
+
+        if self._mmap is not None:
+            self._mmap.close()
+
+        self._file.close()
+
+
+class IterableUploadHandler(BaseUploadHandler):
+    """Upload handler pulling the data on demand from an iterable of chunks
+
+    The chunks are not joined, so a generator producing the data piece by piece
+    can be uploaded without keeping the whole data in memory.
+
+    :param chunks: iterable providing bytes-like chunks
+    :param size: size to be announced to the client (None if unknown)
+    """
+
+    def __init__(self, chunks: Iterable[bytes], size: Optional[int] = None):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+        self.size = size
+
+    def on_read(self, size: int) -> memoryview:
+        while not self._chunk:
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return self._chunk
+
+        data = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return data
+
+    def on_abort(self):
+        close = getattr(self._chunks, "close", None)
+
+        if close is not None:  # stop a generator
+            close()
+
+
+# number of bytes requested from an upload handler at once
+READ_AHEAD_SIZE = 4096
+
+
 class StreamBase(metaclass=ABCMeta):
+    """Source of the data to be uploaded.
+
+    peek and read are returning bytes-like objects (e.g. memoryviews), which are
+    only valid until the next call of peek or read.
+    """
+
     size = 0
 
     @abstractmethod
-    def peek(self, size: int) -> bytes:
+    def peek(self, size: int) -> memoryview:
         """Getting bytes without removing it from the source
         :param size: number of bytes to peek
         """
 
     @abstractmethod
-    def read(self, size: int) -> bytes:
+    def read(self, size: int) -> memoryview:
         """Read bytes (with removing them from the source)
         :param size: number of bytes to read
         """
@@ -51,34 +137,75 @@ class StreamBase(metaclass=ABCMeta):
 
 
 class HandlerStream(StreamBase):
-    def __init__(self, upload_handler: BaseUploadHandler):
+    """Stream reading ahead from an upload handler into a preallocated buffer
+
+    The buffer is used like a ring: consumed data is only skipped and the pending
+    data is moved to the start of the buffer when more space is needed.
+    """
+
+    def __init__(
+        self, upload_handler: BaseUploadHandler, read_ahead: int = READ_AHEAD_SIZE
+    ):
         self._handler = upload_handler
         self.size = upload_handler.size
-        self._buffer = bytearray()
+        self._read_ahead = read_ahead
+
+        self._view = memoryview(bytearray(2 * read_ahead))
+        self._start = 0  # start of pending data in buffer
+        self._end = 0  # end of pending data in buffer
+        self._eof = False
+
+    def _make_room(self, size: int):
+        """Assure space for size bytes behind the pending data"""
+        pending = self._end - self._start
+
+        if self._end + size <= len(self._view):
+            return
+
+        if pending + size > len(self._view):
+            # views handed out are still referencing the old buffer
+            view = memoryview(bytearray(max(pending + size, 2 * len(self._view))))
+            view[:pending] = self._view[self._start : self._end]
+            self._view = view
+        else:
+            self._view[:pending] = self._view[self._start : self._end]
+
+        self._start, self._end = 0, pending
 
     def _extend(self, size: int):
-        missing_bytes = size - len(self._buffer)
+        missing_bytes = size - (self._end - self._start)
 
-        if missing_bytes > 0:
-            self._buffer.extend(self._handler.on_read(missing_bytes))
+        while missing_bytes > 0 and not self._eof:
+            request_size = max(missing_bytes, self._read_ahead)
+            self._make_room(request_size)
 
-    def peek(self, size: int) -> bytes:
-        self._extend(size)
-        return self._buffer[:size]
+            data = self._handler.on_read(request_size)
+
+            if not data:
+                self._eof = True
+                return
+
+            self._make_room(len(data))
+            self._view[self._end : self._end + len(data)] = data
+            self._end += len(data)
+            missing_bytes -= len(data)
 
-    def read(self, size: int) -> bytes:
+    def peek(self, size: int) -> memoryview:
         self._extend(size)
-        data = self._buffer[:size]
-        del self._buffer[:size]
+        return self._view[self._start : min(self._start + size, self._end)]
+
+    def read(self, size: int) -> memoryview:
+        data = self.peek(size)
+        self._start += len(data)
         return data
 
     def abort(self):
         self._handler.on_abort()
-        self._buffer.clear()
+        self._view = memoryview(b"")
 
     def release(self):
         self._handler.on_finish()
-        self._buffer.clear()
+        self._view = memoryview(b"")
 
 
 class FixedStream(StreamBase):
@@ -86,11 +213,11 @@ class FixedStream(StreamBase):
         self._buffer = memoryview(data)
         self.size = len(self._buffer)
 
-    def peek(self, size: int) -> bytes:
-        return bytes(self._buffer[:size])
+    def peek(self, size: int) -> memoryview:
+        return self._buffer[:size]
 
-    def read(self, size: int) -> bytes:
-        data = bytes(self._buffer[:size])
+    def read(self, size: int) -> memoryview:
+        data = self._buffer[:size]
         self._buffer = self._buffer[size:]
         return data
 
@@ -105,7 +232,6 @@ class UploadManager:
     def __init__(self, server: SDOServer):
         self._server = server
 
-        self._handler_callback = None
         self._stream: Optional[StreamBase] = None
 
         self._multiplexor: Optional[TMultiplexor] = None
@@ -118,13 +244,32 @@ class UploadManager:
         # used for segmented transfer
         self._toggle_bit = False
 
+    def bind(self, server: SDOServer):
+        """Bind a pooled manager to another SDO server"""
+        self._server = server
+
     def set_handler_callback(self, callback):
-        self._handler_callback = callback
+        self._server.upload_handler_callback = callback
 
     @property
     def block_transfer_active(self):
         return self._state in (TransferState.BLOCK, TransferState.BLOCK_END)
 
+    @property
+    def transfer_active(self):
+        return self._state != TransferState.NONE
+
+    def abort_transfer(self) -> Optional[TMultiplexor]:
+        """Abort the active transfer (e.g. on timeout) and release the stream
+
+        :returns: multiplexor of the aborted transfer or None if no transfer was active
+        """
+        if self._state == TransferState.NONE:
+            return None
+
+        self._abort()
+        return self._multiplexor
+
     def on_abort(self, multiplexor):
         if self._state != TransferState.NONE and self._multiplexor == multiplexor:
             self._abort()
@@ -145,11 +290,22 @@ class UploadManager:
 
         self._multiplexor = (index, subindex)
 
-        if self._handler_callback:
-            handler = self._handler_callback(self._server.node, index, subindex)
+        node = self._server.node
+        handler = None
+        handler_callback = self._server.upload_handler_callback
 
-            if handler:
-                return HandlerStream(handler)
+        if handler_callback:
+            handler = handler_callback(node, index, subindex)
+
+        if handler is None:
+            callbacks = node.sdo_dispatcher.upload_handler_callbacks
+            handler_callback = callbacks.get((index, subindex), None)
+
+            if handler_callback:
+                handler = handler_callback(node, index, subindex)
+
+        if handler:
+            return HandlerStream(handler)
 
         try:
             value = self._server.node.object_dictionary.read(index, subindex)
@@ -194,9 +350,7 @@ class UploadManager:
             self._block_size = msg[4]
 
             cmd = 0xC4 if size is None else 0xC6
-            self._server.node.network.send(
-                self._server.cob_tx, cmd.to_bytes(1, "little") + msg[1:4] + size_bytes
-            )
+            self._server.send(cmd.to_bytes(1, "little") + msg[1:4] + size_bytes)
             return
 
         if size is not None and 1 <= size <= 4:
@@ -208,7 +362,7 @@ class UploadManager:
             response = (
                 SDO_STRUCT.pack(cmd, index, subindex) + data + bytes(4 - len(data))
             )
-            self._server.node.network.send(self._server.cob_tx, response)
+            self._server.send(response)
             return
 
         self._state = TransferState.SEGMENT
@@ -217,9 +371,7 @@ class UploadManager:
         cmd = 0x40 + (size is not None)
         size_bytes = struct.pack("<I", size) if size is not None else bytes(4)
 
-        self._server.node.network.send(
-            self._server.cob_tx, cmd.to_bytes(1, "little") + msg[1:4] + size_bytes
-        )
+        self._server.send(cmd.to_bytes(1, "little") + msg[1:4] + size_bytes)
 
     def upload_segment(self, msg: bytes):
         if self._state != TransferState.SEGMENT:
@@ -237,19 +389,19 @@ class UploadManager:
 
         self._toggle_bit = not self._toggle_bit
 
+        data = self._stream.peek(8)
+        no_data_left = len(data) <= 7
         data = self._stream.read(7)
-        no_data_left = not self._stream.peek(1)
+
+        cmd = (toggle_bit << 4) + no_data_left + ((7 - len(data)) << 1)
+        response = cmd.to_bytes(1, "little") + data + bytes(7 - len(data))
 
         if no_data_left:
             self._state = TransferState.NONE
             self._stream.release()
             self._stream = None
 
-        cmd = (toggle_bit << 4) + no_data_left + ((7 - len(data)) << 1)
-
-        self._server.node.network.send(
-            self._server.cob_tx, cmd.to_bytes(1, "little") + data + bytes(7 - len(data))
-        )
+        self._server.send(response)
 
     def upload_sub_block(self, msg: bytes):
         if self._state not in (TransferState.BLOCK, TransferState.BLOCK_END):
@@ -270,30 +422,32 @@ class UploadManager:
                 self._crc = crc_hqx(data, self._crc)
 
             self._block_size = msg[2]
+            size = len(data)
 
             if not self._stream.peek(1):
-                cmd = 0xC1 + ((7 - len(data) % 7) << 2)
+                cmd = 0xC1 + ((7 - size % 7) << 2)
                 crc = self._crc if self._crc is not None else 0
-                self._server.node.network.send(
-                    self._server.cob_tx,
+                self._server.send(
                     cmd.to_bytes(1, "little") + crc.to_bytes(2, "little") + bytes(5),
                 )
                 self._state = TransferState.BLOCK_END
                 return
 
-        data = self._stream.peek(self._block_size * 7 + 1)
-        data, following_byte = (
-            data[: self._block_size * 7],
-            data[self._block_size * 7 :],
-        )
-        chunks = [data[i : i + 7] for i in range(0, len(data), 7)]
-
-        for index, chunk in enumerate(chunks[:-1]):
-            response = (index + 1).to_bytes(1, "little") + chunk
-            self._server.node.network.send(self._server.cob_tx, response)
-
-        last_block = not following_byte
-        first_byte = (last_block << 7) + (len(chunks) if chunks else 1)
-        data = chunks[-1] if chunks else b""
-        response = first_byte.to_bytes(1, "little") + data + bytes(7 - len(data))
-        self._server.node.network.send(self._server.cob_tx, response)
+        block_length = self._block_size * 7
+        data = self._stream.peek(block_length + 1)
+        last_block = len(data) <= block_length
+        data = data[:block_length]
+
+        send = self._server.send
+        segments = (len(data) + 6) // 7 or 1  # an empty stream is using one segment
+
+        # data is sliced from the stream buffer without intermediate copies
+        for sequence_number in range(1, segments):
+            offset = (sequence_number - 1) * 7
+            send(
+                sequence_number.to_bytes(1, "little") + data[offset : offset + 7],
+            )
+
+        data = data[(segments - 1) * 7 :]
+        first_byte = (last_block << 7) + segments
+        send(first_byte.to_bytes(1, "little") + data + bytes(7 - len(data)))
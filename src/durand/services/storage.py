@@ -0,0 +1,262 @@
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from durand.object_dictionary import Variable, Record
+from durand.datatypes import DatatypeEnum as DT
+
+
+if TYPE_CHECKING:
+    from durand.node import Node
+
+
+log = logging.getLogger(__name__)
+
+
+SAVE_SIGNATURE = 0x65766173  # "save"
+LOAD_SIGNATURE = 0x64616F6C  # "load"
+
+MAGIC = b"DURP"
+VERSION = 1
+
+HEADER_STRUCT = struct.Struct("<4sHHII")  # magic, version, reserved, count, crc32
+ENTRY_STRUCT = struct.Struct("<HBBH")  # index, subindex, datatype, size
+
+TEntry = Tuple[int, int, int, bytes]
+
+
+class ParameterStorage:
+    """Store and restore parameters (objects 0x1010 and 0x1011)
+
+    Writing the signature "save" to 0x1010 sub 1 stores the values of all
+    writable objects (except DOMAINs) in the given file. The file is written
+    atomically and contains a header with magic, version, number of entries and
+    a CRC32 of the entries, followed by the entries (index, subindex, datatype,
+    size and the packed value).
+
+    On startup, the stored values are written in one batch via
+    ObjectDictionary.write_many. When the batch fails (e.g. a stored PDO mapping
+    exceeding the frame size of the network), the values are written one by one
+    and the failing ones are skipped with a warning. Values for objects added later (e.g. by the
+    application after creating the node) are written as soon as the object is
+    added to the object dictionary.
+
+    Writing the signature "load" to 0x1011 sub 1 removes the stored parameters,
+    so the default values are used after the next start.
+
+    :param node: the node
+    :param path: path of the file used to store the parameters (None to disable)
+    """
+
+    def __init__(self, node: "Node", path: Optional[str] = None):
+        self._node = node
+        self._path = path
+
+        # stored values of objects not yet available in the object dictionary
+        self._pending: Dict[int, List[TEntry]] = {}
+
+        od = node.object_dictionary
+
+        store_record = Record(name="Store Parameters")
+        store_record[1] = Variable(DT.UNSIGNED32, "rw", name="Save All Parameters")
+        od[0x1010] = store_record
+
+        restore_record = Record(name="Restore Default Parameters")
+        restore_record[1] = Variable(
+            DT.UNSIGNED32, "rw", name="Restore All Default Parameters"
+        )
+        od[0x1011] = restore_record
+
+        # bit 0: saves parameters on command
+        capabilities = 1 if path is not None else 0
+        od.set_read_callback(0x1010, 1, lambda: capabilities)
+        od.set_read_callback(0x1011, 1, lambda: capabilities)
+
+        # storing is done while validating, so a failure is reported to the client
+        od.validate_callbacks[(0x1010, 1)].add(self._validate_save)
+        od.validate_callbacks[(0x1011, 1)].add(self._validate_load)
+
+        od.change_callbacks.add(self._apply_pending)
+
+    def _validate_save(self, value: int):
+        if value != SAVE_SIGNATURE or self._path is None:
+            raise ValueError("Invalid signature or storing not supported")
+
+        self.save()
+
+    def _validate_load(self, value: int):
+        if value != LOAD_SIGNATURE or self._path is None:
+            raise ValueError("Invalid signature or restoring not supported")
+
+        self.restore_defaults()
+
+    def snapshot(self) -> bytes:
+        """Pack the values of all writable objects"""
+        od = self._node.object_dictionary
+        entries = []
+
+        for index, obj in od:
+            if index in (0x1010, 0x1011):
+                continue
+
+            variables = [(0, obj)] if isinstance(obj, Variable) else list(obj)
+
+            for subindex, variable in variables:
+                if (
+                    not variable.writable
+                    or variable.datatype == DT.DOMAIN
+                    or not od.has_value(index, subindex)
+                ):
+                    continue
+
+                data = variable.pack(od.read(index, subindex))
+
+                if len(data) > 0xFFFF:
+                    continue
+
+                entries.append(
+                    ENTRY_STRUCT.pack(index, subindex, variable.datatype, len(data))
+                )
+                entries.append(data)
+
+        body = b"".join(entries)
+        header = HEADER_STRUCT.pack(
+            MAGIC, VERSION, 0, len(entries) // 2, zlib.crc32(body)
+        )
+        return header + body
+
+    def save(self):
+        """Store the current values atomically in the file"""
+        assert self._path is not None, "No path for parameter storage given"
+
+        data = self.snapshot()
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as storage_file:
+                storage_file.write(data)
+                storage_file.flush()
+                os.fsync(storage_file.fileno())
+
+            os.replace(temp_path, self._path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def restore_defaults(self):
+        """Remove the stored values (the defaults are used after the next start)"""
+        assert self._path is not None, "No path for parameter storage given"
+
+        self._pending.clear()
+
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def load(self):
+        """Write the stored values to the object dictionary"""
+        if self._path is None:
+            return
+
+        try:
+            with open(self._path, "rb") as storage_file:
+                if not os.fstat(storage_file.fileno()).st_size:
+                    return
+
+                with mmap.mmap(
+                    storage_file.fileno(), 0, access=mmap.ACCESS_READ
+                ) as mapping:
+                    entries = self.parse(mapping)
+        except FileNotFoundError:
+            return
+        except ValueError as exc:
+            log.warning("Stored parameters in %s ignored: %s", self._path, exc)
+            return
+
+        od = self._node.object_dictionary
+        available = []
+
+        for entry in entries:
+            if entry[0] in od:
+                available.append(entry)
+            else:
+                self._pending.setdefault(entry[0], []).append(entry)
+
+        self._write(available)
+
+    @staticmethod
+    def parse(data) -> List[TEntry]:
+        """Parse the stored entries
+
+        :param data: content of the storage file (bytes-like, e.g. a mmap)
+        :returns: list of (index, subindex, datatype, packed value) tuples
+
+        :raises ValueError: when the content is invalid
+        """
+        with memoryview(data) as view:
+            if len(view) < HEADER_STRUCT.size:
+                raise ValueError("File too short")
+
+            magic, version, _, count, crc = HEADER_STRUCT.unpack_from(view)
+
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Unsupported file format")
+
+            if zlib.crc32(view[HEADER_STRUCT.size :]) != crc:
+                raise ValueError("Checksum not matching")
+
+            offset = HEADER_STRUCT.size
+            entries = []
+
+            try:
+                for _ in range(count):
+                    entry = ENTRY_STRUCT.unpack_from(view, offset)
+                    offset += ENTRY_STRUCT.size
+                    size = entry[3]
+                    entries.append((*entry[:3], bytes(view[offset : offset + size])))
+                    offset += size
+            except struct.error as exc:
+                raise ValueError("File truncated") from exc
+
+        return entries
+
+    def _write(self, entries: List[TEntry]):
+        od = self._node.object_dictionary
+        values = []
+
+        for index, subindex, datatype, data in entries:
+            try:
+                variable = od.lookup(index, subindex)
+            except KeyError:
+                continue
+
+            if not isinstance(variable, Variable) or variable.datatype != datatype:
+                log.debug("Stored value for 0x%04X:%d ignored", index, subindex)
+                continue
+
+            values.append((index, subindex, variable.unpack(data)))
+
+        try:
+            od.write_many(values, downloaded=True)
+            return
+        except Exception as exc:
+            log.warning("Restoring stored parameters in one batch failed: %r", exc)
+
+        # write the entries one by one to skip only the failing ones
+        for index, subindex, value in values:
+            try:
+                od.write(index, subindex, value, downloaded=True)
+            except Exception as exc:
+                log.warning(
+                    "Stored value for 0x%04X:%d ignored: %r", index, subindex, exc
+                )
+
+    def _apply_pending(self, index: int):
+        if index in self._pending:
+            self._write(self._pending.pop(index))
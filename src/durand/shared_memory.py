@@ -0,0 +1,265 @@
+""" Sharing process data of the object dictionary with other processes
+
+Requires Python 3.8 or newer (multiprocessing.shared_memory).
+"""
+from dataclasses import dataclass
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Sequence, Tuple
+import logging
+import struct
+import threading
+import time
+
+from durand.object_dictionary import ObjectDictionary, TMultiplexor, Variable
+from durand.datatypes import DatatypeEnum, is_numeric, struct_dict
+
+
+log = logging.getLogger(__name__)
+
+
+MAGIC = b"DURS"
+VERSION = 1
+
+HEADER_STRUCT = struct.Struct("<4sHH")  # magic, version, number of entries
+ENTRY_STRUCT = struct.Struct("<HBB")  # index, subindex, datatype
+SEQUENCE_STRUCT = struct.Struct("<I")
+NOTIFY_STRUCT = struct.Struct("<H")  # number of the changed entry
+
+# every slot: sequence (uint32), dirty flag (uint8), 3 bytes padding, 8 bytes value
+SLOT_SIZE = 16
+DIRTY_OFFSET = 4
+VALUE_OFFSET = 8
+
+READ_TIMEOUT = 0.1  # maximum time in seconds waiting for an active writer
+
+
+@dataclass(frozen=True)
+class SharedProcessDataHandle:
+    """Everything needed to attach to the shared process data (picklable, so it
+    can be passed to a process)
+    """
+
+    name: str
+    notify_connection: Connection
+
+
+class _SharedRegion:
+    """Fixed layout of the shared memory and seqlock access to its slots
+
+    The memory contains a header, a directory with index, subindex and datatype
+    of every entry and a slot per entry. Every slot is written by a single
+    process only. The writer increments the sequence before and after writing
+    the value, so readers retry while the sequence is odd or has changed. When
+    the writer is not finishing within READ_TIMEOUT (e.g. the process died while
+    writing), the current content is returned with a warning.
+    """
+
+    def __init__(self, shm: SharedMemory):
+        self._shm = shm
+        self._buf = shm.buf
+
+        magic, version, count = HEADER_STRUCT.unpack_from(self._buf)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported shared memory layout")
+
+        self._slots_offset = HEADER_STRUCT.size + count * ENTRY_STRUCT.size
+        self._entries: Dict[TMultiplexor, Tuple[int, DatatypeEnum]] = {}
+        self._multiplexors = []
+
+        for number in range(count):
+            index, subindex, datatype = ENTRY_STRUCT.unpack_from(
+                self._buf, HEADER_STRUCT.size + number * ENTRY_STRUCT.size
+            )
+            self._entries[(index, subindex)] = (number, DatatypeEnum(datatype))
+            self._multiplexors.append((index, subindex))
+
+    @staticmethod
+    def _size(count: int) -> int:
+        return HEADER_STRUCT.size + count * (ENTRY_STRUCT.size + SLOT_SIZE)
+
+    @property
+    def multiplexors(self) -> Sequence[TMultiplexor]:
+        return tuple(self._multiplexors)
+
+    def _offset(self, number: int) -> int:
+        return self._slots_offset + number * SLOT_SIZE
+
+    def _store(self, number: int, data: bytes):
+        buf, offset = self._buf, self._offset(number)
+        sequence = SEQUENCE_STRUCT.unpack_from(buf, offset)[0]
+
+        SEQUENCE_STRUCT.pack_into(buf, offset, (sequence + 1) & 0xFFFF_FFFF)  # odd
+        buf[offset + VALUE_OFFSET : offset + VALUE_OFFSET + len(data)] = data
+        SEQUENCE_STRUCT.pack_into(buf, offset, (sequence + 2) & 0xFFFF_FFFF)
+
+    def _load(self, number: int, size: int) -> bytes:
+        buf, offset = self._buf, self._offset(number)
+        deadline = None
+
+        while True:
+            sequence = SEQUENCE_STRUCT.unpack_from(buf, offset)[0]
+
+            if not sequence & 1:
+                data = bytes(buf[offset + VALUE_OFFSET : offset + VALUE_OFFSET + size])
+
+                if SEQUENCE_STRUCT.unpack_from(buf, offset)[0] == sequence:
+                    return data
+
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT
+            elif time.monotonic() > deadline:
+                log.warning(
+                    "Writer of shared entry %r not finishing, value may be inconsistent",
+                    self._multiplexors[number],
+                )
+                return bytes(buf[offset + VALUE_OFFSET : offset + VALUE_OFFSET + size])
+
+            time.sleep(0)  # the writer is active, give it time to finish
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+
+class SharedProcessData(_SharedRegion):
+    """Process data of the object dictionary in shared memory (node side)
+
+    The values of the given (numeric) objects are mirrored into a shared memory
+    region, so other processes read and write them at memory speed via
+    SharedProcessDataClient. Values written by the node (e.g. received via
+    RPDO) are copied into the shared memory on every update.
+
+    Clients mark written entries as dirty and send the number of the entry via a
+    pipe. process_changes() writes those values into the object dictionary (and
+    so e.g. transmits TPDOs). Call it when fileno() is readable, e.g. via
+    loop.add_reader(shared.fileno(), shared.process_changes).
+
+    The values are stored in their CANopen representation (without factor).
+    Every entry must only be written by one process at a time.
+
+    :param od: the object dictionary
+    :param multiplexors: the objects to be shared
+    :param name: name of the shared memory (None for a random name)
+    """
+
+    def __init__(
+        self,
+        od: ObjectDictionary,
+        multiplexors: Sequence[TMultiplexor],
+        name: Optional[str] = None,
+    ):
+        self._od = od
+        self._variables = []
+
+        for multiplexor in multiplexors:
+            variable = od.lookup(*multiplexor)
+
+            if not isinstance(variable, Variable) or not is_numeric(variable.datatype):
+                raise ValueError(f"Numeric variable expected for {multiplexor}")
+
+            self._variables.append(variable)
+
+        shm = SharedMemory(name=name, create=True, size=self._size(len(multiplexors)))
+        HEADER_STRUCT.pack_into(shm.buf, 0, MAGIC, VERSION, len(multiplexors))
+
+        for number, (multiplexor, variable) in enumerate(
+            zip(multiplexors, self._variables)
+        ):
+            offset = HEADER_STRUCT.size + number * ENTRY_STRUCT.size
+            ENTRY_STRUCT.pack_into(shm.buf, offset, *multiplexor, variable.datatype)
+
+        _SharedRegion.__init__(self, shm)
+
+        self._reader, self._writer = Pipe(duplex=False)
+        self._local = threading.local()  # marks values applied from clients
+
+        for number, multiplexor in enumerate(multiplexors):
+            self._mirror(number, od.read(*multiplexor))
+            od.update_callbacks[multiplexor].add(self._create_mirror(number))
+
+    @property
+    def handle(self) -> SharedProcessDataHandle:
+        return SharedProcessDataHandle(self._shm.name, self._writer)
+
+    def _create_mirror(self, number: int):
+        def mirror(value: Any):
+            if not getattr(self._local, "applying", False):
+                self._mirror(number, value)
+
+        return mirror
+
+    def _mirror(self, number: int, value: Any):
+        self._store(number, self._variables[number].pack(value))
+
+    def fileno(self) -> int:
+        """File descriptor becoming readable when clients changed values"""
+        return self._reader.fileno()
+
+    def process_changes(self):
+        """Write the values changed by clients to the object dictionary"""
+        numbers: Dict[int, None] = {}
+
+        while self._reader.poll():
+            data = self._reader.recv_bytes()
+
+            for (number,) in NOTIFY_STRUCT.iter_unpack(data):
+                numbers[number] = None
+
+        entries = []
+
+        for number in numbers:
+            # clear the flag before reading, so a newer value is notified again
+            self._buf[self._offset(number) + DIRTY_OFFSET] = 0
+            variable = self._variables[number]
+            value = variable.unpack(self._load(number, variable.size))
+            entries.append((*self._multiplexors[number], value))
+
+        self._local.applying = True
+
+        try:
+            self._od.write_many(entries)
+        except Exception:
+            log.exception("Writing values from shared memory failed")
+        finally:
+            self._local.applying = False
+
+    def close(self):
+        """Close and remove the shared memory"""
+        _SharedRegion.close(self)
+        self._shm.unlink()
+        self._reader.close()
+        self._writer.close()
+
+
+class SharedProcessDataClient(_SharedRegion):
+    """Access to the process data shared by a node (client side)
+
+    :param handle: SharedProcessData.handle of the node process
+    """
+
+    def __init__(self, handle: SharedProcessDataHandle):
+        try:
+            shm = SharedMemory(name=handle.name, track=False)  # type: ignore
+        except TypeError:  # track is available since Python 3.13
+            shm = SharedMemory(name=handle.name)
+
+        _SharedRegion.__init__(self, shm)
+        self._notify_connection = handle.notify_connection
+
+    def read(self, index: int, subindex: int = 0):
+        number, datatype = self._entries[(index, subindex)]
+        dt_struct = struct_dict[datatype]
+        return dt_struct.unpack(self._load(number, dt_struct.size))[0]
+
+    def write(self, index: int, subindex: int, value):
+        number, datatype = self._entries[(index, subindex)]
+        self._store(number, struct_dict[datatype].pack(value))
+
+        dirty_offset = self._offset(number) + DIRTY_OFFSET
+
+        if not self._buf[dirty_offset]:  # node is already notified otherwise
+            self._buf[dirty_offset] = 1
+            self._notify_connection.send_bytes(NOTIFY_STRUCT.pack(number))
@@ -1,8 +1,12 @@
 """ Testing EMCY messages """
 
-from durand import Node
+import pytest
 
-from ..mock_network import MockNetwork, TxMsg
+from durand import Node, set_scheduler
+from durand.scheduler import VirtualScheduler
+from durand.services.emcy import OverflowPolicy
+
+from ..mock_network import MockNetwork, RxMsg, TxMsg
 
 
 def test_simple_emcy():
@@ -22,3 +26,117 @@ def test_simple_emcy():
             TxMsg(0x82, "00 00 00 00 00 00 00 00")  # receive reset of EMCY
         ]
     )
+
+
+def test_emcy_queue():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+    node.emcy.inhibit_time = 0.1
+
+    network.tx_mock.reset_mock()
+
+    # burst of errors within the inhibit time
+    node.emcy.set(0x1000, 1)
+    node.emcy.set(0x2000, 1)
+    node.emcy.set(0x2000, 1)  # identical to a pending EMCY
+    node.emcy.set(0x3000, 1)
+    node.emcy.set(0, 0)
+    node.emcy.set(0x2000, 1)  # pending, but before an error reset
+
+    network.test([TxMsg(0x82, "00 10 01 00 00 00 00 00")])
+
+    # one EMCY per inhibit time
+    scheduler.run(0.1)
+    network.test([TxMsg(0x82, "00 20 01 00 00 00 00 00")])
+
+    scheduler.run(0.3)
+    network.test([
+            TxMsg(0x82, "00 30 01 00 00 00 00 00"),
+            TxMsg(0x82, "00 00 00 00 00 00 00 00"),
+            TxMsg(0x82, "00 20 01 00 00 00 00 00"),
+        ]
+    )
+
+
+def test_emcy_queue_inhibit_time_disabled():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+    node.emcy.inhibit_time = 0.1
+
+    network.tx_mock.reset_mock()
+
+    for error_code in (0x1000, 0x2000, 0x3000):
+        node.emcy.set(error_code, 1)
+
+    # without inhibit time all pending EMCYs are sent immediately
+    node.emcy.inhibit_time = 0
+    network.test([
+            TxMsg(0x82, "00 10 01 00 00 00 00 00"),
+            TxMsg(0x82, "00 20 01 00 00 00 00 00"),
+            TxMsg(0x82, "00 30 01 00 00 00 00 00"),
+        ]
+    )
+
+
+@pytest.mark.parametrize("policy", list(OverflowPolicy))
+def test_emcy_queue_overflow(policy):
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+    node.emcy.inhibit_time = 0.1
+    node.emcy.queue_size = 2
+    node.emcy.overflow_policy = policy
+
+    network.tx_mock.reset_mock()
+
+    for error_code in (0x1000, 0x2000, 0x3000, 0x4000):
+        node.emcy.set(error_code, 1)
+
+    scheduler.run(1)
+    assert node.emcy.dropped == 1
+
+    dropped = "00 20" if policy == OverflowPolicy.DROP_OLDEST else "00 40"
+    network.test([
+            TxMsg(0x82, f"00 {code:02X} 01 00 00 00 00 00")
+            for code in (0x10, 0x20, 0x30, 0x40)
+            if f"00 {code:02X}" != dropped
+        ]
+    )
+
+
+def test_error_history():
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+    od = node.object_dictionary
+
+    assert od.read(0x1003, 0) == 0
+
+    for error_code in range(0x1000, 0x1000 + 20):
+        node.emcy.set(error_code, 1, data=b"\xAA\xBB")
+    node.emcy.set(0, 0)  # error resets are not recorded
+
+    # the newest error is at subindex 1, only the last 16 errors are kept
+    assert od.read(0x1003, 0) == 16
+    assert od.read(0x1003, 1) == 0xBBAA_1013
+    assert od.read(0x1003, 16) == 0xBBAA_1004
+
+    network.tx_mock.reset_mock()
+
+    # clearing the history
+    network.test([
+            RxMsg(0x602, "2F 03 10 00 01 00 00 00"),
+            TxMsg(0x582, "80 03 10 00 20 00 00 08"),  # only 0 is allowed
+            RxMsg(0x602, "2F 03 10 00 00 00 00 00"),
+            TxMsg(0x582, "60 03 10 00 00 00 00 00"),
+            RxMsg(0x602, "40 03 10 00 00 00 00 00"),
+            TxMsg(0x582, "4F 03 10 00 00 00 00 00"),
+        ]
+    )
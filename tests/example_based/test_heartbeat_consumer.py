@@ -0,0 +1,108 @@
+""" Testing the heartbeat consumer (object 0x1016) """
+from unittest.mock import Mock
+
+import pytest
+
+from durand import Node, set_scheduler
+from durand.scheduler import VirtualScheduler
+
+from ..mock_network import MockNetwork, TxMsg
+
+
+def test_heartbeat_consumer():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+
+    timeout_mock = Mock()
+    node.heartbeat_consumer.timeout_callbacks.add(timeout_mock)
+
+    # monitor node 5 with 100 ms and node 6 with 200 ms
+    node.object_dictionary.write(0x1016, 1, 0x0005_0064)
+    node.object_dictionary.write(0x1016, 2, 0x0006_00C8)
+
+    network.tx_mock.reset_mock()
+
+    # monitoring starts with the first heartbeat
+    scheduler.run(0.5)
+    timeout_mock.assert_not_called()
+
+    for _ in range(4):
+        network.receive(0x705, b"\x05")
+        network.receive(0x706, b"\x7F")
+        scheduler.run(0.09)
+
+    assert node.heartbeat_consumer.is_alive(5)
+    assert node.heartbeat_consumer.is_alive(6)
+
+    # node 6 is missing (timeout detected within one sweep of 25 ms)
+    network.receive(0x705, b"\x05")
+    scheduler.run(0.09)
+    timeout_mock.assert_not_called()
+
+    network.receive(0x705, b"\x05")
+    scheduler.run(0.05)
+    timeout_mock.assert_called_once_with(6)
+    assert not node.heartbeat_consumer.is_alive(6)
+    assert node.heartbeat_consumer.is_alive(5)
+
+    network.test([TxMsg(0x82, "30 81 11 06 00 00 00 00")])
+
+    # node 5 is missing
+    scheduler.run(0.125)
+    timeout_mock.assert_called_with(5)
+
+    # monitoring is restarted with the next heartbeat
+    network.receive(0x705, b"\x05")
+    assert node.heartbeat_consumer.is_alive(5)
+
+
+def test_heartbeat_consumer_duplicate():
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+
+    node.object_dictionary.write(0x1016, 1, 0x0005_0064)
+
+    with pytest.raises(ValueError):
+        node.object_dictionary.write(0x1016, 2, 0x0005_00C8)
+
+    # disabled entries are allowed
+    node.object_dictionary.write(0x1016, 2, 0x0005_0000)
+
+    node.object_dictionary.write(0x1016, 1, 0)
+    assert 0x705 not in network.subscriptions
+
+
+def test_heartbeat_consumer_node_ids():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+
+    node.object_dictionary.write(0x1016, 1, 0x007F_0064)
+    network.receive(0x77F, b"\x05")
+    assert node.heartbeat_consumer.is_alive(127)
+
+    scheduler.run(0.125)
+    assert not node.heartbeat_consumer.is_alive(127)
+
+
+def test_heartbeat_consumer_reconfiguration():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    node = Node(MockNetwork(), node_id=2)
+
+    # every change restarts the monitoring, the outdated sweeps are stopping
+    for time_ms in (100, 200, 300):
+        node.object_dictionary.write(0x1016, 1, 0x0005_0000 + time_ms)
+
+    scheduler.run(0.1)
+    assert len(scheduler._entry_dict) == 1  # a single sweep is running
+
+    node.object_dictionary.write(0x1016, 1, 0)
+    scheduler.run(0.1)
+    assert not scheduler._entry_dict
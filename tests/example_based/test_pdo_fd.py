@@ -0,0 +1,91 @@
+""" Testing PDOs with CAN FD """
+import pytest
+
+from durand import Node, Variable
+from durand.datatypes import DatatypeEnum as DT
+
+from ..mock_network import MockNetwork, TxMsg, RxMsg
+
+
+def test_tpdo_fd():
+    network = MockNetwork(fd=True)
+
+    # create the node
+    node = Node(network, node_id=2)
+
+    for index in range(10):
+        node.object_dictionary[0x2000 + index] = Variable(
+            DT.UNSIGNED8, "rw", value=index
+        )
+
+    # mapping 10 bytes (more than 8 entries)
+    node.tpdo[0].mapping = [(0x2000 + index, 0) for index in range(10)]
+    assert node.object_dictionary.read(0x1A00, 10) == 0x2009_0008
+
+    # the PDO is padded to the next valid CAN FD payload size
+    network.test(
+        [   TxMsg(0x702, "00"),  # boot-up message from NMT
+
+            RxMsg(0x000, "01 00"),  # set Operational state
+
+            TxMsg(0x182, "00 01 02 03 04 05 06 07 08 09 00 00")
+        ]
+    )
+
+
+def test_rpdo_fd():
+    network = MockNetwork(fd=True)
+
+    # create the node
+    node = Node(network, node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.UNSIGNED32, "rw", value=0)
+    node.object_dictionary[0x2001] = Variable(DT.UNSIGNED32, "rw", value=0)
+    node.object_dictionary[0x2002] = Variable(DT.UNSIGNED16, "rw", value=0)
+
+    node.rpdo[0].mapping = [(0x2000, 0), (0x2001, 0), (0x2002, 0)]
+
+    network.test(
+        [   TxMsg(0x702, "00"),  # boot-up message from NMT
+
+            RxMsg(0x000, "01 00"),  # set Operational state
+            RxMsg(0x202, "01 00 00 00 02 00 00 00 03 00 00 00")  # padded frame
+        ]
+    )
+
+    assert node.object_dictionary.read(0x2000, 0) == 1
+    assert node.object_dictionary.read(0x2001, 0) == 2
+    assert node.object_dictionary.read(0x2002, 0) == 3
+
+
+def test_pdo_size_classic():
+    node = Node(MockNetwork(), node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.UNSIGNED32, "rw", value=0)
+
+    with pytest.raises(ValueError):
+        node.tpdo[0].mapping = [(0x2000, 0)] * 3
+
+
+def test_pdo_size_exceeded_via_sdo():
+    network = MockNetwork()
+
+    node = Node(network, node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.UNSIGNED32, "rw", value=0)
+
+    network.test(
+        [   TxMsg(0x702, "00"),  # boot-up message from NMT
+
+            # map 0x2000 three times (12 bytes)
+            RxMsg(0x602, "23 00 1A 01 20 00 00 20"),
+            TxMsg(0x582, "60 00 1A 01 00 00 00 00"),
+            RxMsg(0x602, "23 00 1A 02 20 00 00 20"),
+            TxMsg(0x582, "60 00 1A 02 00 00 00 00"),
+            RxMsg(0x602, "23 00 1A 03 20 00 00 20"),
+            TxMsg(0x582, "60 00 1A 03 00 00 00 00"),
+
+            RxMsg(0x602, "2F 00 1A 00 03 00 00 00"),  # enable the mapping
+            TxMsg(0x582, "80 00 1A 00 42 00 04 06"),  # PDO length exceeded
+        ]
+    )
+
+    assert node.object_dictionary.read(0x1A00, 0) == 0
+    assert node.tpdo[0].mapping == ()
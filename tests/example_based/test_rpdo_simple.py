@@ -61,3 +61,42 @@ def test_local_config_rpdo():
             TxMsg(0x582, "43 00 14 01 02 02 00 80"),  # receive 0x8000_0202
         ]
     )
+
+
+def test_rpdo_nmt_transitions():
+    network = MockNetwork()
+
+    # create the node
+    node = Node(network, node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw", value=5)
+
+    # only the PDOs with default COB-IDs are visited on NMT transitions
+    assert len(node.nmt.operational_callbacks) == 8
+
+    # enabled and mapped PDOs are visited too
+    node.rpdo[4].mapping = [(0x2000, 0)]
+    node.object_dictionary.write(0x1404, 1, 0x301, downloaded=True)
+    assert len(node.nmt.operational_callbacks) == 9
+
+    network.test(
+        [   TxMsg(0x702, "00"),  # boot-up message from NMT
+
+            RxMsg(0x000, "01 00"),  # set NMT Operational state
+            RxMsg(0x301, "02 00")  # receive the PDO message
+        ]
+    )
+
+    assert node.object_dictionary.read(0x2000, 0) == 2
+
+    network.test(
+        [
+            RxMsg(0x000, "02 00"),  # set NMT Stopped state
+            RxMsg(0x301, "03 00")  # receive the PDO message (will be ignored)
+        ]
+    )
+
+    assert node.object_dictionary.read(0x2000, 0) == 2
+    assert 0x301 not in network.subscriptions
+
+    node.rpdo[4].enable = False
+    assert len(node.nmt.operational_callbacks) == 8
@@ -21,8 +21,8 @@ class Msg:
                     "Data parts have to be string containing hexcoded bytes, bytes or integers"
                 )
 
-        if len(self._data) > 8:
-            raise ValueError("Maximum 8 bytes possible (%r)" % self._data)
+        if len(self._data) > 64:
+            raise ValueError("Maximum 64 bytes possible (%r)" % self._data)
 
     @property
     def data(self):
@@ -41,7 +41,8 @@ class RxMsg(Msg):
 
 
 class MockNetwork(NetworkABC):
-    def __init__(self):
+    def __init__(self, fd: bool = False):
+        self.fd = fd
         self.subscriptions = dict()
         self.tx_mock = Mock()
 
@@ -51,6 +52,13 @@ class MockNetwork(NetworkABC):
     def remove_subscription(self, cob_id: int):
         self.subscriptions.pop(cob_id)
 
+    def update_subscriptions(self, add=None, remove=()):
+        for cob_id in remove:
+            self.subscriptions.pop(cob_id)
+
+        if add:
+            self.subscriptions.update(add)
+
     def receive(self, cob_id: int, msg: bytes):
         """Used in tests to send a CAN message to the node"""
         callback = self.subscriptions.get(cob_id, None)
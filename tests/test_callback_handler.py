@@ -0,0 +1,176 @@
+import asyncio
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from durand import Node, Variable
+from durand.datatypes import DatatypeEnum as DT
+from durand.callback_handler import (
+    CallbackHandler,
+    FailMode,
+    AsyncCallbackQueue,
+    OverflowPolicy,
+)
+
+from .mock_network import MockNetwork
+
+
+def test_sync_callbacks():
+    handler = CallbackHandler()
+    mock = Mock()
+
+    handler.add(mock)
+    handler.call(1, a=2)
+
+    mock.assert_called_once_with(1, a=2)
+
+    handler.remove(mock)
+    assert mock not in handler
+
+
+def test_coroutine_not_allowed_for_validation():
+    async def callback(value):
+        pass
+
+    handler = CallbackHandler(fail_mode=FailMode.FIRST_FAIL)
+
+    with pytest.raises(ValueError):
+        handler.add(callback)
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        (OverflowPolicy.DROP_OLDEST, [2, 3]),
+        (OverflowPolicy.DROP_NEWEST, [0, 1]),
+        (OverflowPolicy.COALESCE, [3]),
+    ],
+)
+def test_coroutine_callbacks(policy, expected):
+    values = []
+
+    async def callback(value):
+        values.append(value)
+
+    async def main():
+        queue = AsyncCallbackQueue(maxsize=2, policy=policy)
+        handler = CallbackHandler(async_queue=queue)
+        handler.add(callback)
+
+        for value in range(4):
+            handler.call(value)
+
+        assert values == []  # the callback is not awaited in the calling context
+
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        assert len(queue) == 0
+
+    asyncio.run(main())
+
+    assert values == expected
+
+
+def test_coroutine_update_callback():
+    values = []
+
+    async def on_update(value):
+        await asyncio.sleep(0)
+        values.append(value)
+
+    async def main():
+        node = Node(MockNetwork(), 0x02)
+        node.object_dictionary[0x2000] = Variable(DT.UNSIGNED8, "rw")
+        node.object_dictionary.update_callbacks[(0x2000, 0)].add(on_update)
+
+        node.object_dictionary.write(0x2000, 0, 5)
+        node.object_dictionary.write(0x2000, 0, 6)
+
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+    assert values == [5, 6]
+
+
+def test_coroutine_callbacks_from_thread():
+    values = []
+
+    async def callback(value):
+        values.append(value)
+
+    async def main():
+        queue = AsyncCallbackQueue(loop=asyncio.get_running_loop())
+        handler = CallbackHandler(async_queue=queue)
+        handler.add(callback)
+
+        # e.g. called by the CAN receive thread
+        thread = threading.Thread(target=handler.call, args=(1,))
+        thread.start()
+        thread.join()
+
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+    assert values == [1]
+
+
+def test_coroutine_update_callback_from_thread():
+    values = []
+
+    async def on_update(value):
+        values.append(value)
+
+    async def main():
+        node = Node(MockNetwork(), 0x02)
+        node.object_dictionary[0x2000] = Variable(DT.UNSIGNED8, "rw")
+        node.object_dictionary.update_callbacks[(0x2000, 0)].add(on_update)
+
+        # the default queue is bound when adding the callback, not on the first call
+        thread = threading.Thread(
+            target=node.object_dictionary.write, args=(0x2000, 0, 5)
+        )
+        thread.start()
+        thread.join()
+
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+    assert values == [5]
+
+
+def test_coroutine_callbacks_without_loop():
+    async def callback(value):
+        pass
+
+    handler = CallbackHandler()
+
+    with pytest.raises(ValueError):
+        handler.add(callback)
+
+    assert callback not in handler
+
+
+def test_coroutine_callbacks_closed_loop():
+    loop = asyncio.new_event_loop()
+    queue = AsyncCallbackQueue(loop=loop)
+    loop.close()
+
+    async def callback(value):
+        pass
+
+    with pytest.raises(RuntimeError):
+        queue.put(1, callback, (1,))
+
+    # the worker is started again on the next call
+    assert not queue._worker_active
+
+    with pytest.raises(RuntimeError):
+        AsyncCallbackQueue()  # no running loop
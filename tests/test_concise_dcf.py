@@ -0,0 +1,97 @@
+""" Testing the concise DCF (object 0x1F22) """
+import struct
+from unittest.mock import Mock
+
+from durand import Node, Variable
+from durand.datatypes import DatatypeEnum as DT
+
+from .mock_network import MockNetwork
+
+
+def build_concise_dcf(entries):
+    data = struct.pack("<I", len(entries))
+
+    for index, subindex, value in entries:
+        data += struct.pack("<HBI", index, subindex, len(value)) + value
+
+    return data
+
+
+def download(network: MockNetwork, node_id: int, subindex: int, data: bytes, size=None):
+    """Segmented download of data to 0x1F22 and return the last response"""
+    size = len(data) if size is None else size
+    network.receive(
+        0x600 + node_id,
+        b"\x21\x22\x1F" + bytes((subindex,)) + struct.pack("<I", size),
+    )
+
+    toggle = 0
+
+    while data:
+        segment, data = data[:7], data[7:]
+        cmd = (toggle << 4) + ((7 - len(segment)) << 1) + (not data)
+        network.receive(
+            0x600 + node_id, bytes((cmd,)) + segment + bytes(7 - len(segment))
+        )
+        toggle ^= 1
+
+    return network.tx_mock.call_args[0]
+
+
+def test_concise_dcf():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+    n.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw")
+
+    cob_id_mock = Mock()
+    n.object_dictionary.update_callbacks[(0x1800, 1)].add(cob_id_mock)
+
+    dcf = build_concise_dcf(
+        [
+            (0x1800, 1, struct.pack("<I", 0x8000_0182)),  # disable TPDO 1
+            (0x1A00, 0, b"\x00"),
+            (0x1A00, 1, struct.pack("<I", 0x2000_0010)),  # map 0x2000
+            (0x1A00, 0, b"\x01"),
+            (0x1800, 1, struct.pack("<I", 0x182)),  # enable TPDO 1
+            (0x2000, 0, struct.pack("<h", -7)),
+        ]
+    )
+
+    cob_id, response = download(network, 2, 2, dcf)
+    assert cob_id == 0x582 and response[0] & 0xE0 == 0x20  # successful
+
+    assert n.tpdo[0].mapping == ((0x2000, 0),)
+    assert n.object_dictionary.read(0x2000, 0) == -7
+
+    # callbacks are only called with the final value
+    cob_id_mock.assert_called_once_with(0x182)
+
+
+def test_concise_dcf_errors():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+    n.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw")
+
+    # object not existing
+    dcf = build_concise_dcf([(0x2000, 0, b"\x01\x00"), (0x2001, 0, b"\x01")])
+    assert download(network, 2, 2, dcf) == (0x582, b"\x80\x01\x20\x00\x00\x00\x02\x06")
+    assert n.object_dictionary.read(0x2000, 0) == 0  # nothing is written
+
+    # size not matching
+    dcf = build_concise_dcf([(0x2000, 0, b"\x01")])
+    assert download(network, 2, 2, dcf) == (0x582, b"\x80\x00\x20\x00\x10\x00\x07\x06")
+
+    # announced size not matching
+    dcf = build_concise_dcf([(0x2000, 0, b"\x01\x00")])
+    assert download(network, 2, 2, dcf, size=len(dcf) + 1) == (
+        0x582,
+        b"\x80\x22\x1F\x02\x10\x00\x07\x06",
+    )
+    assert n.object_dictionary.read(0x2000, 0) == 0
+
+    # a DCF for another node is only stored
+    dcf = build_concise_dcf([(0x2000, 0, b"\x01\x00")])
+    cob_id, response = download(network, 2, 3, dcf)
+    assert cob_id == 0x582 and response[0] & 0xE0 == 0x20  # successful
+    assert n.object_dictionary.read(0x2000, 0) == 0
+    assert n.object_dictionary.read(0x1F22, 3) == dcf
@@ -1,7 +1,12 @@
 """ Testing EDS file generation """
+import io
+import zipfile
+from unittest.mock import Mock
 
-from durand import MinimalNode, Variable
+from durand import MinimalNode, Node, Variable, set_scheduler
 from durand.datatypes import DatatypeEnum as DT
+from durand.eds import EDS, StoreFormat, parse_eds, load_eds
+from durand.scheduler import VirtualScheduler
 
 from .mock_network import MockNetwork
 from .test_sdo import build_sdo_packet
@@ -53,3 +58,216 @@ def test_eds_generation():
     node.eds.comments = 'ABC\nDEF\n'
     assert node.eds.content.startswith("[Comments]\nLines=2\nLine1=ABC\nLine2=DEF\n\n")
 
+
+
+def test_eds_cache():
+    network = MockNetwork()
+    node = MinimalNode(network, node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw", value=5)
+
+    assert node.eds.data == node.eds.data
+    assert "[2000]\nParameterName=Variable2000\nObjectType=0x7\nDataType=0x3\nAccessType=rw\nDefaultValue=5\n" in node.eds.content
+
+    # writing a value updates the description of the object
+    node.object_dictionary.write(0x2000, 0, 7)
+    assert "DefaultValue=7" in node.eds.content
+
+    # adding an object is updating the sections
+    node.object_dictionary[0x2001] = Variable(DT.INTEGER16, "rw", value=3)
+    assert "[ManufacturerObjects]\nSupportedObjects=2\n1=0x2000\n2=0x2001\n" in node.eds.content
+
+    # changes not visible to the object dictionary have to be announced
+    node.object_dictionary[0x2001].name = "Parameter"
+    assert "ParameterName=Parameter\n" not in node.eds.content
+    node.eds.invalidate(0x2001)
+    assert "ParameterName=Parameter\n" in node.eds.content
+
+
+def test_eds_written_values():
+    node = Node(MockNetwork(), node_id=2)
+    assert "[1018sub1]\nParameterName=Vendor-ID\n" in node.eds.content
+
+    node.object_dictionary.write(0x1018, 1, 0x1234)
+    node.object_dictionary.write(0x1017, 0, 500)
+
+    content = node.eds.content
+    assert "[1018sub1]\nParameterName=Vendor-ID\nObjectType=0x7\nDataType=0x7\nAccessType=ro\nDefaultValue=4660\n" in content
+    assert "[1017]\nParameterName=Producer Heartbeat Time\nObjectType=0x7\nDataType=0x6\nAccessType=rw\nDefaultValue=500\n" in content
+
+
+def test_eds_compressed():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    node = MinimalNode(network, node_id=2)
+
+    assert node.object_dictionary.read(0x1021, 0) == node.eds.data
+
+    node.eds.store_format = StoreFormat.ZIP
+    assert node.object_dictionary.read(0x1022, 0) == 0x80
+
+    # the compressed file is generated in the background
+    scheduler.run(EDS.COMPRESS_DELAY)
+    compressed = node.eds._compressed_cache[2]
+    assert node.object_dictionary.read(0x1021, 0) is compressed
+
+    with zipfile.ZipFile(io.BytesIO(compressed)) as archive:
+        assert archive.read(node.eds.file_info.FileName) == node.eds.data
+
+    assert len(compressed) < len(node.eds.data) / 4
+
+    # written process data is only compressed on request
+    node.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw", value=5)
+    scheduler.run(EDS.COMPRESS_DELAY)
+
+    for value in range(100):
+        node.object_dictionary.write(0x2000, 0, value)
+
+    assert node.eds._compress_handle is None
+    with zipfile.ZipFile(io.BytesIO(node.object_dictionary.read(0x1021, 0))) as archive:
+        assert b"DefaultValue=99\n" in archive.read(node.eds.file_info.FileName)
+
+    # changes are updating the compressed file
+    node.object_dictionary[0x2001] = Variable(DT.INTEGER16, "rw", value=5)
+    with zipfile.ZipFile(io.BytesIO(node.object_dictionary.read(0x1021, 0))) as archive:
+        assert b"[2001]" in archive.read(node.eds.file_info.FileName)
+
+
+def test_eds_streaming():
+    network = MockNetwork()
+    node = MinimalNode(network, node_id=2)
+
+    data = node.eds.data
+    node.eds.invalidate()
+
+    assert b"".join(node.eds.iter_data()) == data
+
+    for announce_size in (True, False):
+        handler = node.eds.upload_handler(announce_size=announce_size)
+        assert handler.size == (len(data) if announce_size else None)
+
+        chunks = []
+        while True:
+            chunk = handler.on_read(889)
+            if not chunk:
+                break
+            assert len(chunk) <= 889
+            chunks.append(bytes(chunk))
+
+        assert b"".join(chunks) == data
+
+
+EDS_EXAMPLE = """
+[DeviceComissioning]
+NodeID=3
+
+[1017]
+ParameterName=Producer Heartbeat Time
+ObjectType=0x7
+DataType=0x0006
+AccessType=rw
+DefaultValue=0
+ParameterValue=1000
+
+[1800]
+ParameterName=TPDO Communication Parameter
+ObjectType=0x9
+SubNumber=3
+
+[1800sub0]
+ParameterName=Highest Sub-Index Supported
+ObjectType=0x7
+DataType=0x0005
+AccessType=const
+DefaultValue=2
+
+[1800sub1]
+ParameterName=COB-ID
+ObjectType=0x7
+DataType=0x0007
+AccessType=rw
+DefaultValue=$NODEID+0x180
+
+[1800sub2]
+ParameterName=Transmission Type
+ObjectType=0x7
+DataType=0x0005
+AccessType=rw
+DefaultValue=255
+
+[2000]
+ParameterName=Parameter
+ObjectType=0x7
+DataType=0x0003
+AccessType=rww
+DefaultValue=-5
+LowLimit=-10
+HighLimit=0x10
+
+[2001]
+ParameterName=Name
+ObjectType=0x7
+DataType=0x0009
+AccessType=ro
+DefaultValue=durand
+
+[2002]
+ParameterName=Values
+ObjectType=0x8
+DataType=0x0006
+AccessType=rw
+CompactSubObj=4
+"""
+
+
+def test_eds_import():
+    objects = parse_eds(EDS_EXAMPLE)
+
+    assert objects[0x1017] == Variable(
+        DT.UNSIGNED16, "rw", value=1000, name="Producer Heartbeat Time"
+    )
+    assert objects[0x1800][1] == Variable(
+        DT.UNSIGNED32, "rw", value=0x183, name="COB-ID"
+    )
+    assert objects[0x1800][0].value == 2
+    assert objects[0x2000] == Variable(
+        DT.INTEGER16, "rw", value=-5, minimum=-10, maximum=16, name="Parameter"
+    )
+    assert objects[0x2001].value == b"durand"
+    assert len(objects[0x2002]) == 5
+    assert objects[0x2002][4].datatype == DT.UNSIGNED16
+
+    assert parse_eds(EDS_EXAMPLE, node_id=0x10)[0x1800][1].value == 0x190
+
+
+def test_eds_import_roundtrip():
+    node = MinimalNode(MockNetwork(), node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw", value=5, name="A")
+
+    objects = parse_eds(node.eds.content, node_id=2)
+
+    assert set(objects) == {index for index, _ in node.object_dictionary}
+    assert objects[0x2000] == node.object_dictionary[0x2000]
+    assert objects[0x1200][1].value == 0x602
+
+
+def test_eds_import_cache(tmp_path, monkeypatch):
+    eds_path = tmp_path / "device.eds"
+    eds_path.write_text(EDS_EXAMPLE)
+    cache_dir = str(tmp_path / "cache")
+
+    od = load_eds(str(eds_path), node_id=5, cache_dir=cache_dir)
+    assert od.read(0x1800, 1) == 0x185
+
+    # the compiled cache is used when loading the same file again
+    monkeypatch.setattr("durand.eds.parse_eds", Mock(side_effect=AssertionError))
+    od = load_eds(str(eds_path), node_id=5, cache_dir=cache_dir)
+    assert od.read(0x1800, 1) == 0x185
+
+    node = Node(MockNetwork(), node_id=5, od=od)
+    assert node.object_dictionary.read(0x2001, 0) == b"durand"
+
+    # a changed node id is not using the cache
+    monkeypatch.undo()
+    assert load_eds(str(eds_path), node_id=6, cache_dir=cache_dir).read(0x1800, 1) == 0x186
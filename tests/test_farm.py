@@ -0,0 +1,177 @@
+""" Testing nodes running in worker processes """
+import multiprocessing
+import time
+from unittest.mock import Mock, call
+
+import pytest
+
+pytest.importorskip("multiprocessing.shared_memory")  # available since Python 3.8
+
+from durand import Node, Variable
+from durand.datatypes import DatatypeEnum as DT
+from durand.farm import (
+    FRAME,
+    SUBSCRIBE,
+    UNSUBSCRIBE,
+    FarmNetwork,
+    FarmNodeNetwork,
+    NodeFarm,
+    SharedRing,
+)
+
+from .mock_network import MockNetwork
+
+
+def setup_node(network, node_id):
+    return Node(network, node_id)
+
+
+def setup_heartbeat_node(network, node_id):
+    node = Node(network, node_id)
+    node.object_dictionary.write(0x1017, 0, 50)  # heartbeat every 50ms
+    return node
+
+
+def setup_pdo_node(network, node_id):
+    """Node 1 sends 0x2000 on SYNC, the other nodes receive it and send it back"""
+    node = Node(network, node_id)
+    node.object_dictionary[0x2000] = Variable(DT.UNSIGNED8, "rw", value=node_id)
+    node.tpdo[0].mapping = [(0x2000, 0)]
+
+    if node_id == 1:
+        node.tpdo[0].transmission_type = 1  # synchronous
+    else:
+        node.object_dictionary.write(0x1404, 1, 0x181, downloaded=True)
+        node.rpdo[4].mapping = [(0x2000, 0)]
+
+    return node
+
+
+def fork_context():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork not available")
+
+    return multiprocessing.get_context("fork")
+
+
+def wait_for(condition, timeout=10):
+    end = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < end, "Timeout"
+        time.sleep(0.01)
+
+
+def test_shared_ring():
+    ring = SharedRing(capacity=2)
+    other = SharedRing(name=ring.name)
+
+    assert ring.put(0x181, b"\x01\x02")
+    assert ring.put(0x000, kind=SUBSCRIBE)
+    assert not ring.put(0x182, b"\x03")  # full
+    assert len(other) == 2
+
+    assert other.get() == (0x181, 0, b"\x01\x02")
+    assert other.get() == (0x000, SUBSCRIBE, b"")
+    assert other.get() is None
+
+    assert ring.put(0x182, bytes(64))
+    assert other.get() == (0x182, 0, bytes(64))
+
+    other.close()
+    ring.close()
+    ring.unlink()
+
+
+def test_farm_network_subscriptions():
+    rx_ring, tx_ring = SharedRing(capacity=8), SharedRing(capacity=8)
+    network = FarmNetwork(rx_ring, tx_ring)
+    first, second = FarmNodeNetwork(network), FarmNodeNetwork(network)
+    first_mock, second_mock = Mock(), Mock()
+
+    # the COB-ID is subscribed once for both nodes
+    first.add_subscription(0x000, first_mock)
+    second.add_subscription(0x000, second_mock)
+    assert tx_ring.get() == (0x000, SUBSCRIBE, b"")
+    assert tx_ring.get() is None
+
+    rx_ring.put(0x000, b"\x01\x00")
+    assert network.process() == 1
+    first_mock.assert_called_once_with(0x000, b"\x01\x00")
+    second_mock.assert_called_once_with(0x000, b"\x01\x00")
+
+    # frames are delivered to the other nodes of the worker
+    first_mock.reset_mock()
+    second_mock.reset_mock()
+    first.send(0x000, b"\x02\x00")
+    assert tx_ring.get() == (0x000, FRAME, b"\x02\x00")
+
+    assert network.process() == 1
+    first_mock.assert_not_called()
+    second_mock.assert_called_once_with(0x000, b"\x02\x00")
+
+    # the COB-ID is unsubscribed with the last callback
+    first.remove_subscription(0x000)
+    assert tx_ring.get() is None
+    second.remove_subscription(0x000)
+    assert tx_ring.get() == (0x000, UNSUBSCRIBE, b"")
+
+    for ring in (rx_ring, tx_ring):
+        ring.close()
+        ring.unlink()
+
+
+def test_node_farm():
+    network = MockNetwork()
+    context = fork_context()
+
+    with NodeFarm(network, setup_node, range(1, 5), workers=2, context=context):
+        # every node is booting in one of the workers
+        boot_ups = [call(0x700 + node_id, b"\x00") for node_id in range(1, 5)]
+        wait_for(lambda: all(c in network.tx_mock.call_args_list for c in boot_ups))
+
+        # frames are routed to the subscribed worker
+        assert 0x603 in network.subscriptions
+        network.receive(0x603, b"\x40\x00\x10\x00\x00\x00\x00\x00")
+
+        response = call(0x583, b"\x43\x00\x10\x00\x00\x00\x00\x00")
+        wait_for(lambda: response in network.tx_mock.call_args_list)
+
+    assert not network.subscriptions
+
+
+def test_node_farm_nmt_broadcast():
+    network = MockNetwork()
+
+    with NodeFarm(
+        network, setup_heartbeat_node, range(1, 4), workers=1, context=fork_context()
+    ):
+        wait_for(lambda: 0x000 in network.subscriptions)
+
+        # all nodes of the worker are switched to operational
+        network.receive(0x000, b"\x01\x00")
+
+        heartbeats = [call(0x700 + node_id, b"\x05") for node_id in range(1, 4)]
+        wait_for(lambda: all(c in network.tx_mock.call_args_list for c in heartbeats))
+
+
+def test_node_farm_frames_between_nodes():
+    network = MockNetwork()
+
+    with NodeFarm(
+        network, setup_pdo_node, range(1, 5), workers=2, context=fork_context()
+    ) as farm:
+        # the boot-ups are sent after the subscriptions of the nodes
+        boot_ups = [call(0x700 + node_id, b"\x00") for node_id in range(1, 5)]
+        wait_for(lambda: all(c in network.tx_mock.call_args_list for c in boot_ups))
+        network.receive(0x000, b"\x01\x00")
+
+        # the RPDOs of the other nodes are enabled in both workers
+        wait_for(lambda: len(farm._routes.get(0x181, ())) == 2)
+        network.tx_mock.reset_mock()
+
+        # TPDO of node 1 is received by node 2 (same worker) and 3, 4 (other worker)
+        network.receive(0x080, b"")
+
+        responses = [call(0x180 + node_id, b"\x01") for node_id in range(1, 5)]
+        wait_for(lambda: all(c in network.tx_mock.call_args_list for c in responses))
@@ -0,0 +1,199 @@
+""" Testing the python-can based network """
+from unittest.mock import Mock, call
+
+import can
+import pytest
+
+from durand import CANBusNetwork, Node, set_scheduler
+from durand.network import NodeListener, TxClass
+from durand.scheduler import VirtualScheduler
+
+
+@pytest.fixture
+def bus():
+    bus = can.Bus(interface="virtual", channel="test_network")
+    bus.set_filters = Mock(wraps=bus.set_filters)
+    yield bus
+    bus.shutdown()
+
+
+def test_update_subscriptions(bus):
+    network = CANBusNetwork(bus)
+    callback = Mock()
+
+    network.update_subscriptions(add={0x181: callback, 0x182: callback})
+    assert bus.set_filters.call_count == 1
+
+    network.update_subscriptions(add={0x183: callback}, remove=[0x181, 0x182])
+    assert bus.set_filters.call_count == 2
+    assert set(network.subscriptions) == {0x183}
+
+    network.stop()
+
+
+def test_subscription_transaction(bus):
+    network = CANBusNetwork(bus)
+    node = Node(network, node_id=2)
+
+    for rpdo in node.rpdo[:8]:
+        rpdo.mapping = [(0x1000, 0)]
+        rpdo.enable = True
+
+    bus.set_filters.reset_mock()
+
+    # NMT start is subscribing all RPDOs with a single filter update
+    node.nmt.set_state(5)
+    assert bus.set_filters.call_count == 1
+    assert 0x202 in network.subscriptions
+
+    # nested transactions update the filters when the outermost one is left
+    with network.subscription_transaction():
+        with network.subscription_transaction():
+            node.nmt.set_state(127)
+
+        assert bus.set_filters.call_count == 1
+
+    assert bus.set_filters.call_count == 2
+    assert 0x202 not in network.subscriptions
+
+    network.stop()
+
+
+def test_tx_queue(bus):
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = CANBusNetwork(bus)
+    sent = []
+
+    def send(msg, timeout=None):
+        if bus_full:
+            raise can.CanOperationError("Transmit buffer full")
+        sent.append((msg.arbitration_id, bytes(msg.data)))
+
+    bus.send = send
+    bus_full = True
+
+    # SDO block segments, NMT and TPDOs while the driver queue is full
+    for sequence in range(1, 4):
+        network.send(0x582, bytes((sequence,)))
+    network.send(0x182, b"\x01")
+    network.send(0x000, b"\x01\x00")
+    network.send(0x182, b"\x02")  # replaces the queued TPDO
+    network.send(0x181, b"\x03")
+
+    scheduler.run(0.01)
+    assert sent == []
+
+    # the queue is sent in order of the COB-IDs after the bus recovered
+    bus_full = False
+    scheduler.run(1)
+
+    assert sent == [
+        (0x000, b"\x01\x00"),
+        (0x181, b"\x03"),
+        (0x182, b"\x02"),
+        (0x582, b"\x01"),
+        (0x582, b"\x02"),
+        (0x582, b"\x03"),
+    ]
+
+    # frames are sent directly while the bus accepts them
+    network.send(0x582, b"\x04")
+    assert sent[-1] == (0x582, b"\x04")
+
+    network.stop()
+
+
+def test_tx_retry_not_scheduled(bus):
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = CANBusNetwork(bus)
+    sent = []
+
+    def send(msg, timeout=None):
+        if bus_full:
+            raise can.CanOperationError("Transmit buffer full")
+        sent.append((msg.arbitration_id, bytes(msg.data)))
+
+    bus.send = send
+    bus_full = True
+
+    scheduler_add = scheduler.add
+    scheduler.add = Mock(side_effect=RuntimeError("Scheduler not running"))
+
+    network.send(0x582, b"\x01")
+    assert sent == []
+
+    # the queue is sent with the next frame
+    scheduler.add = scheduler_add
+    bus_full = False
+    network.send(0x582, b"\x02")
+
+    assert sent == [(0x582, b"\x01"), (0x582, b"\x02")]
+
+    network.stop()
+
+
+def test_tx_quota(bus):
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = CANBusNetwork(bus)
+    network.tx_quotas[TxClass.SDO] = 2
+    bus.send = Mock(side_effect=can.CanOperationError("Bus off"))
+
+    for sequence in range(4):
+        network.send(0x582, bytes((sequence,)))
+
+    assert network.tx_dropped == 2  # the quota includes the frame to be retried
+
+    network.stop()
+
+
+def test_batch_receive(bus):
+    network = CANBusNetwork(bus, batch_receive=True)
+    network.latest_only_cob_ids.add(0x202)
+
+    rpdo_mock, sdo_mock = Mock(), Mock()
+    network.update_subscriptions(add={0x202: rpdo_mock, 0x602: sdo_mock})
+
+    frames = [
+        can.Message(arbitration_id=0x202, data=b"\x01", is_extended_id=False),
+        can.Message(arbitration_id=0x602, data=b"\x02", is_extended_id=False),
+        can.Message(arbitration_id=0x202, data=b"\x03", is_extended_id=False),
+        can.Message(arbitration_id=0x602, data=b"\x04", is_extended_id=False),
+        can.Message(arbitration_id=0x202, data=b"\x05", is_extended_id=False),
+    ]
+
+    # the frames following the first one are read from the bus
+    listener = NodeListener(network, Mock(recv=Mock(side_effect=frames[1:] + [None])))
+    listener.on_message_received(frames[0])
+
+    # only the newest RPDO is processed, other frames are processed in order
+    rpdo_mock.assert_called_once_with(0x202, b"\x05")
+    assert sdo_mock.call_args_list == [call(0x602, b"\x02"), call(0x602, b"\x04")]
+
+    network.stop()
+
+
+def test_fd(bus):
+    network = CANBusNetwork(bus, fd=True)
+    receiver = can.Bus(interface="virtual", channel="test_network")
+
+    network.send(0x182, bytes(range(12)))
+    msg = receiver.recv(1)
+    assert msg.is_fd and msg.bitrate_switch and msg.data == bytes(range(12))
+
+    # received CAN FD frames are processed
+    callback = Mock()
+    listener = NodeListener(network)
+    network.add_subscription(0x202, callback)
+    listener.on_message_received(
+        can.Message(arbitration_id=0x202, data=bytes(16), is_fd=True)
+    )
+    callback.assert_called_once_with(0x202, bytes(16))
+
+    receiver.shutdown()
+    network.stop()
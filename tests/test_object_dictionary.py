@@ -43,4 +43,28 @@ def test_access_of_unknown_variable():
         node.object_dictionary.write(0x2000, 0, 5)
 
     with pytest.raises(KeyError):
-        node.object_dictionary.read(0x2000, 0)
\ No newline at end of file
+        node.object_dictionary.read(0x2000, 0)
+
+def test_write_many():
+    node = Node(MockNetwork(), node_id=2)
+    od = node.object_dictionary
+    od[0x2000] = Variable(DT.INTEGER16, "rw")
+    od[0x2001] = Variable(DT.INTEGER16, "rw", minimum=0)
+
+    calls = []
+    od.update_callbacks[(0x2000, 0)].add(lambda v: calls.append((0x2000, v)))
+    od.update_callbacks[(0x2001, 0)].add(lambda v: calls.append((0x2001, v)))
+
+    od.write_many([(0x2000, 0, 1), (0x2001, 0, 2), (0x2000, 0, 3)])
+
+    # callbacks are called once per object with the last value
+    assert calls == [(0x2001, 2), (0x2000, 3)]
+
+    # values written before a failing write are stored and announced
+    calls.clear()
+
+    with pytest.raises(ValueError):
+        od.write_many([(0x2000, 0, 4), (0x2001, 0, -1), (0x2000, 0, 5)])
+
+    assert calls == [(0x2000, 4)]
+    assert od.read(0x2001, 0) == 2
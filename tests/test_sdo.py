@@ -1,14 +1,25 @@
 from unittest.mock import Mock, call
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import struct
+import threading
 from binascii import crc_hqx
 
 import pytest
 
-from durand import Node, Variable, Record
+from durand import Node, Variable, Record, set_scheduler
+from durand.scheduler import VirtualScheduler
 from durand.datatypes import DatatypeEnum as DT
 from durand.datatypes import struct_dict
 from durand.services.sdo.server import SDO_STRUCT
-from durand.services.sdo import BaseUploadHandler
+from durand.services.sdo import (
+    BaseUploadHandler,
+    FileUploadHandler,
+    FileDownloadHandler,
+)
+from durand.services.sdo.upload import HandlerStream
+from durand.services.sdo.download import DownloadBuffer
+from durand.services.nmt import StateEnum
 
 from .mock_network import MockNetwork
 
@@ -421,6 +432,78 @@ def test_sdo_download_segmented_handler():
     handler_mock.on_abort.assert_called_once_with()
 
 
+def test_sdo_download_handler_executor():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+
+    release_handler = threading.Event()
+    handler_mock = Mock()
+    handler_mock.on_receive.side_effect = lambda data: release_handler.wait(1)
+
+    n.sdo_servers[0].download_manager.set_handler_callback(
+        lambda node, index, subindex, size: handler_mock
+    )
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        n.sdo_servers[0].set_executor(executor)
+
+        network.receive(0x602, build_sdo_packet(cs=1, index=0x2000))
+        network.receive(0x602, b"\x0D\x11" + bytes(6))
+
+        # other services are processed while the handler is blocking
+        network.receive(0, b"\x01\x02")
+        assert n.nmt.state == StateEnum.OPERATIONAL
+
+        release_handler.set()
+
+    handler_mock.on_receive.assert_called_once_with(b"\x11")
+    handler_mock.on_finish.assert_called_once_with()
+
+    network.tx_mock.assert_has_calls(
+        [call(0x582, build_sdo_packet(3, 0x2000)), call(0x582, b"\x20" + bytes(7))]
+    )
+
+
+def test_sdo_concurrent_servers():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+
+    n.sdo_servers[1].cob_rx = 0x640
+    n.sdo_servers[1].cob_tx = 0x5C0
+
+    # both handlers have to be called at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=2)
+
+    def handler_callback(node, index, subindex, size):
+        barrier.wait()
+        return Mock()
+
+    for server in n.sdo_servers[:2]:
+        server.download_manager.set_handler_callback(handler_callback)
+
+    network.tx_mock.reset_mock()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        n.sdo_dispatcher.set_executor(executor)
+
+        network.receive(0x602, build_sdo_packet(cs=1, index=0x2000))
+        network.receive(0x640, build_sdo_packet(cs=1, index=0x2000))
+
+    assert not barrier.broken
+
+    network.tx_mock.assert_has_calls(
+        [
+            call(0x582, build_sdo_packet(3, 0x2000)),
+            call(0x5C0, build_sdo_packet(3, 0x2000)),
+        ],
+        any_order=True,
+    )
+
+
 @pytest.mark.parametrize(
     "size", [1, 7, 8, 889, 890, 889 * 2, 889 * 2 + 1, 4096, 10_000]
 )
@@ -511,6 +594,110 @@ def test_sdo_download_block(size, crc, with_handler, with_size):
         assert n.object_dictionary.read(0x2000, 0) == b"\xAA" * size
 
 
+def test_sdo_download_small_domain():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+
+    update_mock = Mock()
+    n.object_dictionary.update_callbacks[(0x2000, 0)].add(update_mock)
+
+    network.receive(0x602, b"\x21\x00\x20\x00\x03\x00\x00\x00")  # segmented
+    network.receive(0x602, b"\x09ABC" + bytes(4))  # last segment with 3 bytes
+
+    update_mock.assert_called_once_with(b"ABC")
+    assert type(update_mock.call_args.args[0]) is bytes
+    assert type(n.object_dictionary.read(0x2000, 0)) is bytes
+
+
+@pytest.mark.parametrize("spill_threshold", [100, 0x100000])
+def test_sdo_download_block_buffer(monkeypatch, spill_threshold):
+    monkeypatch.setattr(DownloadBuffer, "SPILL_THRESHOLD", spill_threshold)
+
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+    data = bytes(range(200))
+
+    update_mock = Mock()
+    n.object_dictionary.update_callbacks[(0x2000, 0)].add(update_mock)
+
+    network.receive(0x602, b"\xC6\x00\x20\x00" + struct.pack("<I", len(data)))
+
+    segments = [data[i : i + 7] for i in range(0, len(data), 7)]
+
+    for sequence_number, segment in enumerate(segments, start=1):
+        cmd = sequence_number + ((sequence_number == len(segments)) << 7)
+        network.receive(0x602, bytes([cmd]) + segment + bytes(7 - len(segment)))
+
+    cmd = 0xC1 + ((7 - len(data) % 7) << 2)
+    crc = crc_hqx(data, 0)
+    network.receive(0x602, struct.pack("<BH", cmd, crc) + bytes(5))
+    network.tx_mock.assert_called_with(0x582, b"\xA1" + bytes(7))
+
+    value = update_mock.call_args.args[0]
+    assert value == data
+
+    # only spilled values are handed over as memoryview (without copy)
+    assert isinstance(value, memoryview if len(data) > spill_threshold else bytes)
+    assert isinstance(n.object_dictionary.read(0x2000, 0), type(value))
+
+    # sending more data than announced
+    network.receive(0x602, b"\x21\x00\x20\x00\x03\x00\x00\x00")
+    network.receive(0x602, b"\x00ABCDEFG")
+    network.tx_mock.assert_called_with(0x582, b"\x80\x00\x20\x00\x12\x00\x07\x06")
+
+
+def test_sdo_download_block_lost_segment():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+    data = bytes(range(200)) * 5
+
+    network.tx_mock.reset_mock()
+    network.receive(0x602, b"\xC2\x00\x20\x00" + struct.pack("<I", len(data)))
+    network.tx_mock.assert_called_once_with(0x582, b"\xA4\x00\x20\x00\x7F\x00\x00\x00")
+
+    segments = [data[i : i + 7] for i in range(0, len(data), 7)]
+
+    # segment 3 is lost, the following segments of the block are ignored
+    network.tx_mock.reset_mock()
+    for sequence_number in range(1, 128):
+        if sequence_number != 3:
+            segment = segments[sequence_number - 1]
+            network.receive(0x602, bytes([sequence_number]) + segment)
+
+    network.tx_mock.assert_called_once_with(
+        0x582, b"\xA2\x02\x3F" + bytes(5)
+    )  # acknowledge segment 2 and reduce block size to 63
+
+    segments = segments[2:]
+    block_size = 63
+
+    while segments:
+        block, segments = segments[:block_size], segments[block_size:]
+
+        network.tx_mock.reset_mock()
+        for sequence_number, segment in enumerate(block, start=1):
+            last = not segments and sequence_number == len(block)
+            cmd = sequence_number + (last << 7)
+            network.receive(0x602, bytes([cmd]) + segment + bytes(7 - len(segment)))
+
+        block_size += 8  # block size is increased again
+        network.tx_mock.assert_called_once_with(
+            0x582, b"\xA2" + bytes([len(block), block_size]) + bytes(5)
+        )
+
+    cmd = 0xC1 + ((7 - len(data) % 7) << 2)
+    network.receive(0x602, bytes([cmd]) + bytes(7))
+    network.tx_mock.assert_called_with(0x582, b"\xA1" + bytes(7))
+
+    assert n.object_dictionary.read(0x2000, 0) == data
+
+
 def test_sdo_block_failed():
     network = MockNetwork()
     n = Node(network, 0x02)
@@ -667,6 +854,33 @@ class UploadHandler(BaseUploadHandler):
         return response_data
 
 
+@pytest.mark.parametrize("read_ahead", [1, 16, 4096])
+def test_upload_handler_stream(read_ahead):
+    data = bytes(range(256)) * 40
+    handler = UploadHandler(data)
+    handler.on_read = Mock(wraps=handler.on_read)
+
+    stream = HandlerStream(handler, read_ahead=read_ahead)
+
+    assert stream.size == len(data)
+    assert stream.peek(3) == data[:3]
+
+    handler.on_read.assert_called_once_with(max(3, read_ahead))
+
+    received = b""
+
+    for size in itertools.cycle((7, 890, 1)):
+        assert stream.peek(size) == data[len(received) : len(received) + size]
+        chunk = stream.read(size)
+
+        if not chunk:
+            break
+
+        received += chunk
+
+    assert received == data
+
+
 @pytest.mark.parametrize("with_handler", [True, False])
 @pytest.mark.parametrize("size", [0, 1, 2, 6, 7, 8, 14, 100])
 @pytest.mark.parametrize("with_pst", [True, False])  # protocol switching threshold
@@ -869,3 +1083,196 @@ def test_block_upload_extended(size, blocksize, with_crc, with_handler, with_siz
     network.tx_mock.assert_called_with(
         0x582, struct.pack("<BH", cmd, crc) + bytes(5)
     )  # response to last block upload requst
+
+
+def test_sdo_transfer_timeout():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+
+    handler_mock = Mock()
+    n.sdo_servers[0].download_manager.set_handler_callback(
+        lambda node, index, subindex, size: handler_mock
+    )
+    n.sdo_servers[0].timeout = 1.0
+
+    network.receive(0x602, build_sdo_packet(cs=1, index=0x2000))
+    scheduler.run(0.8)
+
+    network.receive(0x602, b"\x00ABCDEFG")
+    assert len(scheduler._entry_dict) == 1  # requests are not restarting a timer
+    scheduler.run(0.8)
+
+    handler_mock.on_abort.assert_not_called()
+    network.tx_mock.reset_mock()
+
+    scheduler.run(0.4)
+
+    network.tx_mock.assert_called_once_with(
+        0x582, b"\x80\x00\x20\x00\x00\x00\x04\x05"
+    )  # abort with timeout
+    handler_mock.on_abort.assert_called_once_with()
+    assert not n.sdo_servers[0].download_manager.transfer_active
+
+    # finished transfers are not timing out
+    network.tx_mock.reset_mock()
+    network.receive(0x602, build_sdo_packet(cs=1, index=0x2000))
+    network.receive(0x602, b"\x0D\x10" + bytes(6))
+    scheduler.run(2)
+
+    network.tx_mock.assert_has_calls(
+        [call(0x582, build_sdo_packet(3, 0x2000)), call(0x582, b"\x20" + bytes(7))]
+    )
+    assert network.tx_mock.call_count == 2
+
+
+def test_sdo_transfer_timeout_executor():
+    scheduler = VirtualScheduler()
+    set_scheduler(scheduler)
+
+    main_thread = threading.current_thread()
+    add_threads = []
+    scheduler_add = scheduler.add
+
+    def add(*args, **kwargs):
+        add_threads.append(threading.current_thread())
+        return scheduler_add(*args, **kwargs)
+
+    scheduler.add = add
+
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+
+    handler_mock = Mock()
+    n.sdo_servers[0].download_manager.set_handler_callback(
+        lambda node, index, subindex, size: handler_mock
+    )
+    n.sdo_servers[0].timeout = 1.0
+
+    server = n.sdo_servers[0]
+    handle_request = server._handle_request
+    failures = [RuntimeError("failure")]
+
+    def failing_handle_request(msg):
+        if failures:
+            raise failures.pop()
+        handle_request(msg)
+
+    server._handle_request = failing_handle_request
+    network.tx_mock.reset_mock()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        server.set_executor(executor)
+
+        # a failing request is not stopping the processing of the next ones
+        network.receive(0x602, build_sdo_packet(cs=2, index=0x1000))
+        network.receive(0x602, build_sdo_packet(cs=1, index=0x2000))
+
+    network.tx_mock.assert_called_once_with(0x582, build_sdo_packet(3, 0x2000))
+
+    # the scheduler is only used in the receiving context
+    scheduler.run(1.5)
+    assert add_threads and all(thread is main_thread for thread in add_threads)
+
+    network.tx_mock.assert_called_with(
+        0x582, b"\x80\x00\x20\x00\x00\x00\x04\x05"
+    )  # abort with timeout
+    handler_mock.on_abort.assert_called_once_with()
+
+    # requests are processed in the receiving context when the executor is shut down
+    network.receive(0x602, build_sdo_packet(cs=2, index=0x1000))
+    network.tx_mock.assert_called_with(
+        0x582, build_sdo_packet(cs=2, index=0x1000, data=bytes(4))
+    )
+
+
+@pytest.mark.parametrize("size", [0, 5, 100, 5000])
+def test_file_upload_handler(tmp_path, size):
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    data = (b"ABC" * (size // 3 + 1))[:size]
+    path = tmp_path / "log.bin"
+    path.write_bytes(data)
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "ro")
+    n.sdo_servers[0].upload_manager.set_handler_callback(
+        lambda node, index, subindex: FileUploadHandler(str(path))
+    )
+
+    network.receive(0x602, b"\xA4\x00\x20\x00\x7F\x00\x00\x00")  # init block upload
+    network.tx_mock.assert_called_with(
+        0x582, b"\xC6\x00\x20\x00" + size.to_bytes(4, "little")
+    )
+
+    network.tx_mock.reset_mock()
+    network.receive(0x602, b"\xA3" + bytes(7))  # start upload
+
+    received = b""
+
+    while True:
+        segments = [c.args[1] for c in network.tx_mock.call_args_list]
+        network.tx_mock.reset_mock()
+
+        if segments[-1][0] & 0x80:
+            received += b"".join(segment[1:] for segment in segments)
+            break
+
+        received += b"".join(segment[1:] for segment in segments)
+        network.receive(0x602, b"\xA2\x7F\x7F" + bytes(5))  # acknowledge block
+
+    network.receive(0x602, b"\xA2" + bytes([len(segments)]) + b"\x7F" + bytes(5))
+    cmd = network.tx_mock.call_args.args[1][0]
+    received = received[: len(received) - ((cmd >> 2) & 0x07)]
+
+    assert received == data
+
+
+@pytest.mark.parametrize("with_size", [True, False])
+def test_file_download_handler(tmp_path, with_size):
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(b"old firmware")
+
+    n.object_dictionary[0x2000] = Variable(DT.DOMAIN, "rw")
+    n.sdo_servers[0].download_manager.set_handler_callback(
+        lambda node, index, subindex, size: FileDownloadHandler(
+            str(path), size, buffer_size=10
+        )
+    )
+
+    data = bytes(range(100))
+
+    # aborted transfer is keeping the original file
+    network.receive(0x602, b"\x21\x00\x20\x00" + len(data).to_bytes(4, "little"))
+    network.receive(0x602, b"\x00" + data[:7])
+    network.receive(0x602, b"\x80\x00\x20\x00\x00\x00\x00\x00")
+
+    assert path.read_bytes() == b"old firmware"
+    assert list(tmp_path.iterdir()) == [path]
+
+    # successful transfer is replacing the file
+    if with_size:
+        network.receive(0x602, b"\x21\x00\x20\x00" + len(data).to_bytes(4, "little"))
+    else:
+        network.receive(0x602, b"\x20\x00\x20\x00" + bytes(4))
+
+    toggle_bit = 0
+
+    for offset in range(0, len(data), 7):
+        segment = data[offset : offset + 7]
+        last = offset + 7 >= len(data)
+        cmd = (toggle_bit << 4) + ((7 - len(segment)) << 1) + last
+        network.receive(0x602, bytes([cmd]) + segment + bytes(7 - len(segment)))
+        toggle_bit ^= 1
+
+    assert path.read_bytes() == data
+    assert list(tmp_path.iterdir()) == [path]
@@ -203,3 +203,35 @@ def test_config_sdo_server(node_id, sdo_server):
     # sanity check to see if other sdo servers are affected
     assert n.sdo_servers[2].cob_rx is None
     assert n.sdo_servers[2].cob_tx is None
+
+
+def test_sdo_dispatcher():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    # only the default server is entered in the table
+    assert n.sdo_dispatcher.active_servers == 1
+    assert all(
+        server._download_manager is None and server._upload_manager is None
+        for server in n.sdo_servers
+    )
+
+    n.sdo_servers[5].cob_rx = 0x640
+    n.sdo_servers[5].cob_tx = 0x5C0
+    assert n.sdo_dispatcher.active_servers == 2
+
+    network.tx_mock.reset_mock()
+    network.receive(0x640, b"\x40\x00\x12\x00\x00\x00\x00\x00")
+    network.tx_mock.assert_called_once_with(0x5C0, b"\x4F\x00\x12\x00\x02\x00\x00\x00")
+
+    # managers are returned to the pool after the transfer
+    assert n.sdo_servers[5]._upload_manager is None
+
+    # stopping the node removes the subscriptions of all servers
+    network.receive(0, b"\x02\x02")
+    assert 0x602 not in network.subscriptions
+    assert 0x640 not in network.subscriptions
+
+    network.receive(0, b"\x80\x02")
+    assert 0x602 in network.subscriptions
+    assert 0x640 in network.subscriptions
@@ -0,0 +1,102 @@
+""" Testing process data shared with other processes """
+import multiprocessing
+
+import pytest
+
+pytest.importorskip("multiprocessing.shared_memory")  # available since Python 3.8
+
+from durand import Node, Variable
+from durand.datatypes import DatatypeEnum as DT
+from durand.shared_memory import SharedProcessData, SharedProcessDataClient
+
+from .mock_network import MockNetwork, TxMsg, RxMsg
+
+
+def worker(handle, barrier):
+    client = SharedProcessDataClient(handle)
+    client.write(0x2001, 0, client.read(0x2000, 0) * 2)
+    client.close()
+    barrier.wait()
+
+
+@pytest.fixture
+def node():
+    network = MockNetwork()
+    node = Node(network, node_id=2)
+    node.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw", value=5)
+    node.object_dictionary[0x2001] = Variable(DT.REAL32, "rw", value=0.0)
+    return node
+
+
+def test_shared_process_data(node):
+    network = node.network
+    od = node.object_dictionary
+
+    shared = SharedProcessData(od, [(0x2000, 0), (0x2001, 0)])
+    client = SharedProcessDataClient(shared.handle)
+
+    assert client.multiplexors == ((0x2000, 0), (0x2001, 0))
+    assert client.read(0x2000, 0) == 5
+
+    # values received via RPDO are available for the clients
+    node.rpdo[0].mapping = [(0x2000, 0)]
+    node.tpdo[0].mapping = [(0x2001, 0)]
+
+    network.test(
+        [   TxMsg(0x702, "00"),  # boot-up message from NMT
+
+            RxMsg(0x000, "01 00"),  # set Operational state
+            TxMsg(0x182, "00 00 00 00"),
+            RxMsg(0x202, "07 00")  # receive the RPDO
+        ]
+    )
+
+    assert client.read(0x2000, 0) == 7
+
+    # values written by clients are transmitted when processed by the node
+    client.write(0x2001, 0, 1.5)
+    client.write(0x2001, 0, 2.5)
+    network.test([])
+
+    shared.process_changes()
+    assert od.read(0x2001, 0) == 2.5
+    network.test([TxMsg(0x182, "00 00 20 40")])
+
+    client.close()
+    shared.close()
+
+
+def test_shared_process_data_dead_writer(node, caplog):
+    shared = SharedProcessData(node.object_dictionary, [(0x2000, 0), (0x2001, 0)])
+    client = SharedProcessDataClient(shared.handle)
+
+    # a writer stopped between incrementing the sequence and writing the value
+    offset = client._offset(0)
+    client._buf[offset] |= 1
+
+    assert client.read(0x2000, 0) == 5
+    assert "not finishing" in caplog.text
+
+    client.close()
+    shared.close()
+
+
+def test_shared_process_data_processes(node):
+    shared = SharedProcessData(node.object_dictionary, [(0x2000, 0), (0x2001, 0)])
+
+    context = multiprocessing.get_context()
+    barrier = context.Barrier(2)
+    process = context.Process(target=worker, args=(shared.handle, barrier))
+    process.start()
+    barrier.wait(timeout=10)
+    process.join(timeout=10)
+
+    shared.process_changes()
+    assert node.object_dictionary.read(0x2001, 0) == 10.0
+
+    shared.close()
+
+
+def test_shared_process_data_numeric_only(node):
+    with pytest.raises(ValueError):
+        SharedProcessData(node.object_dictionary, [(0x1008, 0)])
@@ -0,0 +1,100 @@
+""" Testing store and restore of parameters (objects 0x1010 and 0x1011) """
+import struct
+
+from durand import Node, Variable
+from durand.datatypes import DatatypeEnum as DT
+
+from .mock_network import MockNetwork
+
+
+def write_signature(network: MockNetwork, index: int, signature: bytes):
+    """Expedited download of the signature to sub 1 and return the response"""
+    network.tx_mock.reset_mock()
+    network.receive(0x602, b"\x23" + struct.pack("<HB", index, 1) + signature)
+    return network.tx_mock.call_args[0]
+
+
+def test_store_parameters(tmp_path):
+    path = str(tmp_path / "parameters.bin")
+
+    network = MockNetwork()
+    n = Node(network, 0x02, storage_path=path)
+    n.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw")
+
+    assert n.object_dictionary.read(0x1010, 1) == 1  # saving on command
+
+    n.object_dictionary.write(0x1800, 1, 0x8000_0182)
+    n.object_dictionary.write(0x1A00, 0, 0)
+    n.object_dictionary.write(0x1A00, 1, 0x2000_0010)
+    n.object_dictionary.write(0x1A00, 0, 1)
+    n.object_dictionary.write(0x1800, 1, 0x282)
+    n.object_dictionary.write(0x2000, 0, -7)
+
+    # wrong signature
+    cob_id, response = write_signature(network, 0x1010, b"evas")
+    assert cob_id == 0x582 and response[0] == 0x80
+
+    assert write_signature(network, 0x1010, b"save") == (
+        0x582,
+        b"\x60\x10\x10\x01\x00\x00\x00\x00",
+    )
+
+    # a new node is started with the stored parameters
+    n = Node(MockNetwork(), 0x02, storage_path=path)
+    assert n.object_dictionary.read(0x1800, 1) == 0x282
+    assert n.tpdo[0].mapping == ((0x2000, 0),)
+
+    # values of objects added after creating the node are written when added
+    n.object_dictionary[0x2000] = Variable(DT.INTEGER16, "rw")
+    assert n.object_dictionary.read(0x2000, 0) == -7
+
+    # restoring the defaults removes the stored parameters
+    network = MockNetwork()
+    n = Node(network, 0x02, storage_path=path)
+    assert write_signature(network, 0x1011, b"load")[1][0] == 0x60
+
+    n = Node(MockNetwork(), 0x02, storage_path=path)
+    assert n.object_dictionary.read(0x1800, 1) == 0x4000_0182
+
+
+def test_store_parameters_corrupted(tmp_path):
+    path = tmp_path / "parameters.bin"
+
+    n = Node(MockNetwork(), 0x02, storage_path=str(path))
+    n.object_dictionary.write(0x1800, 1, 0x282)
+    n.parameter_storage.save()
+
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(data)
+
+    n = Node(MockNetwork(), 0x02, storage_path=str(path))
+    assert n.object_dictionary.read(0x1800, 1) == 0x4000_0182
+
+
+def test_store_parameters_invalid_entry(tmp_path):
+    path = str(tmp_path / "parameters.bin")
+
+    n = Node(MockNetwork(fd=True), 0x02, storage_path=path)
+    n.object_dictionary[0x2000] = Variable(DT.UNSIGNED64, "rw")
+
+    n.tpdo[0].mapping = [(0x2000, 0), (0x2000, 0)]  # exceeding a classic frame
+    n.tpdo[1].mapping = [(0x1001, 0)]
+    n.object_dictionary.write(0x1801, 1, 0x282)
+    n.parameter_storage.save()
+
+    # the mapping is skipped on a classic network, the other values are restored
+    n = Node(MockNetwork(), 0x02, storage_path=path)
+    assert n.tpdo[0].mapping == ()
+    assert n.tpdo[1].mapping == ((0x1001, 0),)
+    assert n.object_dictionary.read(0x1801, 1) == 0x282
+
+
+def test_store_parameters_not_supported():
+    network = MockNetwork()
+    n = Node(network, 0x02)
+
+    assert n.object_dictionary.read(0x1010, 1) == 0
+
+    cob_id, response = write_signature(network, 0x1010, b"save")
+    assert cob_id == 0x582 and response[0] == 0x80